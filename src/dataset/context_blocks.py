@@ -0,0 +1,229 @@
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+from transformers import AutoTokenizer
+
+
+CONTEXT_HEADER = "\n\nRelevant ETF Information:\n"
+BLOCK_SEPARATOR = "\n\n"
+CONTEXT_FOOTER = ".\n"
+
+SYSTEM_PLACEHOLDER = "\x00CONTEXT\x00"
+USER_PLACEHOLDER = "\x00USER\x00"
+
+
+def render_snippet(etf, ticker_field='ticker', name_field='etf_name', description_field='description'):
+    """Context snippet of one ETF as the chat frontends put it into the system prompt."""
+    return f"{etf[ticker_field]} - {etf[name_field]}\n{etf[description_field]}"
+
+
+def _flatten(sequences, dtype):
+    """Concatenation of `sequences` and the offsets of each one (plus the total length at the end)."""
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(sequence) for sequence in sequences])
+    return np.fromiter((x for sequence in sequences for x in sequence), dtype=dtype, count=offsets[-1]), offsets
+
+
+def blocks_version(keys, texts, tokenizer):
+    """Hash of everything the blocks are derived from: tokenizer, keys and rendered snippets."""
+    sha = hashlib.sha1()
+    sha.update(f"{tokenizer.name_or_path}|{len(tokenizer)}|{BLOCK_SEPARATOR!r}".encode('utf-8'))
+    for key, text in zip(keys, texts):
+        sha.update(f"\x00{key}\x00{text}".encode('utf-8'))
+    return sha.hexdigest()
+
+
+class ContextBlocks:
+    """
+    Rendered ETF context snippets and their token IDs, keyed by ticker.
+
+    Every block is tokenized together with the separator that follows it in the prompt:
+    the pre-tokenizer merges punctuation with the newlines after it (`.` + `\\n\\n` is one
+    `.\\n\\n` piece), so tokenizing the two apart would not give the template's IDs. A block
+    always starts after a newline, where no piece crosses the boundary.
+
+    Token IDs and UTF-8 bytes of the snippets live in flat arrays with offsets, so the
+    whole table is a handful of arrays on disk (`.npz`) and in memory.
+
+    Args:
+        keys (list): Ticker of every block.
+        text_bytes (np.ndarray): Concatenated UTF-8 bytes of the rendered snippets.
+        text_offsets (np.ndarray): Start of every snippet in `text_bytes`, plus the total length at the end.
+        tokens (np.ndarray): Concatenated token IDs of snippet + `BLOCK_SEPARATOR`.
+        offsets (np.ndarray): Start of every block in `tokens`, plus the total length at the end.
+        version (str): `blocks_version` of the inputs the blocks were built from.
+    """
+
+    def __init__(self, keys, text_bytes, text_offsets, tokens, offsets, version=None):
+        self.keys = list(keys)
+        self.text_bytes = text_bytes
+        self.text_offsets = text_offsets
+        self.tokens = tokens
+        self.offsets = offsets
+        self.version = version
+        self.positions = {key: i for i, key in enumerate(self.keys)}
+
+    @classmethod
+    def build(cls, etf_data, tokenizer, key_field='ticker', **fields):
+        keys = [etf[key_field] for etf in etf_data]
+        texts = [render_snippet(etf, **fields) for etf in etf_data]
+        encoded = tokenizer([text + BLOCK_SEPARATOR for text in texts], add_special_tokens=False)['input_ids']
+        tokens, offsets = _flatten(encoded, np.int32)
+        text_bytes, text_offsets = _flatten([text.encode('utf-8') for text in texts], np.uint8)
+        return cls(keys, text_bytes, text_offsets, tokens, offsets, blocks_version(keys, texts, tokenizer))
+
+    def save(self, path):
+        np.savez(path, keys=np.array(self.keys), text_bytes=self.text_bytes, text_offsets=self.text_offsets,
+                 tokens=self.tokens, offsets=self.offsets, version=np.array(self.version or ''))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        if 'version' not in data:
+            raise ValueError(f"{path} predates versioned context blocks")
+        return cls(data['keys'].tolist(), data['text_bytes'], data['text_offsets'], data['tokens'],
+                   data['offsets'], str(data['version']) or None)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def text(self, key):
+        position = self.positions[key]
+        return self.text_bytes[self.text_offsets[position]:self.text_offsets[position + 1]].tobytes().decode('utf-8')
+
+    def token_ids(self, key):
+        """Token IDs of the block followed by `BLOCK_SEPARATOR`."""
+        position = self.positions[key]
+        return self.tokens[self.offsets[position]:self.offsets[position + 1]]
+
+
+class PromptAssembler:
+    """
+    Builds chat-template input IDs from cached token segments instead of re-tokenizing the prompt.
+
+    The chat template is rendered once around placeholders and its static pieces are
+    tokenized once. A request then only tokenizes the user message; the ETF context is
+    spliced in from `ContextBlocks`. The last block is not followed by the separator but
+    by the context footer, which the pre-tokenizer can merge with its end (`.` + `.\\n`
+    is one `..\\n` piece), so it is tokenized together with the footer, once per ticker.
+    Likewise the newline closing the user header (`user\\n`) merges with newlines the
+    message starts with, so it is tokenized together with the user message. The remaining
+    boundaries sit before a special token, after a block separator or between a word and
+    a newline, so the result is the same as `apply_chat_template` on the full text.
+
+    Args:
+        tokenizer: Chat tokenizer with a chat template.
+        blocks (ContextBlocks): Pre-tokenized ETF snippets.
+        system_prompt (str): Constant system message the ETF context is appended to.
+        context_footer (str): Text closing the ETF context inside the system message.
+    """
+
+    def __init__(self, tokenizer, blocks, system_prompt, context_footer=CONTEXT_FOOTER):
+        self.tokenizer = tokenizer
+        self.blocks = blocks
+        self.system_prompt = system_prompt
+
+        rendered = tokenizer.apply_chat_template(
+            [{"role": "system", "content": system_prompt + SYSTEM_PLACEHOLDER},
+             {"role": "user", "content": USER_PLACEHOLDER}],
+            tokenize=False, add_generation_prompt=True,
+        )
+        head, rest = rendered.split(SYSTEM_PLACEHOLDER)
+        middle, tail = rest.split(USER_PLACEHOLDER)
+
+        encode = lambda text: np.array(tokenizer.encode(text, add_special_tokens=False), dtype=np.int32)
+        # without retrieved ETFs the system prompt ends right before `middle`
+        self.encode = encode
+        self.plain_head = encode(head)
+        self.head = encode(head + CONTEXT_HEADER)
+        self.context_footer = context_footer
+        # "\n\n" opening a message would be one piece with the header's "\n", keep them together
+        stripped = middle.rstrip('\r\n')
+        self.user_prefix = middle[len(stripped):]
+        self.middle = encode(stripped)
+        self.tail = encode(tail)
+        self.closing = {}
+
+    def context_text(self, keys):
+        return BLOCK_SEPARATOR.join(self.blocks.text(key) for key in keys)
+
+    def closing_ids(self, key):
+        """Token IDs of the last block of the context together with the footer."""
+        ids = self.closing.get(key)
+        if ids is None:
+            ids = self.closing[key] = self.encode(self.blocks.text(key) + self.context_footer)
+        return ids
+
+    def context_segments(self, keys):
+        return [self.blocks.token_ids(key) for key in keys[:-1]] + [self.closing_ids(keys[-1])]
+
+    def system_ids(self):
+        """(T,) token IDs up to the user message without ETF context, the same for every request."""
+        return torch.from_numpy(np.concatenate([self.plain_head, self.middle]).astype(np.int64))
+
+    def prefix_length(self, keys=()):
+        """Number of leading `input_ids` tokens that do not depend on the user message."""
+        if not keys:
+            return len(self.plain_head) + len(self.middle)
+        return len(self.head) + sum(len(segment) for segment in self.context_segments(keys)) + len(self.middle)
+
+    def input_ids(self, user_input, keys=()):
+        """
+        Token IDs of `apply_chat_template` on the system prompt (plus ETF context) and user turn.
+
+        Args:
+            user_input (str): User message.
+            keys (list): Tickers whose context blocks go into the system prompt.
+
+        Returns:
+            torch.Tensor: (1, seq_len) input IDs.
+        """
+        segments = [self.head] + self.context_segments(keys) if keys else [self.plain_head]
+        segments.append(self.middle)
+        segments.append(self.encode(self.user_prefix + user_input))
+        segments.append(self.tail)
+        return torch.from_numpy(np.concatenate(segments).astype(np.int64))[None]
+
+
+def load_or_build(path, etf_data, tokenizer, key_field='ticker', **fields):
+    """
+    Load context blocks from `path`, (re)building and saving them first if the file is
+    missing or was built from another version of the ETF data or another tokenizer.
+    """
+    keys = [etf[key_field] for etf in etf_data]
+    version = blocks_version(keys, [render_snippet(etf, **fields) for etf in etf_data], tokenizer)
+    if os.path.exists(path):
+        try:
+            blocks = ContextBlocks.load(path)
+        except (OSError, ValueError, KeyError):
+            blocks = None
+        if blocks is not None and blocks.version == version:
+            return blocks
+    blocks = ContextBlocks.build(etf_data, tokenizer, key_field=key_field, **fields)
+    blocks.save(path)
+    return blocks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render and pre-tokenize ETF context blocks for prompt assembly")
+    parser.add_argument("etf_data_file", help="ETF data JSON (etf_data_v3_clean.json schema)")
+    parser.add_argument("output_file", help="Output .npz file")
+    parser.add_argument("--model-name", default="FINGU-AI/FinguAI-Chat-v1", help="Tokenizer to use")
+    parser.add_argument("--key-field", default="bbg_ticker", help="ETF field used as block key")
+    args = parser.parse_args()
+
+    with open(args.etf_data_file, 'r') as file:
+        etf_data = json.load(file)
+    tokenizer = AutoTokenizer.from_pretrained(args.model_name)
+
+    blocks = ContextBlocks.build(etf_data, tokenizer, key_field=args.key_field)
+    blocks.save(args.output_file)
+    print(f"Saved {len(blocks.keys)} context blocks, {len(blocks.tokens)} tokens, to {args.output_file}")
+
+
+if __name__ == '__main__':
+    main()
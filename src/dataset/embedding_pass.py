@@ -0,0 +1,85 @@
+import time
+
+import numpy as np
+import torch
+
+
+def length_buckets(lengths, max_tokens=65536, max_batch_size=512):
+    """
+    Group sequence positions into batches of similar length.
+
+    Positions are sorted by token length and cut greedily so that the padded size of a
+    batch (batch size * longest sequence in it) stays within `max_tokens`.
+
+    Args:
+        lengths (list): Token count of every sequence.
+        max_tokens (int): Budget of padded tokens per batch.
+        max_batch_size (int): Hard cap on sequences per batch.
+
+    Returns:
+        list: Batches as int arrays of original positions.
+    """
+    order = np.argsort(lengths, kind='stable')
+    batches = []
+    start = 0
+    for end in range(1, len(order) + 1):
+        # order is ascending, so the last element is the longest of the batch
+        too_big = end - start > max_batch_size or (end - start) * lengths[order[end - 1]] > max_tokens
+        if too_big and end - 1 > start:
+            batches.append(order[start:end - 1])
+            start = end - 1
+    if start < len(order):
+        batches.append(order[start:])
+    return batches
+
+
+def bucketed_embed(texts, tokenizer, encode_fn, device='cpu', out=None, max_tokens=65536, max_batch_size=512,
+                   max_length=None, verbose=True):
+    """
+    Embed texts in length-sorted batches, writing vectors into `out` in the original order.
+
+    Args:
+        texts (list): Texts to embed.
+        tokenizer: Hugging Face tokenizer used by the encoder.
+        encode_fn (callable): Called as `encode_fn(input_ids=..., attention_mask=...)`, returns (batch, d).
+        device: Device the token tensors are moved to.
+        out (np.ndarray): Preallocated (len(texts), d) array, e.g. a memmap; allocated from the first batch if None.
+        max_tokens (int): Budget of padded tokens per batch.
+        max_batch_size (int): Hard cap on sequences per batch.
+        max_length (int): Truncation length, defaults to the tokenizer's model_max_length.
+        verbose (bool): Print throughput when done.
+
+    Returns:
+        tuple: (out, stats) where stats holds real/padded token counts, seconds and tokens/s.
+    """
+    encoded = tokenizer(list(texts), truncation=True, max_length=max_length)['input_ids']
+    lengths = np.array([len(ids) for ids in encoded])
+
+    real_tokens = int(lengths.sum())
+    padded_tokens = 0
+    start = time.perf_counter()
+
+    for positions in length_buckets(lengths, max_tokens=max_tokens, max_batch_size=max_batch_size):
+        batch = tokenizer.pad({'input_ids': [encoded[i] for i in positions]}, return_tensors='pt')
+        padded_tokens += batch['input_ids'].numel()
+
+        with torch.no_grad():
+            embeddings = encode_fn(**batch.to(device))
+        embeddings = embeddings.float().cpu().numpy()
+
+        if out is None:
+            out = np.empty((len(texts), embeddings.shape[1]), dtype=np.float32)
+        out[positions] = embeddings
+
+    seconds = time.perf_counter() - start
+    stats = {
+        'sequences': len(texts),
+        'real_tokens': real_tokens,
+        'padded_tokens': padded_tokens,
+        'seconds': seconds,
+        'tokens_per_s': real_tokens / seconds if seconds > 0 else float('inf'),
+    }
+    if verbose:
+        print(f"Embedded {len(texts)} texts, {real_tokens} tokens ({padded_tokens} padded) "
+              f"in {seconds:.1f}s: {stats['tokens_per_s']:.0f} tokens/s")
+    return out, stats
@@ -0,0 +1,172 @@
+import json
+import os
+from contextlib import contextmanager
+
+import numpy as np
+import faiss
+
+
+TICKERS_SUFFIX = '.tickers.json'
+
+
+def tickers_path(path):
+    return path + TICKERS_SUFFIX
+
+
+@contextmanager
+def replacing(path):
+    """
+    Yield a temporary path next to `path` that is renamed over `path` once the block finishes.
+
+    Files read through mmap (`EmbeddingStore`, `read_index_shared`) must never be rewritten
+    in place: truncating them kills the serving process with SIGBUS. A rename leaves the old
+    inode mapped until its readers reopen, e.g. on `Retriever.refresh`.
+    """
+    partial = f"{path}.{os.getpid()}.partial"
+    try:
+        yield partial
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.replace(partial, path)
+
+
+def write_index(index, index_path):
+    """`faiss.write_index` through a rename, safe while `index_path` is memory-mapped by a reader."""
+    with replacing(index_path) as partial:
+        faiss.write_index(index, partial)
+
+
+def create_store(path, num_rows, dimension, tickers, dtype=np.float16):
+    """
+    Allocate an on-disk embedding matrix and return it as a writable memmap.
+
+    The file is a plain `.npy` (its header holds dtype and shape), so it can be filled
+    row by row, e.g. as the `out` array of `bucketed_embed`, without holding the matrix in RAM.
+
+    Args:
+        path (str): Target `.npy` file.
+        num_rows (int): Number of embeddings.
+        dimension (int): Embedding dimension.
+        tickers (list): Ticker of every row, written to the `.tickers.json` sidecar.
+        dtype: np.float16 (half the size) or np.float32.
+
+    Returns:
+        np.memmap: Writable (num_rows, dimension) array; call `.flush()` when done.
+
+    Writes `path` in place, so only use it on a fresh path; `write_store` replaces a live store.
+    """
+    if len(tickers) != num_rows:
+        raise ValueError(f"Got {len(tickers)} tickers for {num_rows} rows")
+    with open(tickers_path(path), 'w') as file:
+        json.dump(list(tickers), file)
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(num_rows, dimension))
+
+
+def write_store(path, embeddings, tickers, dtype=np.float16):
+    """Write a whole embedding matrix and its ticker sidecar in one go, replacing any previous store."""
+    with replacing(path) as partial:
+        out = create_store(partial, len(embeddings), embeddings.shape[1], tickers, dtype=dtype)
+        out[:] = embeddings
+        out.flush()
+        del out
+        os.replace(tickers_path(partial), tickers_path(path))
+
+
+class EmbeddingStore:
+    """
+    Read-only, memory-mapped view of an embedding matrix written by `create_store`/`write_store`.
+
+    Opening is zero-copy: the OS page cache holds the vectors once, however many
+    processes (e.g. Gradio workers) map the same file.
+
+    Args:
+        path (str): `.npy` file of the store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.vectors = np.load(path, mmap_mode='r')
+        with open(tickers_path(path), 'r') as file:
+            self.tickers = json.load(file)
+        self.rows = {ticker: row for row, ticker in enumerate(self.tickers)}
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def dimension(self):
+        return self.vectors.shape[1]
+
+    def rows_for(self, tickers):
+        return np.array([self.rows[ticker] for ticker in tickers], dtype=np.int64)
+
+    def get(self, tickers):
+        """float32 vectors of the given tickers; only these rows are read and copied."""
+        return np.asarray(self.vectors[self.rows_for(tickers)], dtype=np.float32)
+
+    def chunks(self, chunk_rows=65536):
+        """Yield (start_row, float32 block) so a consumer never materializes the full matrix."""
+        for start in range(0, len(self), chunk_rows):
+            yield start, np.asarray(self.vectors[start:start + chunk_rows], dtype=np.float32)
+
+    def search(self, queries, k, metric='ip', chunk_rows=65536):
+        """
+        Exact k-NN straight over the memmap, one chunk at a time.
+
+        Args:
+            queries (np.ndarray): (nq, d) query vectors.
+            k (int): Neighbours per query.
+            metric (str): 'ip' or 'l2'.
+            chunk_rows (int): Rows converted to float32 at a time.
+
+        Returns:
+            tuple: (scores, rows) arrays of shape (nq, k), best first.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        faiss_metric = faiss.METRIC_INNER_PRODUCT if metric == 'ip' else faiss.METRIC_L2
+        best_scores, best_rows = None, None
+        for start, block in self.chunks(chunk_rows):
+            scores, rows = faiss.knn(queries, block, min(k, len(block)), metric=faiss_metric)
+            rows = rows + start
+            if best_scores is None:
+                best_scores, best_rows = scores, rows
+                continue
+            scores = np.hstack([best_scores, scores])
+            rows = np.hstack([best_rows, rows])
+            order = np.argsort(-scores if metric == 'ip' else scores, axis=1, kind='stable')[:, :k]
+            best_scores = np.take_along_axis(scores, order, axis=1)
+            best_rows = np.take_along_axis(rows, order, axis=1)
+        return best_scores, best_rows
+
+    def add_to_index(self, index, chunk_rows=65536):
+        """Fill a FAISS index from the store in bounded-memory chunks; rows become the IDs."""
+        for start, block in self.chunks(chunk_rows):
+            if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+                index.add_with_ids(block, np.arange(start, start + len(block), dtype=np.int64))
+            else:
+                index.add(block)
+        return index
+
+
+def read_index_shared(index_path):
+    """
+    Load a FAISS index with its vector storage memory-mapped instead of copied into RAM.
+
+    Falls back to a regular read for index types or FAISS versions without mmap support.
+    Anything that rewrites `index_path` must go through `write_index`, never in place.
+    """
+    flags = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    try:
+        return faiss.read_index(index_path, flags)
+    except RuntimeError:
+        return faiss.read_index(index_path)
+
+
+def load_embeddings(path):
+    """Open embeddings from either an `EmbeddingStore` `.npy` file or a legacy `torch.save` `.pth`."""
+    if os.path.splitext(path)[1] == '.npy':
+        return EmbeddingStore(path).vectors
+    import torch
+    return np.asarray(torch.load(path), dtype=np.float32)
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import faiss
+from faiss import read_index
+
+from src.dataset.embedding_store import replacing, write_index
+
+
+MANIFEST_SUFFIX = '.manifest.json'
+
+
+def content_hash(text):
+    """Hash of a rendered ETF description, used to detect changed entries."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class IncrementalIndex:
+    """
+    FAISS index over ETF descriptions that only re-embeds new or changed ETFs.
+
+    Next to the index file a JSON manifest keeps, for every ticker, its FAISS ID and
+    the content hash of the description it was embedded from. The ID of an ETF is
+    always its position in the data file, which is what every consumer resolves hits
+    with (`etf_data[id]`): when an insertion or removal shifts positions, the vectors of
+    the shifted ETFs are re-added under their new IDs without being re-embedded.
+
+    Args:
+        index_path (str): Path of the FAISS index file.
+        manifest_path (str): Path of the ticker manifest, defaults to `index_path + '.manifest.json'`.
+    """
+
+    def __init__(self, index_path, manifest_path=None):
+        self.index_path = index_path
+        self.manifest_path = manifest_path or index_path + MANIFEST_SUFFIX
+        self.index = None
+        self.ids = {}
+        self.hashes = {}
+        self.next_id = 0
+        self.load()
+
+    def load(self):
+        if not (os.path.exists(self.index_path) and os.path.exists(self.manifest_path)):
+            # no manifest means we can't trust the IDs of an existing index, start over
+            return
+        self.index = read_index(self.index_path)
+        with open(self.manifest_path, 'r') as file:
+            manifest = json.load(file)
+        self.ids = {ticker: entry['id'] for ticker, entry in manifest['tickers'].items()}
+        self.hashes = {ticker: entry['hash'] for ticker, entry in manifest['tickers'].items()}
+        self.next_id = manifest['next_id']
+
+    def save(self):
+        write_index(self.index, self.index_path)
+        manifest = {
+            'next_id': self.next_id,
+            'tickers': {
+                ticker: {'id': self.ids[ticker], 'hash': self.hashes[ticker]}
+                for ticker in self.ids
+            },
+        }
+        with replacing(self.manifest_path) as partial, open(partial, 'w') as file:
+            json.dump(manifest, file)
+
+    def diff(self, descriptions):
+        """
+        Compare rendered descriptions against the manifest.
+
+        Args:
+            descriptions (dict): Mapping ticker -> rendered description.
+
+        Returns:
+            tuple: (changed, removed) lists of tickers. `changed` holds new and modified entries.
+        """
+        changed = [
+            ticker for ticker, text in descriptions.items()
+            if self.hashes.get(ticker) != content_hash(text)
+        ]
+        removed = [ticker for ticker in self.ids if ticker not in descriptions]
+        return changed, removed
+
+    def update(self, descriptions, embed_fn):
+        """
+        Bring the index in line with `descriptions`, embedding only what changed.
+
+        Args:
+            descriptions (dict): Mapping ticker -> rendered description, in data file order.
+            embed_fn (callable): Takes a list of texts, returns a float32 array (n, d).
+
+        Returns:
+            dict: Counts of added, updated, removed, moved and unchanged tickers.
+        """
+        changed, removed = self.diff(descriptions)
+        positions = {ticker: position for position, ticker in enumerate(descriptions)}
+        changed_set = set(changed)
+        moved = [ticker for ticker, idx in self.ids.items()
+                 if ticker in positions and ticker not in changed_set and idx != positions[ticker]]
+        added = [ticker for ticker in changed if ticker not in self.ids]
+
+        moved_vectors = None
+        if moved:
+            moved_vectors = self.index.reconstruct_batch(np.array([self.ids[t] for t in moved], dtype=np.int64))
+        stale = [self.ids[ticker] for ticker in changed + removed + moved if ticker in self.ids]
+        if self.index is not None and stale:
+            self.index.remove_ids(np.array(stale, dtype=np.int64))
+        for ticker in removed:
+            del self.ids[ticker]
+            del self.hashes[ticker]
+
+        if moved:
+            self.index.add_with_ids(moved_vectors, np.array([positions[t] for t in moved], dtype=np.int64))
+        if changed:
+            embeddings = np.ascontiguousarray(embed_fn([descriptions[t] for t in changed]), dtype=np.float32)
+            if self.index is None:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(embeddings.shape[1]))
+            self.index.add_with_ids(embeddings, np.array([positions[t] for t in changed], dtype=np.int64))
+            for ticker in changed:
+                self.hashes[ticker] = content_hash(descriptions[ticker])
+        for ticker in moved + changed:
+            self.ids[ticker] = positions[ticker]
+        self.next_id = len(descriptions)
+
+        return {
+            'added': len(added),
+            'updated': len(changed) - len(added),
+            'removed': len(removed),
+            'moved': len(moved),
+            'unchanged': len(descriptions) - len(changed) - len(moved),
+        }
+
+    def ticker_for_id(self):
+        """Reverse mapping FAISS ID -> ticker."""
+        return {idx: ticker for ticker, idx in self.ids.items()}
+
+    def embeddings(self):
+        """
+        Reconstruct all stored vectors ordered by ID.
+
+        Returns:
+            tuple: (ids, embeddings) with ids an int64 array and embeddings a float32 array (n, d).
+        """
+        ids = np.array(sorted(self.ids.values()), dtype=np.int64)
+        if self.index is None or len(ids) == 0:
+            return ids, np.zeros((0, 0 if self.index is None else self.index.d), dtype=np.float32)
+        return ids, self.index.reconstruct_batch(ids)
+
+
+def check_positions(index, tickers, index_path=None, manifest_path=None):
+    """
+    Make sure FAISS IDs of `index` are positions in the data file whose tickers are `tickers`.
+
+    Raises:
+        ValueError: If the index size or the manifest next to `index_path` disagrees with
+            the data file, e.g. the index was rebuilt from a different version of it.
+    """
+    if index.ntotal != len(tickers):
+        raise ValueError(f"Index holds {index.ntotal} vectors for {len(tickers)} ETFs, rebuild it from the data file")
+    manifest_path = manifest_path or (index_path + MANIFEST_SUFFIX if index_path else None)
+    if manifest_path is None or not os.path.exists(manifest_path):
+        return
+    with open(manifest_path, 'r') as file:
+        ids = {ticker: entry['id'] for ticker, entry in json.load(file)['tickers'].items()}
+    if any(ids.get(ticker) != position for position, ticker in enumerate(tickers)):
+        raise ValueError(f"IDs of {index_path or manifest_path} are not positions in the data file, rebuild it")
@@ -0,0 +1,92 @@
+import argparse
+import time
+
+import numpy as np
+
+from src.dataset.index_factory import INDEX_TYPES, build_index, index_memory
+from src.dataset.embedding_store import load_embeddings
+
+
+def make_queries(embeddings, num_queries, metric, noise=0.05, seed=0):
+    # perturbed copies of stored vectors look like real "near an ETF" queries
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(embeddings), size=num_queries, replace=num_queries > len(embeddings))
+    queries = embeddings[rows] + noise * rng.standard_normal((num_queries, embeddings.shape[1])).astype(np.float32)
+    if metric == 'ip':
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return np.ascontiguousarray(queries, dtype=np.float32)
+
+
+def synthetic_embeddings(n, dimension, clusters=200, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    embeddings = centers[rng.integers(clusters, size=n)] + 0.3 * rng.standard_normal((n, dimension)).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def recall_at_k(found, truth):
+    k = truth.shape[1]
+    hits = [len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth)]
+    return float(np.sum(hits)) / (len(truth) * k)
+
+
+def benchmark(embeddings, index_types, metric='ip', k=10, num_queries=1000, **params):
+    queries = make_queries(embeddings, num_queries, metric)
+
+    baseline = build_index(embeddings, 'flat', metric=metric)
+    _, truth = baseline.search(queries, k)
+
+    results = []
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = build_index(embeddings, index_type, metric=metric, **params)
+        build_time = time.perf_counter() - start
+
+        # single-query latency, which is what a chat request sees
+        latencies = np.empty(num_queries)
+        found = np.empty((num_queries, k), dtype=np.int64)
+        for i in range(num_queries):
+            start = time.perf_counter()
+            _, found[i:i + 1] = index.search(queries[i:i + 1], k)
+            latencies[i] = time.perf_counter() - start
+
+        results.append({
+            'index_type': index_type,
+            'recall@k': recall_at_k(found, truth),
+            'p50_ms': np.percentile(latencies, 50) * 1e3,
+            'p99_ms': np.percentile(latencies, 99) * 1e3,
+            'build_s': build_time,
+            'memory_mb': index_memory(index) / 2 ** 20,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall/latency/memory benchmark of FAISS index types against the flat baseline")
+    parser.add_argument("--embeddings", default="etf_multitask_embeddings.npy",
+                        help="Embedding store (or legacy .pth) saved by rag_index.py or rag_index_modal.py")
+    parser.add_argument("--synthetic", type=int, default=0, help="Benchmark on N synthetic unit vectors instead")
+    parser.add_argument("--dimension", type=int, default=1024, help="Dimension of synthetic vectors")
+    parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    parser.add_argument("--metric", default="ip", choices=["l2", "ip"])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, default=64)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        embeddings = synthetic_embeddings(args.synthetic, args.dimension)
+    else:
+        embeddings = np.asarray(load_embeddings(args.embeddings), dtype=np.float32)
+
+    print(f"{len(embeddings)} vectors, dimension {embeddings.shape[1]}, metric {args.metric}, k={args.k}")
+    print(f"{'index':<10}{'recall@k':>10}{'p50 ms':>10}{'p99 ms':>10}{'build s':>10}{'MB':>10}")
+    for row in benchmark(embeddings, args.types, metric=args.metric, k=args.k, num_queries=args.queries,
+                         nprobe=args.nprobe, ef_search=args.ef_search):
+        print(f"{row['index_type']:<10}{row['recall@k']:>10.3f}{row['p50_ms']:>10.3f}{row['p99_ms']:>10.3f}"
+              f"{row['build_s']:>10.2f}{row['memory_mb']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
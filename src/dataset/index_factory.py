@@ -0,0 +1,136 @@
+import math
+
+import numpy as np
+import faiss
+
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'hnsw', 'ivf_pq')
+METRICS = {
+    'l2': faiss.METRIC_L2,
+    # MultitaskLM.encode returns unit vectors, so inner product is cosine similarity
+    'ip': faiss.METRIC_INNER_PRODUCT,
+}
+
+
+def default_nlist(n):
+    # the faiss rule of thumb, kept small enough that every list gets ~39+ training points
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def default_pq_m(dimension):
+    for m in (64, 48, 32, 16, 8, 4):
+        if dimension % m == 0:
+            return m
+    return 1
+
+
+def factory_string(index_type, dimension, n=None, nlist=None, hnsw_m=32, pq_m=None, pq_bits=8):
+    """
+    Translate one of `INDEX_TYPES` into a `faiss.index_factory` description.
+
+    Args:
+        index_type (str): 'flat', 'ivf_flat', 'hnsw' or 'ivf_pq'.
+        dimension (int): Embedding dimension.
+        n (int): Number of vectors the index is built for, used to pick `nlist`.
+        nlist (int): Number of IVF lists, defaults to ~4*sqrt(n).
+        hnsw_m (int): Neighbours per HNSW node.
+        pq_m (int): Number of PQ sub-quantizers, must divide `dimension`.
+        pq_bits (int): Bits per PQ code.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+
+    if index_type == 'flat':
+        return 'Flat'
+    if index_type == 'hnsw':
+        return f'HNSW{hnsw_m},Flat'
+
+    if nlist is None:
+        if n is None:
+            raise ValueError(f"{index_type} needs either nlist or the number of vectors n")
+        nlist = default_nlist(n)
+    if index_type == 'ivf_flat':
+        return f'IVF{nlist},Flat'
+
+    pq_m = pq_m or default_pq_m(dimension)
+    if dimension % pq_m != 0:
+        raise ValueError(f"pq_m={pq_m} does not divide the embedding dimension {dimension}")
+    return f'IVF{nlist},PQ{pq_m}x{pq_bits}'
+
+
+def configure_search(index, nprobe=None, ef_search=None):
+    """Set query-time knobs (IVF `nprobe`, HNSW `efSearch`) on a built or loaded index."""
+    base = index
+    if isinstance(base, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        base = faiss.downcast_index(base.index)
+    if nprobe is not None:
+        ivf = faiss.try_extract_index_ivf(base)
+        if ivf is not None:
+            ivf.nprobe = nprobe
+    if ef_search is not None and hasattr(base, 'hnsw'):
+        base.hnsw.efSearch = ef_search
+    return index
+
+
+def build_index(embeddings, index_type='flat', metric='l2', ids=None, nprobe=16, ef_search=64, **params):
+    """
+    Build, train and fill a FAISS index of the requested type.
+
+    Args:
+        embeddings (np.ndarray): float32 array (n, d).
+        index_type (str): One of `INDEX_TYPES`.
+        metric (str): 'l2' or 'ip'.
+        ids (np.ndarray): Optional int64 IDs, e.g. the stable IDs of `IncrementalIndex`.
+        nprobe (int): IVF lists visited per query.
+        ef_search (int): HNSW candidate list size per query.
+        **params: Forwarded to `factory_string` (nlist, hnsw_m, pq_m, pq_bits).
+
+    Returns:
+        faiss.Index: The populated index.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n, dimension = embeddings.shape
+    description = factory_string(index_type, dimension, n=n, **params)
+    if ids is not None:
+        description = 'IDMap2,' + description
+    index = faiss.index_factory(dimension, description, METRICS[metric])
+
+    if not index.is_trained:
+        index.train(embeddings)
+    if ids is None:
+        index.add(embeddings)
+    else:
+        index.add_with_ids(embeddings, np.asarray(ids, dtype=np.int64))
+
+    return configure_search(index, nprobe=nprobe, ef_search=ef_search)
+
+
+def index_memory(index):
+    """Size in bytes of the serialized index, a close proxy for its resident memory."""
+    return faiss.serialize_index(index).nbytes
+
+
+def search_with_mask(index, queries, k, mask):
+    """
+    Search only among the IDs set in a boolean `mask`, pushing the filter into FAISS.
+
+    The mask is packed into a bitmap `IDSelector`, so vectors outside it are never scored.
+    IDs are the index IDs (positions for plain indexes, external IDs behind an IDMap).
+    """
+    bitmap = np.packbits(mask.astype(np.uint8), bitorder='little')
+    selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+
+    base = index
+    if isinstance(base, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        base = faiss.downcast_index(base.index)
+    ivf = faiss.try_extract_index_ivf(base)
+    if ivf is not None:
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    elif hasattr(base, 'hnsw'):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=base.hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+
+    distances, ids = index.search(np.ascontiguousarray(queries, dtype=np.float32), k, params=params)
+    del bitmap  # the selector only borrows the buffer, keep it alive until here
+    return distances, ids
@@ -4,13 +4,23 @@ import gradio as gr
 from transformers import AutoTokenizer, AutoModelForCausalLM, TextStreamer
 import torch
 from sentence_transformers import SentenceTransformer
-import faiss
 import numpy as np
 
 from src.models.multitask import MultitaskLM
+from src.dataset.incremental_index import IncrementalIndex
+from src.dataset.index_factory import build_index
+from src.dataset.embedding_pass import bucketed_embed
+from src.dataset.embedding_store import write_store, write_index
 
 ETFS_PATH = "../../data/etf_data_v3_clean.json"
-INDEX_PATH = "../../data/etfs.index"
+# MultitaskLM vectors, kept apart from the all-MiniLM-L6-v2 etfs.index the retrieval service queries
+INDEX_PATH = "../../data/etfs_multitask.index"
+# exact flat index above stays the source of truth, ANN index is derived from its vectors
+ANN_INDEX_TYPE = None  # 'ivf_flat', 'hnsw' or 'ivf_pq', see src/dataset/index_factory.py
+ANN_METRIC = 'ip'  # encode() output is normalized
+ANN_INDEX_PATH = "../../data/etfs_multitask_ann.index"
+EMBEDDINGS_PATH = 'etf_multitask_embeddings.npy'  # memory-mapped store, see src/dataset/embedding_store.py
+EMBEDDINGS_DTYPE = np.float16
 MODEL_NAME = 'FINGU-AI/FinguAI-Chat-v1'
 LORA_PATH = '../pipeline/lora_high/FINGU-AI/FinguAI-Chat-v1'
 
@@ -79,36 +89,31 @@ The ETF's ticker is {etf['ticker']} ({etf['bbg_ticker']}), known as the {etf['et
 - **Inception Date**: {etf['inception_date']}"""
 
 
-descriptions = [
-    form(etf) for etf in etf_data
-]
+descriptions = {
+    etf['bbg_ticker']: form(etf) for etf in etf_data
+}
 
 # Split code START
-BATCH_SIZE = 500  # 300-400 tokens per ETF
+MAX_TOKENS_PER_BATCH = 500 * 400  # same memory budget as the old 500 x ~400-token batches
 
-# Prepare descriptions
-num_batches = len(descriptions) // BATCH_SIZE + int(len(descriptions) % BATCH_SIZE != 0)
 
-# Initialize empty list to hold all embeddings
-all_embeddings = []
-
-# Process in batches
-for i in range(num_batches):
-    batch_descriptions = descriptions[i * BATCH_SIZE: (i + 1) * BATCH_SIZE]
-    tokens = tokenizer(batch_descriptions, return_tensors='pt', padding=True, truncation=True).to(device)
+def embed(texts):
+    # length-sorted batches, so little compute goes into padding
+    embeddings, _ = bucketed_embed(texts, tokenizer, embedding_model.encode, device=device,
+                                   max_tokens=MAX_TOKENS_PER_BATCH)
+    return embeddings
+# Split code END
 
-    with torch.no_grad():
-        embeddings = embedding_model.encode(**tokens)
-        all_embeddings.append(embeddings.cpu().numpy())
 
-# Concatenate all embeddings
-embeddings = np.vstack(all_embeddings)
-# Split code END
+# only new or changed ETFs (by content hash of their description) get re-embedded,
+# IDs follow the data file order so hits resolve with etf_data[id]
+index = IncrementalIndex(INDEX_PATH)
+print(index.update(descriptions, embed))
+index.save()
 
+ids, embeddings = index.embeddings()
+ticker_for_id = index.ticker_for_id()
+write_store(EMBEDDINGS_PATH, embeddings, [ticker_for_id[idx] for idx in ids], dtype=EMBEDDINGS_DTYPE)
 
-dimension = embeddings.shape[1]
-index = faiss.IndexFlatL2(dimension)
-index.add(embeddings)
-from faiss import write_index, read_index
-torch.save(embeddings, 'etf_embeddings.pth')
-write_index(index, INDEX_PATH)
+if ANN_INDEX_TYPE is not None:
+    write_index(build_index(embeddings, ANN_INDEX_TYPE, metric=ANN_METRIC, ids=ids), ANN_INDEX_PATH)
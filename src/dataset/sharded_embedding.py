@@ -0,0 +1,116 @@
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+
+
+MANIFEST_NAME = 'manifest.json'
+
+# per-process encoder, created once by the pool initializer
+_encoder = None
+
+
+def shard_ranges(num_texts, shard_size):
+    """Contiguous [start, end) row ranges; shard i always covers the same rows for the same inputs."""
+    return [(start, min(start + shard_size, num_texts)) for start in range(0, num_texts, shard_size)]
+
+
+def shard_path(shard_dir, shard_id):
+    return os.path.join(shard_dir, f'shard_{shard_id:05d}.npy')
+
+
+def texts_fingerprint(texts, model_name):
+    digest = hashlib.sha256(model_name.encode('utf-8'))
+    for text in texts:
+        digest.update(hashlib.sha256(text.encode('utf-8')).digest())
+    return digest.hexdigest()
+
+
+def _init_worker(model_name, num_threads):
+    global _encoder
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(num_threads)
+    _encoder = SentenceTransformer(model_name, device='cpu')
+
+
+def _embed_shard(shard_id, texts, shard_dir, batch_size):
+    embeddings = _encoder.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+    # write-then-rename, so a crash never leaves a half-written shard that looks finished
+    target = shard_path(shard_dir, shard_id)
+    partial = target + '.partial.npy'
+    np.save(partial, np.asarray(embeddings, dtype=np.float32))
+    os.replace(partial, target)
+    return shard_id
+
+
+def prepare_shard_dir(shard_dir, fingerprint, num_texts, shard_size):
+    """Reuse finished shards of an interrupted run with identical inputs, start over otherwise."""
+    manifest = {'fingerprint': fingerprint, 'num_texts': num_texts, 'shard_size': shard_size}
+    manifest_path = os.path.join(shard_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as file:
+            if json.load(file) == manifest:
+                return
+        shutil.rmtree(shard_dir)
+    os.makedirs(shard_dir, exist_ok=True)
+    with open(manifest_path, 'w') as file:
+        json.dump(manifest, file)
+
+
+def sharded_embed(texts, model_name, shard_dir, num_workers=None, shard_size=1000, batch_size=32, out=None):
+    """
+    Embed `texts` with a SentenceTransformer across worker processes, resumable after a crash.
+
+    Texts are cut into fixed shards; every worker process loads the encoder once and
+    writes each finished shard to `shard_dir`. Rerunning with the same texts and model
+    skips shards that are already on disk. Shards are merged in shard order, so the
+    output rows always match `texts`.
+
+    Args:
+        texts (list): Texts to embed.
+        model_name (str): SentenceTransformer model name or path.
+        shard_dir (str): Directory for partial outputs and the resume manifest.
+        num_workers (int): Worker processes, defaults to the number of CPU cores.
+        shard_size (int): Texts per shard, i.e. the most work lost on a crash per worker.
+        batch_size (int): Encoder batch size inside a worker.
+        out (np.ndarray): Optional preallocated (len(texts), d) output, e.g. `embedding_store.create_store`.
+
+    Returns:
+        np.ndarray: Embeddings in the order of `texts`.
+    """
+    num_workers = num_workers or os.cpu_count()
+    ranges = shard_ranges(len(texts), shard_size)
+    prepare_shard_dir(shard_dir, texts_fingerprint(texts, model_name), len(texts), shard_size)
+
+    todo = [i for i in range(len(ranges)) if not os.path.exists(shard_path(shard_dir, i))]
+    print(f"{len(ranges) - len(todo)}/{len(ranges)} shards already done, embedding {len(todo)} on {num_workers} workers")
+
+    if todo:
+        # spawn: forked torch/tokenizer state is not safe to share
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context('spawn'),
+                                 initializer=_init_worker,
+                                 initargs=(model_name, max(1, os.cpu_count() // num_workers))) as pool:
+            futures = [
+                pool.submit(_embed_shard, i, texts[ranges[i][0]:ranges[i][1]], shard_dir, batch_size)
+                for i in todo
+            ]
+            for done, future in enumerate(futures, 1):
+                print(f"shard {future.result()} done ({done}/{len(todo)})")
+
+    return merge_shards(shard_dir, ranges, out=out)
+
+
+def merge_shards(shard_dir, ranges, out=None):
+    """Copy shards into one array in shard order."""
+    for i, (start, end) in enumerate(ranges):
+        shard = np.load(shard_path(shard_dir, i), mmap_mode='r')
+        if out is None:
+            out = np.empty((ranges[-1][1], shard.shape[1]), dtype=np.float32)
+        out[start:end] = shard
+    return out
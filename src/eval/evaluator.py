@@ -8,6 +8,11 @@ from sklearn.metrics.pairwise import cosine_similarity
 from transformers import AutoModelForCausalLM, AutoTokenizer
 import torch
 
+from src.serving.prefix_cache import PrefixCache
+
+FINGU_SYSTEM_PROMPT = ("You are a professional portfolio manager specializing in ETF who advises the client by providing deep "
+                       "insight into the financial markets. Help the user and provide accurate information.")
+
 class ETFAdvisorEvaluatorBase:
     def __init__(self, model, tokenizer, test_prompts, bert_score=True, rouge_score=True, perplexity=True, cosine_similarity=True):
         self.model = model
@@ -146,11 +151,18 @@ class ETFAdvisorEvaluatorGPT2(ETFAdvisorEvaluatorBase):
         return perplexity.item()
 
 class ETFAdvisorEvaluatorFingu(ETFAdvisorEvaluatorBase):
+    prefix_cache = None
+
     def generate_response(self, prompt):
         messages = [
-            {"role": "system", "content": "You are a professional portfolio manager specializing in ETF who advises the client by providing deep insight into the financial markets. Help the user and provide accurate information."},
+            {"role": "system", "content": FINGU_SYSTEM_PROMPT},
             {"role": "user", "content": prompt},
         ]
+        if self.prefix_cache is None:
+            # the system turn is the same for every test prompt, its KV states are computed once
+            self.prefix_cache = PrefixCache(self.model).pin(self.tokenizer.apply_chat_template(
+                messages[:1], tokenize=True, return_tensors="pt"
+            )[0])
 
         tokenized_chat = self.tokenizer.apply_chat_template(
             messages,
@@ -169,7 +181,9 @@ class ETFAdvisorEvaluatorFingu(ETFAdvisorEvaluatorBase):
             'eos_token_id': self.tokenizer.eos_token_id,
         }
 
-        outputs = self.model.generate(tokenized_chat, **generation_params)
+        # generate only prefills the tokens after the cached system turn
+        past_key_values = self.prefix_cache.past_key_values(tokenized_chat[0])
+        outputs = self.model.generate(tokenized_chat, past_key_values=past_key_values, **generation_params)
         decoded_outputs = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
 
         raw_answer = decoded_outputs[0]
@@ -1,18 +1,25 @@
-import random
-import re
-import pickle
 import sys
 import torch
 import gradio as gr
 from transformers import AutoTokenizer, AutoModelForCausalLM, AutoModelForSequenceClassification
-from transformers.generation import TextStreamer
-from sentence_transformers import SentenceTransformer
 import os
+import threading
 from torch import nn
-import faiss
+from concurrent.futures import ThreadPoolExecutor
 
 from src.models.multitask import MultitaskLM
 from src.optimization.optimization_mpt import optimizer
+from src.optimization.price_store import get_price_store
+from src.optimization.result_cache import default_result_cache
+from src.retrieval.cache import default_cache
+from src.retrieval.retriever import Retriever
+from src.dataset.context_blocks import PromptAssembler, load_or_build
+from src.retrieval.rerank import CrossEncoderReranker
+from src.serving.engine import GenerationEngine
+from src.serving.prefix_cache import PrefixCache
+from src.serving.response_cache import ResponseCache, model_fingerprint
+from src.serving.streaming import stream_answer
+from src.serving.timing import LatencyStats, StageTimer
 
 # from src.models.multitask import MultitaskLM
 # from src.optimization.optimization_mpt import optimizer
@@ -26,14 +33,27 @@ optimization_path = os.path.abspath(os.path.join(current_file_path, '../optimiza
 models_path = os.path.abspath(os.path.join(current_file_path, '../models'))
 sys.path.append(optimization_path)
 sys.path.append(models_path)
-with open('../../data/etf_data_short.pickle', 'rb') as file:
-    etf_data = pickle.load(file)
 
+ETFS_PATH = "../../data/etf_data_v3_clean.json"
 INDEX_PATH = "../../data/etfs.index"
+CONTEXT_BLOCKS_PATH = "../../data/etf_context_blocks.npz"
+NPROBE = 16
+EF_SEARCH = 64
+NUM_CANDIDATES = 30  # dense/lexical hits handed to the re-ranker
+RERANK_BUDGET = 0.25  # seconds, dense order is kept beyond that
+OPTIMIZATION_CACHE_DIR = "../../data/optimization_cache"
+TAIL_RISK_PATHS = 10000  # Monte Carlo paths behind the VaR/CVaR lines of the allocation
+OPTIMIZATION_METHOD = 'max_sharpe'  # or min_variance, risk_parity, max_diversification
+GROUP_CAPS = None  # e.g. {'Equity': 0.8}, caps per asset_class_focus
 HEAD_PATH = '../pipeline/modules/class_head.pth'
 SELECT_PATH = '../pipeline/modules/select_head.pth'
 LORA_PATH = '../pipeline/fine_tuned_model/FINGU-AI/FinguAI-Chat-v1'
 MODEL_NAME = "FINGU-AI/FinguAI-Chat-v1"
+MAX_BATCH_SIZE = 8  # chat sessions decoded together
+CONTEXT_PREFIXES = 16  # system prompt + ETF context prefixes whose KV states are kept
+DETERMINISTIC = False  # greedy decoding, repeated questions are then answered from the response cache
+RESPONSE_CACHE_DIR = "../../data/response_cache"
+RESPONSE_TTL = 24 * 3600  # seconds a cached answer is served
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 linear = nn.Linear(384, 2, bias=False)
@@ -43,10 +63,25 @@ linear.load_state_dict(torch.load(HEAD_PATH))
 tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
 
 model = MultitaskLM(MODEL_NAME, lora_path=LORA_PATH).to(device)
-
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-
-index = faiss.read_index(INDEX_PATH)
+# one engine for all sessions: concurrent requests are decoded together, shared prompt prefixes are prefilled once
+prefix_cache = PrefixCache(model.model, max_size=CONTEXT_PREFIXES)
+engine = GenerationEngine(model.model, eos_token_id=tokenizer.eos_token_id, max_batch_size=MAX_BATCH_SIZE,
+                          prefix_cache=prefix_cache)
+# CPU stages of concurrent requests (portfolio optimization) run here, next to the engine's decoding
+pipeline_pool = ThreadPoolExecutor(max_workers=MAX_BATCH_SIZE, thread_name_prefix='chat-pipeline')
+# per-stage latency over recent requests: embed, classify, retrieve, optimize, response_cache, first_token, generate
+latency_stats = LatencyStats()
+
+# BM25 + dense over the ETFs matching filters parsed from the query, then the cross-encoder
+# decides how many ETFs are relevant enough to go into the context
+reranker = CrossEncoderReranker(device='cpu', time_budget=RERANK_BUDGET)
+retriever = Retriever.load(ETFS_PATH, INDEX_PATH, nprobe=NPROBE, ef_search=EF_SEARCH,
+                           reranker=reranker, num_candidates=NUM_CANDIDATES)
+
+# price panel is loaded once here, optimization turns only slice it
+get_price_store()
+# repeated baskets are answered from the cache, across restarts too
+default_result_cache.disk_dir = OPTIMIZATION_CACHE_DIR
 
 raw_context_message = (
     "You are a financial specialist specializing in ETF portfolio construction and optimization. "
@@ -54,11 +89,25 @@ raw_context_message = (
     "Consider their risk tolerance, investment goals, and market conditions when offering advice."
 )
 
+# ETF snippets are rendered and tokenized once, prompts are spliced together from token segments
+context_blocks = load_or_build(CONTEXT_BLOCKS_PATH, retriever.etf_data, tokenizer, key_field='bbg_ticker')
+prompt_assembler = PromptAssembler(tokenizer, context_blocks, raw_context_message)
+# KV states of the system prompt are computed once, every request only prefills what follows
+prefix_cache.pin(prompt_assembler.system_ids())
+# data file and index may be rebuilt while serving: the retriever swaps both, the context blocks follow
+retrieval_lock = threading.Lock()
+retrieval_state = (retriever.snapshot, prompt_assembler)
+
+# greedy answers only depend on the weights, the ETF data and the prompt, so they are cached
+# under those (in memory and on disk, across restarts) and a repeated question skips the engine;
+# the data part of the key is the retrieval snapshot a request used, so a refresh starts a new namespace
+response_cache = ResponseCache(ttl=RESPONSE_TTL, disk_dir=RESPONSE_CACHE_DIR) if DETERMINISTIC else None
+weights_version = model_fingerprint(model.model, LORA_PATH)
+
 # Define generation parameters
 generation_params = {
     'max_new_tokens': 200,
-    'use_cache': True,
-    'do_sample': True,
+    'do_sample': not DETERMINISTIC,
     'temperature': 0.7,
     'top_p': 0.9,
     'top_k': 50,
@@ -66,118 +115,134 @@ generation_params = {
 }
 
 # Function to classify text
-def optimization_prediction(text: str) -> int:
-    logits = linear(torch.tensor(embedding_model.encode(text)))
+def optimization_prediction(embedding) -> int:
+    # classifies the query embedding the retriever searches with, the text is encoded once
+    logits = linear(torch.as_tensor(embedding))
     print(logits)
     return torch.argmax(logits).detach().item()
 
 
-def extract_tickers(query):
-    query_embedding = embedding_model.encode([query])
-    distances, indices = index.search(query_embedding, random.randint(3,8))
-    print(distances, indices)
-    return indices[0]
+def refresh_retrieval():
+    """Current retriever snapshot and the prompt assembler built from the same ETF data."""
+    global retrieval_state
+    with retrieval_lock:
+        if retriever.refresh():
+            blocks = load_or_build(CONTEXT_BLOCKS_PATH, retriever.etf_data, tokenizer, key_field='bbg_ticker')
+            retrieval_state = (retriever.snapshot, PromptAssembler(tokenizer, blocks, raw_context_message))
+        return retrieval_state
+
+
+def extract_tickers(query, embedding=None, snapshot=None):
+    hits = retriever.search_one(query, embeddings=None if embedding is None else embedding[None], snapshot=snapshot)
+    print(hits, default_cache.stats())
+    return hits
+
+
+def stream_generation(user_input, history, input_ids, timer, tickers=(), prefix_length=None, data_version=None):
+    """
+    Stream the engine's answer into the chat history and record its prefill and decode times.
+
+    In deterministic mode a question already answered for the same ETFs (of the same
+    `data_version`) is served from the response cache without touching the engine, and
+    complete answers are stored there.
+    """
+    key = None
+    if response_cache is not None:
+        key = response_cache.key(weights_version, data_version, user_input, tickers, generation_params)
+        with timer.stage('response_cache'):
+            answer = response_cache.get(key)
+        if answer is not None:
+            history.append((user_input, answer))
+            yield history
+            return
+
+    request = engine.submit(input_ids, prefix_length=prefix_length, **generation_params)
+    history.append((user_input, ''))
+    for answer in stream_answer(tokenizer, request):
+        history[-1] = (user_input, answer)
+        yield history
+    if request.first_token_at is not None:
+        timer.mark('first_token', request.submitted, request.first_token_at)
+    timer.mark('generate', request.submitted)
+    if key is not None:
+        response_cache.put(key, history[-1][1])
+        print(response_cache.stats())
+
+
+def optim_generation(user_input, history, embedding, timer):
+    print('optim body')
+    with timer.stage('retrieve'):
+        snapshot, assembler = refresh_retrieval()
+        hits = extract_tickers(user_input, embedding, snapshot)
+    etf_results = [hit.record for hit in hits]
+    etf_keys = [etf['bbg_ticker'] for etf in etf_results]
+    print(assembler.context_text(etf_keys))
+    print([hit.id for hit in hits])
+
+    # the price panel covers only part of the ETF universe, ETFs without history can't be optimized
+    price_store = get_price_store()
+    priced = [etf for etf in etf_results if etf['bbg_ticker'] in price_store]
+    unpriced = [etf['bbg_ticker'] for etf in etf_results if etf['bbg_ticker'] not in price_store]
+
+    # the allocation is solved on the pool while the engine prefills and decodes the answer
+    allocation = None
+    if priced:
+        allocation = pipeline_pool.submit(
+            timer.timed('optimize', optimizer), [etf['bbg_ticker'] for etf in priced], method=OPTIMIZATION_METHOD,
+            tail_risk_paths=TAIL_RISK_PATHS, groups={etf['bbg_ticker']: etf.get('asset_class_focus') for etf in priced},
+            group_caps=GROUP_CAPS,
+        )
 
+    # Same IDs as apply_chat_template on the system prompt + ETF context and the user turn
+    tokenized_chat = assembler.input_ids(user_input, etf_keys).to(device)
 
-def optim_generation(user_input, history):
-    print('optim body')
-    indices = extract_tickers(user_input)
-    etf_results = [etf_data[idx] for idx in indices]
-    etf_context = "\n\n".join([
-        f"{etf['ticker']} - {etf['etf_name']}\n{etf['description']}"
-        for etf in etf_results
-    ])
-
-    initial_allocation = optimizer(  # should work by indices
-        [etf['bbg_ticker'] for etf in etf_results], 
-    )
-
-    context = (
-        "You are a financial specialist specializing in ETF portfolio construction and optimization. "
-        "Your role is to assist users by providing accurate, timely, and insightful information to guide their investment decisions. "
-        "Consider their risk tolerance, investment goals, and market conditions when offering advice."
-        f"\n\nRelevant ETF Information:\n{etf_context}.\n"
-    )
-
-    print(initial_allocation)
-    print(etf_context)
-    print(indices)
-
-    # history.append((user_input, f"some answer\n\n{initial_allocation}"))
-    # return history
-
-
-    # Construct the conversation messages
-    messages = [
-        {"role": "system", "content": context},
-        {"role": "user", "content": user_input},
-    ]
-
-    # Tokenize the chat messages
-    tokenized_chat = tokenizer.apply_chat_template(
-        messages, tokenize=True, add_generation_prompt=True,
-        return_tensors="pt"
-    ).to(device)
-
-    streamer = TextStreamer(tokenizer)
-
-    # Generate the response
-    outputs = model.model.generate(tokenized_chat, **generation_params, streamer=streamer)
-    decoded_outputs = tokenizer.batch_decode(outputs)
-    raw_answer = decoded_outputs[0]
-
-    # Extract the assistant's response
-    raw_answer = raw_answer.replace("<|im_end|>", "").replace("<|im_start|>", "")
-    match = re.search(r"assistant\s*\n(.*?)(?=\nuser|\Z)", raw_answer, re.DOTALL)
-    if match:
-        answer = match.group(1).strip()
-    else:
-        answer = raw_answer.strip()
+    # Generate the response, decoded in one batch with the other sessions' requests;
+    # the assistant's answer is shown as it grows. The system prompt + ETF context prefix
+    # is cached, so a follow-up question about the same ETFs skips its prefill.
+    yield from stream_generation(user_input, history, tokenized_chat[0], timer, tickers=etf_keys,
+                                 prefix_length=assembler.prefix_length(etf_keys),
+                                 data_version=(snapshot.version, assembler.blocks.version))
+    answer = history[-1][1]
 
-    # Append the new interaction to the history
-    history.append((user_input, f"{answer}\n\n{initial_allocation}"))
-    return history
+    if allocation is None:
+        initial_allocation = "No allocation for this basket: none of its ETFs has price history"
+    else:
+        try:
+            initial_allocation = allocation.result()
+        except (ValueError, KeyError, RuntimeError) as error:
+            # e.g. GROUP_CAPS the basket cannot satisfy or a broken process pool, the answer is still worth showing
+            initial_allocation = f"No allocation for this basket: {error}"
+        if unpriced:
+            initial_allocation += f"\nLeft out, no price history: {', '.join(unpriced)}"
+    print(initial_allocation, default_result_cache.stats())
+    history[-1] = (user_input, f"{answer}\n\n{initial_allocation}")
+    yield history
 
 
 def respond(inp, hist=[]):
-    label = optimization_prediction(inp)
+    timer = StageTimer()
+    with timer.stage('embed'):
+        # shared by the classifier and the retriever
+        embedding = retriever.encode([inp])[0]
+    with timer.stage('classify'):
+        label = optimization_prediction(embedding)
     if label == 0:
         print("executing optimization")
-        return optim_generation(inp, hist)
+        yield from optim_generation(inp, hist, embedding, timer)
     else:
         print("executing raw gen")
-        return raw_generation(inp, hist)
+        yield from raw_generation(inp, hist, timer)
+    latency_stats.add(timer)
+    print(timer.summary())
 
 
-def raw_generation(user_input, history):
-    messages = [
-        {"role": "system", "content": raw_context_message},
-        {"role": "user", "content": user_input},
-    ]
+def raw_generation(user_input, history, timer):
     # Tokenize the chat template
-    tokenized_chat = tokenizer.apply_chat_template(
-        messages, tokenize=True, add_generation_prompt=True, return_tensors="pt"
-    ).to(device)
-
-    # Use a streamer for generating the response
-    streamer = TextStreamer(tokenizer)
-
-    # Generate the response
-    outputs = model.model.generate(tokenized_chat, **generation_params, streamer=streamer)
-    decoded_outputs = tokenizer.batch_decode(outputs)
-    raw_answer = decoded_outputs[0]
-
-    # Extract the assistant's response
-    raw_answer = raw_answer.replace("<|im_end|>", "").replace("<|im_start|>", "")
-    match = re.search(r"assistant\s*\n(.*?)(?=\nuser|\Z)", raw_answer, re.DOTALL)
-    if match:
-        answer = match.group(1).strip()
-    else:
-        answer = raw_answer.strip()
+    tokenized_chat = prompt_assembler.input_ids(user_input).to(device)
 
-    # Append the new interaction to the history
-    history.append((user_input, answer))
-    return history
+    # Generate the response, decoded in one batch with the other sessions' requests;
+    # the assistant's answer is shown as it grows
+    yield from stream_generation(user_input, history, tokenized_chat[0], timer)
 
 
 # Create the Gradio interface
@@ -192,10 +257,11 @@ with gr.Blocks() as demo:
         btn = gr.Button("Send")
 
     def submit_message(user_input, history=[]):
-        new_history = respond(user_input, history)
-        return new_history, ""
+        for new_history in respond(user_input, history):
+            yield new_history, ""
 
 
     btn.click(submit_message, [txt, chatbot], [chatbot, txt])
 
+demo.queue(default_concurrency_limit=MAX_BATCH_SIZE)
 demo.launch()
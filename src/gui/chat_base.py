@@ -1,10 +1,14 @@
 import gradio as gr
-import re
-from transformers import AutoTokenizer, AutoModelForCausalLM, TextStreamer
+from transformers import AutoTokenizer, AutoModelForCausalLM
 import torch
 
+from src.serving.engine import GenerationEngine
+from src.serving.prefix_cache import PrefixCache
+from src.serving.streaming import stream_answer
+
 # Define the model name and the directory where the fine-tuned model is located
 model_name = "FINGU-AI/FinguAI-Chat-v1"
+MAX_BATCH_SIZE = 8  # sessions decoded together
 
 # Load the tokenizer and model from the fine-tuned directory
 tokenizer = AutoTokenizer.from_pretrained(model_name, attn_implementation="flash_attention_2")
@@ -14,15 +18,24 @@ model = AutoModelForCausalLM.from_pretrained(model_name)
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 model.to(device)
 
+system_prompt = (
+    "You are a financial specialist specializing in ETF portfolio construction and optimization. "
+    "Your role is to assist users by providing accurate, timely, and insightful information to guide their investment decisions. "
+    "Consider their risk tolerance, investment goals, and market conditions when offering advice."
+)
+
+# one engine for all sessions: concurrent requests are decoded together; the KV states of the
+# system turn are computed once and every request only prefills its user turn
+prefix_cache = PrefixCache(model).pin(tokenizer.apply_chat_template(
+    [{"role": "system", "content": system_prompt}], tokenize=True, return_tensors="pt"
+)[0])
+engine = GenerationEngine(model, eos_token_id=tokenizer.eos_token_id, max_batch_size=MAX_BATCH_SIZE,
+                          prefix_cache=prefix_cache)
+
 
 def respond(user_input, history):
-    context = (
-        "You are a financial specialist specializing in ETF portfolio construction and optimization. "
-        "Your role is to assist users by providing accurate, timely, and insightful information to guide their investment decisions. "
-        "Consider their risk tolerance, investment goals, and market conditions when offering advice."
-    )
     messages = [
-        {"role": "system", "content": context},
+        {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_input},
     ]
 
@@ -34,7 +47,6 @@ def respond(user_input, history):
     # Define generation parameters
     generation_params = {
         'max_new_tokens': 1000,
-        'use_cache': True,
         'do_sample': True,
         'temperature': 0.7,
         'top_p': 0.9,
@@ -42,25 +54,13 @@ def respond(user_input, history):
         'eos_token_id': tokenizer.eos_token_id,
     }
 
-    # Use a streamer for generating the response
-    streamer = TextStreamer(tokenizer)
-
-    # Generate the response
-    outputs = model.generate(tokenized_chat, **generation_params, streamer=streamer)
-    decoded_outputs = tokenizer.batch_decode(outputs)
-    raw_answer = decoded_outputs[0]
-
-    # Extract the assistant's response
-    raw_answer = raw_answer.replace("<|im_end|>", "").replace("<|im_start|>", "")
-    match = re.search(r"assistant\s*\n(.*?)(?=\nuser|\Z)", raw_answer, re.DOTALL)
-    if match:
-        answer = match.group(1).strip()
-    else:
-        answer = raw_answer.strip()
-
-    # Append the new interaction to the history
-    history.append((user_input, answer))
-    return history
+    # Generate the response, decoded in one batch with the other sessions' requests;
+    # the assistant's answer is shown as it grows
+    request = engine.submit(tokenized_chat[0], **generation_params)
+    history.append((user_input, ''))
+    for answer in stream_answer(tokenizer, request):
+        history[-1] = (user_input, answer)
+        yield history
 
 
 # Create the Gradio interface
@@ -73,9 +73,10 @@ with gr.Blocks() as demo:
 
     def submit_message(user_input, history):
         history = history or []
-        new_history = respond(user_input, history)
-        return new_history, ""
+        for new_history in respond(user_input, history):
+            yield new_history, ""
 
     btn.click(submit_message, [txt, chatbot], [chatbot, txt])
 
+demo.queue(default_concurrency_limit=MAX_BATCH_SIZE)
 demo.launch()
@@ -1,45 +1,22 @@
-import re
-import json
 import gradio as gr
 from peft import PeftModel
-from transformers import AutoTokenizer, AutoModelForCausalLM, TextStreamer
+from transformers import AutoTokenizer, AutoModelForCausalLM
 import torch
-from sentence_transformers import SentenceTransformer
-import faiss
-import numpy as np
-
-# Load the ETF data from JSON file
-with open('../../data/etf_data_v2.json', 'r') as file:
-    etf_data = json.load(file)
-
-# Ensure all descriptions are strings and handle NaN values
-# for etf in etf_data:
-#     if not isinstance(etf.get("Description"), str):
-#         etf["Description"] = ""
-for etf in etf_data:
-    for key, value in etf.items():
-        if isinstance(value, float) and np.isnan(value):
-            etf[key] = "Not Available"
-        elif not isinstance(value, str):
-            etf[key] = str(value)
-
-# Load a pre-trained embedding model
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-
-# Generate embeddings for the ETF descriptions
-descriptions = [etf["Description"] for etf in etf_data]
-embeddings = embedding_model.encode(descriptions)
-
-# Convert embeddings to FAISS index
-dimension = embeddings.shape[1]
-index = faiss.IndexFlatL2(dimension)
-index.add(np.array(embeddings))
-
-# Store additional data for retrieval
-etf_tickers = [etf["Ticker"] for etf in etf_data]
+
+from src.retrieval.retriever import Retriever
+from src.dataset.context_blocks import PromptAssembler, load_or_build
+from src.serving.engine import GenerationEngine
+from src.serving.prefix_cache import PrefixCache
+from src.serving.streaming import stream_answer
+
+# same data file, index and encoder as chat.py
+retriever = Retriever.load()
+etf_data = retriever.etf_data
 
 # Define the model name and the directory where the fine-tuned model is located
 model_name = "FINGU-AI/FinguAI-Chat-v1"
+MAX_BATCH_SIZE = 8  # sessions decoded together
+CONTEXT_PREFIXES = 16  # system prompt + ETF context prefixes whose KV states are kept
 output_dir = '../pipeline/fine_tuned_model/' + model_name
 
 # Load the tokenizer and model from the fine-tuned directory
@@ -51,12 +28,26 @@ model = PeftModel.from_pretrained(base_model, output_dir)
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 model.to(device)
 
+# one engine for all sessions: concurrent requests are decoded together, shared prompt prefixes are prefilled once
+prefix_cache = PrefixCache(model, max_size=CONTEXT_PREFIXES)
+engine = GenerationEngine(model, eos_token_id=tokenizer.eos_token_id, max_batch_size=MAX_BATCH_SIZE,
+                          prefix_cache=prefix_cache)
+
+system_prompt = (
+    "You are a financial specialist specializing in ETF portfolio construction and optimization. "
+    "Your role is to assist users by providing accurate, timely, and insightful information to guide their investment decisions. "
+    "Consider their risk tolerance, investment goals, and market conditions when offering advice."
+)
+
+# ETF snippets are rendered and tokenized once, prompts are spliced together from token segments
+context_blocks = load_or_build('../../data/etf_context_blocks.npz', etf_data, tokenizer, key_field='bbg_ticker')
+prompt_assembler = PromptAssembler(tokenizer, context_blocks, system_prompt, context_footer=".")
+# KV states of the system prompt are computed once, every request only prefills what follows
+prefix_cache.pin(prompt_assembler.system_ids())
+
 
 def search_etf(query, k=3):
-    query_embedding = embedding_model.encode([query])
-    distances, indices = index.search(query_embedding, k)
-    results = [etf_data[idx] for idx in indices[0]]
-    return results
+    return [hit.record for hit in retriever.search_one(query, k)]
 
 
 def respond(user_input, history):
@@ -71,33 +62,13 @@ def respond(user_input, history):
     #     for etf in etf_results
     # ])
 
-    etf_results = search_etf(user_input)
-    etf_context = "\n\n".join([
-        f"{etf['Ticker']} - {etf['Name']}\n{etf['Description']}"
-        for etf in etf_results
-    ])
-
-    # Construct the context for the language model
-    context = (
-        "You are a financial specialist specializing in ETF portfolio construction and optimization. "
-        "Your role is to assist users by providing accurate, timely, and insightful information to guide their investment decisions. "
-        "Consider their risk tolerance, investment goals, and market conditions when offering advice."
-        f"\n\nRelevant ETF Information:\n{etf_context}."
-    )
-
-    messages = [
-        {"role": "system", "content": context},
-        {"role": "user", "content": user_input},
-    ]
-
-    tokenized_chat = tokenizer.apply_chat_template(
-        messages, tokenize=True, add_generation_prompt=True, return_tensors="pt"
-    ).to(device)
+    # Same IDs as apply_chat_template on the system prompt + ETF context and the user turn
+    etf_keys = [etf['bbg_ticker'] for etf in etf_results]
+    tokenized_chat = prompt_assembler.input_ids(user_input, etf_keys).to(device)
 
     # Define generation parameters
     generation_params = {
         'max_new_tokens': 1000,
-        'use_cache': True,
         'do_sample': True,
         'temperature': 0.7,
         'top_p': 0.9,
@@ -105,25 +76,14 @@ def respond(user_input, history):
         'eos_token_id': tokenizer.eos_token_id,
     }
 
-    # Use a streamer for generating the response
-    streamer = TextStreamer(tokenizer)
-
-    # Generate the response
-    outputs = model.generate(tokenized_chat, **generation_params, streamer=streamer)
-    decoded_outputs = tokenizer.batch_decode(outputs)
-    raw_answer = decoded_outputs[0]
-
-    # Extract the assistant's response
-    raw_answer = raw_answer.replace("<|im_end|>", "").replace("<|im_start|>", "")
-    match = re.search(r"assistant\s*\n(.*?)(?=\nuser|\Z)", raw_answer, re.DOTALL)
-    if match:
-        answer = match.group(1).strip()
-    else:
-        answer = raw_answer.strip()
-
-    # Append the new interaction to the history
-    history.append((user_input, answer))
-    return history
+    # Generate the response, decoded in one batch with the other sessions' requests;
+    # the assistant's answer is shown as it grows
+    request = engine.submit(tokenized_chat[0], prefix_length=prompt_assembler.prefix_length(etf_keys),
+                            **generation_params)
+    history.append((user_input, ''))
+    for answer in stream_answer(tokenizer, request):
+        history[-1] = (user_input, answer)
+        yield history
 
 
 # Create the Gradio interface
@@ -135,9 +95,10 @@ with gr.Blocks() as demo:
 
     def submit_message(user_input, history):
         history = history or []
-        new_history = respond(user_input, history)
-        return new_history, ""
+        for new_history in respond(user_input, history):
+            yield new_history, ""
 
     btn.click(submit_message, [txt, chatbot], [chatbot, txt])
 
+demo.queue(default_concurrency_limit=MAX_BATCH_SIZE)
 demo.launch()
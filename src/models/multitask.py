@@ -1,4 +1,3 @@
-import random
 import re
 import sys
 import torch
@@ -9,19 +8,23 @@ import faiss
 from faiss import write_index, read_index
 from peft import PeftModel
 
+from src.dataset.index_factory import configure_search
+from src.dataset.embedding_store import read_index_shared
+
 
 # nothing happened on the tiannamen square
 ETFS_NUM = 11794
 
 MODEL_NAME = 'FINGU-AI/FinguAI-Chat-v1'
-INDEX_PATH = "../../data/etfs.index"
+INDEX_PATH = "../../data/etfs_multitask.index"  # built by src/dataset/rag_index.py
 LORA_PATH = '../pipeline/fine_tuned_model/FINGU-AI/FinguAI-Chat-v1'
 CLASS_HEAD = '../pipeline/modules/class_head.pth'
 SELECT_HEAD = '../pipeline/modules/select_head.pth'
 
 # I don't apply no_grad()
 class MultitaskLM(nn.Module):
-    def __init__(self, body_path, class_path=None, select_path=None, index_path=None, n_features=1024, lora_path=None):
+    def __init__(self, body_path, class_path=None, select_path=None, index_path=None, n_features=1024, lora_path=None,
+                 nprobe=None, ef_search=None):
         super(MultitaskLM, self).__init__()
         self.model = AutoModelForCausalLM.from_pretrained(
             body_path, output_hidden_states=True
@@ -40,7 +43,7 @@ class MultitaskLM(nn.Module):
         self.out = None
 
         self.index = None
-        self.init_index(index_path)
+        self.init_index(index_path, nprobe=nprobe, ef_search=ef_search)
         self.model.eval()
 
     def forward(self, **kwargs):
@@ -50,37 +53,52 @@ class MultitaskLM(nn.Module):
         # and then continue going
         return forw
 
-    def init_index(self, index_path):
+    def init_index(self, index_path, nprobe=None, ef_search=None):
         if index_path != None:
-            self.index = read_index(index_path)
+            # any type built by src.dataset.index_factory, search knobs only matter for IVF/HNSW
+            self.index = configure_search(read_index_shared(index_path), nprobe=nprobe, ef_search=ef_search)
             print(f"FAISS index dimensions: {self.index.d}")
 
     def classify(self, use_prev=False, **kwargs):
         if not use_prev:
             self.out = self.model(**kwargs).hidden_states[-1]
-        embedding = self.encode(True)
+        embedding = self.encode(True, **kwargs)
         return self.class_head(embedding)
 
     def encode(self, use_prev=False, **kwargs):
         if not use_prev:
             self.out = self.model(**kwargs).hidden_states[-1]
-        enc = self.out.mean(-2)
+        mask = kwargs.get('attention_mask')
+        if mask is None:
+            enc = self.out.mean(-2)
+        else:
+            # padded positions must not leak into the mean, or the vector depends on the batch it was in
+            mask = mask.unsqueeze(-1).to(self.out.dtype)
+            enc = (self.out * mask).sum(-2) / mask.sum(-2).clamp(min=1)
         normalized_enc = enc / enc.norm(dim=1)[:,None]
         print(f"Embedding shape: {normalized_enc.shape}")
         return normalized_enc
 
-    def select(self, use_prev=True, use_index=True, **kwargs):
+    def select(self, use_prev=True, use_index=True, k=5, reranker=None, query=None, texts=None, **kwargs):
+        # with a reranker (src.retrieval.rerank) the number of ETFs is decided by its score cutoff,
+        # `texts` maps a candidate index to the snippet it scores against `query`
         if not use_prev:
             self.out = self.model(**kwargs).hidden_states[-1]
 
-        embedding = self.encode(True)
+        embedding = self.encode(True, **kwargs)
         if not use_index:
             scores = self.select_head(embedding)
             # it may return non-consistent by dimensionality list of lists
-            return torch.topk(scores, 50)[1][:, :random.randint(3, 8)]
-            
-        distances, indices = self.index.search(embedding.detach().numpy(), 50)
-        return indices[0, :random.randint(3, 8)]
+            candidates = torch.topk(scores, 50)[1][0].cpu().numpy()
+        else:
+            # IDs are positions in the ETF data file, IncrementalIndex keeps them that way
+            distances, indices = self.index.search(embedding.detach().cpu().numpy(), 50)
+            candidates = indices[0][indices[0] >= 0]
+
+        if reranker is not None and query is not None:
+            candidates, _, _ = reranker.rerank(query, candidates, [texts(idx) for idx in candidates])
+            return candidates
+        return candidates[:k]
 
 if __name__ == "__main__":
     m = MultitaskLM(MODEL_NAME, lora_path=LORA_PATH, class_path=CLASS_HEAD, select_path=SELECT_HEAD)
@@ -0,0 +1,117 @@
+import numpy as np
+from scipy.optimize import minimize
+
+from src.optimization.constraints import check_solution, homogenize, is_feasible
+from src.optimization.factor_model import FactorCovariance
+from src.optimization.qp import solve_qp
+from src.optimization.sharpe import max_ratio_qp, max_sharpe
+
+
+def min_variance(mean_returns, cov_matrix, risk_free_rate, upper=None, G=None, h=None, **options):
+    """Minimum-variance weights: one active-set QP, min w'Σw s.t. 1'w = 1, 0 <= w <= upper, G w <= h."""
+    num_assets = len(cov_matrix)
+    return solve_qp(cov_matrix, np.zeros(num_assets), np.ones((1, num_assets)), [1.],
+                    upper=upper if upper is not None else np.ones(num_assets), G=G, h=h)['x']
+
+
+def max_diversification(mean_returns, cov_matrix, risk_free_rate, upper=None, G=None, h=None, **options):
+    """
+    Maximum-diversification weights, max σ'w / sqrt(w'Σw).
+
+    Same ratio structure as the Sharpe ratio with asset volatilities in place of excess
+    returns, so it is solved as the same convex QP (`sharpe.max_ratio_qp`).
+    """
+    weights = max_ratio_qp(np.sqrt(cov_matrix.diagonal()), cov_matrix, upper, G, h)
+    if weights is None:
+        raise ValueError("Constraints leave no feasible portfolio")
+    return weights
+
+
+def _coordinate(rest, variance, budget):
+    """Positive root of variance y² + rest y - budget = 0, the minimizer along one coordinate."""
+    return (-rest + np.sqrt(rest * rest + 4 * variance * budget)) / (2 * variance)
+
+
+def _dense_sweep(cov_matrix, variances, budgets, y, cov_y):
+    # Σy is updated in O(n) per coordinate
+    for i in range(len(y)):
+        new = _coordinate(cov_y[i] - variances[i] * y[i], variances[i], budgets[i])
+        cov_y += cov_matrix[:, i] * (new - y[i])
+        y[i] = new
+    return cov_y, cov_y
+
+
+def _factor_sweep(cov_matrix, variances, budgets, y, exposures):
+    # only the factor exposures B'y are tracked: (Σy)_i - Σ_ii y_i = B_i'(B'y) - |B_i|² y_i, O(k) per coordinate
+    loadings = cov_matrix.loadings
+    for i in range(len(y)):
+        new = _coordinate(loadings[i] @ exposures - (variances[i] - cov_matrix.specific[i]) * y[i],
+                          variances[i], budgets[i])
+        exposures += loadings[i] * (new - y[i])
+        y[i] = new
+    return exposures, cov_matrix @ y
+
+
+def risk_budget_ccd(cov_matrix, budgets=None, max_sweeps=500, tol=1e-10):
+    """
+    Risk-budgeting weights by cyclical coordinate descent (Griveau-Billion, Richard and Roncalli).
+
+    Minimizes ½ y'Σy - Σ b_i ln y_i; each coordinate has a closed-form minimizer, and at
+    the optimum every asset's risk contribution y_i (Σy)_i equals its budget b_i. The
+    weights are y normalized to sum to one. A sweep costs O(n²) on a dense covariance and
+    O(nk) on a `FactorCovariance`.
+    """
+    if isinstance(cov_matrix, FactorCovariance):
+        sweep = _factor_sweep
+    else:
+        cov_matrix, sweep = np.asarray(cov_matrix, dtype=float), _dense_sweep
+    num_assets = len(cov_matrix)
+    budgets = np.full(num_assets, 1. / num_assets) if budgets is None else np.asarray(budgets, dtype=float)
+    variances = cov_matrix.diagonal()
+    y = 1. / np.sqrt(variances)
+    y *= np.sqrt(budgets.sum() / (y @ (cov_matrix @ y)))
+    state = cov_matrix.loadings.T @ y if sweep is _factor_sweep else cov_matrix @ y
+    for _ in range(max_sweeps):
+        state, cov_y = sweep(cov_matrix, variances, budgets, y, state)
+        if np.abs(y * cov_y - budgets).max() <= tol * budgets.max():
+            break
+    return y / y.sum()
+
+
+def risk_parity(mean_returns, cov_matrix, risk_free_rate, upper=None, G=None, h=None, budgets=None, **options):
+    """
+    Equal-risk-contribution (or `budgets`) weights.
+
+    Unconstrained risk parity comes from coordinate descent. If that breaks a cap, the same
+    log-barrier objective is minimized under the homogenized caps with SLSQP (constrained
+    risk budgeting), starting from the unconstrained solution.
+    """
+    if not isinstance(cov_matrix, FactorCovariance):
+        cov_matrix = np.asarray(cov_matrix, dtype=float)
+    weights = risk_budget_ccd(cov_matrix, budgets)
+    if is_feasible(weights, upper, G, h):
+        return weights
+
+    num_assets = len(cov_matrix)
+    budgets = np.full(num_assets, 1. / num_assets) if budgets is None else np.asarray(budgets, dtype=float)
+    rows = homogenize(num_assets, None if upper is None else np.broadcast_to(upper, num_assets).astype(float), G, h)
+    scale = np.sqrt(budgets.sum() / (weights @ (cov_matrix @ weights)))
+    result = minimize(lambda y: 0.5 * y @ cov_matrix @ y - budgets @ np.log(y), weights * scale,
+                      jac=lambda y: cov_matrix @ y - budgets / y, method='SLSQP',
+                      bounds=[(1e-12, None)] * num_assets,
+                      constraints=[{'type': 'ineq', 'fun': lambda y: -rows @ y, 'jac': lambda y: -rows}])
+    return check_solution(result.x / result.x.sum(), result, upper, G, h)
+
+
+def max_sharpe_weights(mean_returns, cov_matrix, risk_free_rate, upper=None, G=None, h=None, solver='slsqp', **options):
+    return max_sharpe(mean_returns, cov_matrix, risk_free_rate, solver=solver,
+                      upper=1. if upper is None else upper, G=G, h=h)
+
+
+# every allocation mode: (mean_returns, cov_matrix, daily_risk_free_rate, upper, G, h, **options) -> weights
+ALLOCATORS = {
+    'max_sharpe': max_sharpe_weights,
+    'min_variance': min_variance,
+    'risk_parity': risk_parity,
+    'max_diversification': max_diversification,
+}
@@ -0,0 +1,171 @@
+import argparse
+from functools import partial
+
+import numpy as np
+
+from src.optimization.covariance import EWMACovariance, MomentCovariance, estimate
+from src.optimization.allocation import ALLOCATORS
+from src.optimization.factor_model import factor_covariance
+from src.optimization.price_store import get_price_store
+
+
+def equal_weight(mean_returns, cov_matrix, risk_free_rate):
+    return np.full(len(mean_returns), 1. / len(mean_returns))
+
+
+# the QP path of max-Sharpe, a backtest solves it at every rebalance
+STRATEGIES = {'equal_weight': equal_weight, **ALLOCATORS, 'max_sharpe': partial(ALLOCATORS['max_sharpe'], solver='qp')}
+
+
+def rebalance_indices(num_days, lookback, rebalance_every):
+    """Rows where weights are refit; each fit only sees the `lookback` rows before it."""
+    return np.arange(lookback, num_days, rebalance_every)
+
+
+def drawdowns(portfolio_returns):
+    equity = np.cumprod(1 + portfolio_returns)
+    return equity, equity / np.maximum.accumulate(equity) - 1
+
+
+def performance(portfolio_returns, risk_free_rate=0.05, turnover=None):
+    """Annualized summary of daily portfolio returns, same conventions as `get_portfolio_details`."""
+    equity, drawdown = drawdowns(portfolio_returns)
+    annualized_return = equity[-1] ** (252 / len(portfolio_returns)) - 1
+    annualized_volatility = portfolio_returns.std() * np.sqrt(252)
+    downside = portfolio_returns[portfolio_returns < 0]
+    annual_downside_deviation = downside.std() * np.sqrt(252) if len(downside) else np.nan
+    return {
+        'annualized_return': annualized_return,
+        'annualized_volatility': annualized_volatility,
+        'sharpe_ratio': (annualized_return - risk_free_rate) / annualized_volatility,
+        'sortino_ratio': (annualized_return - risk_free_rate) / annual_downside_deviation,
+        'max_drawdown': drawdown.min(),
+        'mean_turnover': np.mean(turnover) if turnover is not None else np.nan,
+    }
+
+
+def fit_weights(returns, starts, weight_fn, lookback, covariance, risk_free_rate, decay=0.94):
+    """
+    Target weights at every rebalance row.
+
+    The covariance estimator is rolled forward between rebalances with block updates
+    (see `covariance.py`) instead of being refit on every window; the mean is a rolling
+    window mean from one cumulative sum. A 'factor' model is refit on every window.
+    """
+    num_assets = returns.shape[1]
+    if covariance == 'ewma':
+        estimator = EWMACovariance(num_assets, decay=decay)
+    elif covariance != 'factor':
+        estimator = MomentCovariance(num_assets, window=lookback)
+    cumulative = np.vstack([np.zeros(num_assets), np.cumsum(returns, axis=0)])
+    weights = np.empty((len(starts), num_assets))
+    seen = starts[0] - lookback
+    for k, start in enumerate(starts):
+        if covariance == 'factor':
+            cov_matrix = factor_covariance(returns[start - lookback:start])
+        else:
+            estimator.update_many(returns[seen:start])
+            seen = start
+            cov_matrix = estimate(estimator, covariance)
+        mean_returns = (cumulative[start] - cumulative[start - lookback]) / lookback
+        weights[k] = weight_fn(mean_returns, cov_matrix, risk_free_rate / 252)
+    return weights
+
+
+def portfolio_returns(returns, starts, weights, cost_bps=0.):
+    """
+    Daily returns of buy-and-hold between rebalances, for all dates at once.
+
+    Inside a holding period the value of asset i is w_i ∏(1 + r_i), taken from one
+    cumulative sum of log returns; the portfolio return is the ratio of consecutive
+    portfolio values. Turnover is the traded fraction Σ|target - drifted| at every
+    rebalance (the first one buys in from cash), and `cost_bps` of it is charged on
+    the rebalance day.
+
+    Returns:
+        tuple: (daily returns from the first rebalance on, turnover per rebalance).
+    """
+    num_days = len(returns)
+    held = returns[starts[0]:]
+    log_growth = np.vstack([np.zeros(returns.shape[1]), np.cumsum(np.log1p(held), axis=0)])
+
+    segment = np.searchsorted(starts, np.arange(starts[0], num_days), side='right') - 1
+    segment_start = starts[segment] - starts[0]
+    # growth of every asset since the start of its holding period, times the target weight
+    growth = np.exp(log_growth[1:] - log_growth[segment_start])
+    values = np.einsum('tn,tn->t', weights[segment], growth)
+    previous = np.concatenate([[1.], values[:-1]])
+    previous[segment_start == np.arange(len(values))] = 1.
+    daily = values / previous - 1
+
+    ends = np.append(starts[1:], num_days) - starts[0] - 1
+    drifted = weights * growth[ends] / values[ends, None]
+    turnover = np.abs(weights - np.vstack([np.zeros(returns.shape[1]), drifted[:-1]])).sum(axis=1)
+    daily[starts - starts[0]] -= cost_bps / 1e4 * turnover
+    return daily, turnover
+
+
+def backtest(returns, dates=None, method='max_sharpe', weight_fn=None, lookback=252, rebalance_every=21,
+             covariance='sample', risk_free_rate=0.05, cost_bps=0.):
+    """
+    Walk-forward backtest: refit on a trailing window at every rebalance date, hold until the next one.
+
+    Args:
+        returns (np.ndarray): (T, n) daily returns without gaps.
+        dates (pd.DatetimeIndex): Date of every row.
+        method (str): One of `STRATEGIES`, ignored when `weight_fn` is given.
+        weight_fn (callable): (mean_returns, cov_matrix, daily_risk_free_rate) -> weights.
+        lookback (int): Days of history per fit.
+        rebalance_every (int): Days between rebalances.
+        covariance (str): 'sample', 'ledoit_wolf', 'rolling' or 'factor' over the lookback window, or 'ewma'.
+        risk_free_rate (float): Annual risk-free rate.
+        cost_bps (float): Transaction cost per unit of traded notional, in basis points.
+
+    Returns:
+        dict: 'dates', 'returns', 'equity', 'drawdown' (daily, from the first rebalance on),
+        'rebalance_dates', 'weights', 'turnover' (per rebalance) and 'performance'.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    if len(returns) <= lookback:
+        raise ValueError(f"Need more than {lookback} days of returns, got {len(returns)}")
+    weight_fn = weight_fn or STRATEGIES[method]
+    starts = rebalance_indices(len(returns), lookback, rebalance_every)
+
+    weights = fit_weights(returns, starts, weight_fn, lookback, covariance, risk_free_rate)
+    daily, turnover = portfolio_returns(returns, starts, weights, cost_bps=cost_bps)
+    equity, drawdown = drawdowns(daily)
+    dates = np.arange(len(returns)) if dates is None else dates
+    return {
+        'dates': dates[starts[0]:],
+        'returns': daily,
+        'equity': equity,
+        'drawdown': drawdown,
+        'rebalance_dates': dates[starts],
+        'weights': weights,
+        'turnover': turnover,
+        'performance': performance(daily, risk_free_rate, turnover),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Walk-forward backtest of optimizer strategies on etf_prices.pkl")
+    parser.add_argument("tickers", nargs="+")
+    parser.add_argument("--methods", nargs="+", default=list(STRATEGIES), choices=list(STRATEGIES))
+    parser.add_argument("--lookback", type=int, default=252)
+    parser.add_argument("--rebalance-every", type=int, default=21)
+    parser.add_argument("--covariance", default="sample")
+    parser.add_argument("--cost-bps", type=float, default=0.)
+    args = parser.parse_args()
+
+    returns, dates = get_price_store().panel(args.tickers)
+    print(f"{len(dates)} days, {dates[0].date()} to {dates[-1].date()}")
+    print(f"{'method':<20}{'return':>10}{'vol':>10}{'sharpe':>10}{'max dd':>10}{'turnover':>10}")
+    for method in args.methods:
+        result = backtest(returns, dates, method=method, lookback=args.lookback, rebalance_every=args.rebalance_every,
+                          covariance=args.covariance, cost_bps=args.cost_bps)['performance']
+        print(f"{method:<20}{result['annualized_return']:>10.2%}{result['annualized_volatility']:>10.2%}"
+              f"{result['sharpe_ratio']:>10.2f}{result['max_drawdown']:>10.2%}{result['mean_turnover']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.optimization.optimization_mpt import PortfolioOptimizer
+from src.optimization.price_store import PRICES_PATH, get_price_store
+
+
+def _init_worker(prices_path):
+    # the parent already wrote the .npy cache, so this only memory-maps it: one copy of the panel per machine
+    get_price_store(prices_path)
+
+
+def _solve_chunk(baskets, method, risk_free_rate, covariance, solver, constraints):
+    results = []
+    for tickers in baskets:
+        try:
+            optimizer = PortfolioOptimizer(list(tickers), risk_free_rate, covariance=covariance, **constraints)
+            weights = optimizer.optimize(method, solver=solver)
+            daily_return = weights @ optimizer.returns.mean().values
+            daily_volatility = np.sqrt(weights @ (optimizer.risk_model() @ weights))
+            results.append((np.asarray(weights, dtype=np.float64),
+                            *optimizer.annualize(daily_return, daily_volatility), None))
+        except (KeyError, ValueError, np.linalg.LinAlgError, RuntimeError) as error:
+            results.append((np.full(len(tickers), np.nan), np.nan, np.nan, np.nan, f"{type(error).__name__}: {error}"))
+    return results
+
+
+def optimize_many(baskets, method='max_sharpe', risk_free_rate=0.05, covariance='sample', solver='slsqp',
+                  num_workers=None, chunk_size=16, prices_path=PRICES_PATH, **constraints):
+    """
+    Optimize many baskets over a process pool sharing one memory-mapped price panel.
+
+    The price store is built (or its cache validated) once in the calling process;
+    workers memory-map the same `.npy` files, so the panel is never copied or pickled.
+    Baskets are sent in chunks to keep inter-process traffic small. A failing basket
+    (unknown ticker, no common history) gets NaNs and an error message instead of
+    aborting the batch.
+
+    Args:
+        baskets (list): Ticker lists.
+        method (str): One of `optimization_mpt.METHODS`.
+        risk_free_rate (float): Annual risk-free rate.
+        covariance (str): Covariance estimator, see `covariance.ESTIMATORS`.
+        solver (str): Max-Sharpe solver, see `sharpe.SOLVERS`.
+        num_workers (int): Worker processes, defaults to the number of CPU cores; 1 runs in-process.
+        chunk_size (int): Baskets per task.
+        prices_path (str): Price pickle shared with the workers.
+        **constraints: `max_weight`, `groups` and `group_caps`, applied to every basket.
+
+    Returns:
+        dict: Columnar results. Per basket: 'annualized_return', 'annualized_volatility', 'sharpe_ratio'
+        and 'error'. All weights are in one flat 'weights' array aligned with flat 'tickers'; basket i
+        spans offsets[i]:offsets[i + 1].
+    """
+    baskets = [list(tickers) for tickers in baskets]
+    num_workers = num_workers or os.cpu_count()
+    get_price_store(prices_path)
+
+    chunks = [baskets[i:i + chunk_size] for i in range(0, len(baskets), chunk_size)]
+    options = (method, risk_free_rate, covariance, solver, constraints)
+    if num_workers == 1 or len(chunks) <= 1:
+        solved = [_solve_chunk(chunk, *options) for chunk in chunks]
+    else:
+        # spawn: forked BLAS thread pools are not safe to reuse
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(prices_path,)) as pool:
+            solved = list(pool.map(_solve_chunk, chunks, *[[option] * len(chunks) for option in options]))
+    results = [result for chunk in solved for result in chunk]
+
+    offsets = np.zeros(len(baskets) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(tickers) for tickers in baskets])
+    return {
+        'tickers': [ticker for tickers in baskets for ticker in tickers],
+        'weights': np.concatenate([result[0] for result in results]) if results else np.zeros(0),
+        'offsets': offsets,
+        'annualized_return': np.array([result[1] for result in results], dtype=np.float64),
+        'annualized_volatility': np.array([result[2] for result in results], dtype=np.float64),
+        'sharpe_ratio': np.array([result[3] for result in results], dtype=np.float64),
+        'error': [result[4] for result in results],
+    }
+
+
+def basket_weights(results, i):
+    """(tickers, weights) of basket `i` in an `optimize_many` result."""
+    start, end = results['offsets'][i], results['offsets'][i + 1]
+    return results['tickers'][start:end], results['weights'][start:end]
@@ -0,0 +1,73 @@
+import numpy as np
+
+
+def constraint_matrices(tickers, max_weight=None, groups=None, group_caps=None):
+    """
+    Per-asset caps and group caps of a basket as solver input.
+
+    Args:
+        tickers (list): Basket, in weight order.
+        max_weight (float or dict): Cap for every asset, or ticker -> cap (missing tickers are uncapped).
+        groups (dict): Ticker -> group, e.g. the ETF's 'asset_class_focus'.
+        group_caps (dict): Group -> cap on the summed weight of its members.
+
+    Returns:
+        tuple: (upper, G, h) with upper bounds of shape (n,) and group rows G w <= h,
+        G and h are None without group caps.
+    """
+    num_assets = len(tickers)
+    if max_weight is None:
+        upper = np.ones(num_assets)
+    elif isinstance(max_weight, dict):
+        upper = np.array([max_weight.get(ticker, 1.) for ticker in tickers], dtype=float)
+    else:
+        upper = np.full(num_assets, float(max_weight))
+
+    rows, caps = [], []
+    for group, cap in (group_caps or {}).items():
+        members = np.array([(groups or {}).get(ticker) == group for ticker in tickers], dtype=float)
+        if members.any() and cap < members.sum():
+            rows.append(members)
+            caps.append(cap)
+    if not rows:
+        return upper, None, None
+    return upper, np.array(rows), np.array(caps, dtype=float)
+
+
+def is_feasible(weights, upper=None, G=None, h=None, tol=1e-8):
+    if upper is not None and np.any(weights > upper + tol):
+        return False
+    return G is None or bool(np.all(G @ weights <= h + tol))
+
+
+def check_solution(weights, result, upper=None, G=None, h=None, tol=1e-6):
+    """
+    Weights of a SciPy `minimize` run, refusing unconverged ones and ones that break the caps.
+
+    Raises:
+        ValueError: Like the QP allocators when the caps leave no feasible portfolio.
+    """
+    budget_ok = abs(weights.sum() - 1) <= tol and np.all(weights >= -tol)
+    if not (budget_ok and is_feasible(weights, upper, G, h, tol=tol)):
+        raise ValueError("Constraints leave no feasible portfolio")
+    if not result.success:
+        raise ValueError(f"Optimizer did not converge: {result.message}")
+    return weights
+
+
+def homogenize(num_assets, upper=None, G=None, h=None):
+    """
+    Caps on w rewritten for y = κw (κ = 1'y > 0): w_i <= u_i becomes y_i - u_i 1'y <= 0 and
+    G w <= h becomes (G - h 1') y <= 0. Used by the ratio objectives (Sharpe, diversification).
+
+    Returns:
+        np.ndarray: (k, n) rows R with R y <= 0, or None without caps.
+    """
+    rows = []
+    if upper is not None:
+        capped = np.flatnonzero(upper < 1)
+        rows.append(np.eye(num_assets)[capped] - upper[capped, None])
+    if G is not None:
+        rows.append(G - h[:, None])
+    rows = [block for block in rows if len(block)]
+    return np.vstack(rows) if rows else None
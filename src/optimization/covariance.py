@@ -0,0 +1,260 @@
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+
+
+ESTIMATORS = ('sample', 'ledoit_wolf', 'ewma', 'rolling')
+EWMA_DECAY = 0.94  # RiskMetrics daily decay
+ROLLING_WINDOW = 252
+
+
+def ledoit_wolf_shrinkage(emp_cov, squared_moments, num_obs):
+    """
+    Ledoit-Wolf intensity of shrinking towards a scaled identity.
+
+    Args:
+        emp_cov (np.ndarray): Biased (divided by T) covariance of the centered returns.
+        squared_moments (np.ndarray): Σ_t (x_t - m)²(x_t - m)²' of the centered returns.
+        num_obs (int): Number of observations T.
+
+    Returns:
+        tuple: (shrinkage in [0, 1], target scale mu).
+    """
+    num_assets = len(emp_cov)
+    mu = np.trace(emp_cov) / num_assets
+    delta = (np.sum(emp_cov ** 2) - 2 * mu * np.trace(emp_cov) + num_assets * mu ** 2) / num_assets
+    beta = (squared_moments.sum() / num_obs - np.sum(emp_cov ** 2)) / (num_assets * num_obs)
+    beta = min(beta, delta)
+    return (beta / delta if delta > 0 else 0.), mu
+
+
+def shrink(emp_cov, shrinkage, mu):
+    shrunk = (1 - shrinkage) * emp_cov
+    shrunk[np.diag_indices_from(shrunk)] += shrinkage * mu
+    return shrunk
+
+
+def ledoit_wolf(returns):
+    """Ledoit-Wolf shrunk covariance of a (T, n) returns matrix, well-conditioned even when n > T."""
+    returns = np.asarray(returns, dtype=np.float64)
+    centered = returns - returns.mean(axis=0)
+    emp_cov = centered.T @ centered / len(returns)
+    squared = centered ** 2
+    shrinkage, mu = ledoit_wolf_shrinkage(emp_cov, squared.T @ squared, len(returns))
+    return shrink(emp_cov, shrinkage, mu)
+
+
+def ewma_covariance(returns, decay=EWMA_DECAY):
+    """RiskMetrics zero-mean EWMA covariance, the most recent row weighted highest."""
+    returns = np.asarray(returns, dtype=np.float64)
+    weights = (1 - decay) * decay ** np.arange(len(returns) - 1, -1, -1)
+    # the recursion starts from the first outer product, so it carries the weight the older history would have
+    weights[0] = decay ** (len(returns) - 1)
+    return (returns * weights[:, None]).T @ returns
+
+
+class MomentCovariance:
+    """
+    Sample and Ledoit-Wolf covariance from running moment sums, updated in O(n²) per day.
+
+    Keeps Σx, Σxx', Σx²x' and Σx²x²' over all rows (or over the last `window` rows, with
+    the oldest row subtracted on every update), which is everything the sample covariance
+    and the Ledoit-Wolf intensity need.
+
+    Args:
+        num_assets (int): Number of columns.
+        window (int): Rolling window length, None for an expanding window.
+    """
+
+    def __init__(self, num_assets, window=None):
+        self.window = window
+        self.count = 0
+        self.sum = np.zeros(num_assets)
+        self.cross = np.zeros((num_assets, num_assets))
+        self.cubic = np.zeros((num_assets, num_assets))
+        self.quartic = np.zeros((num_assets, num_assets))
+        self.rows = deque() if window else None
+
+    def _accumulate(self, rows, sign):
+        squared = rows ** 2
+        self.count += sign * len(rows)
+        self.sum += sign * rows.sum(axis=0)
+        self.cross += sign * (rows.T @ rows)
+        self.cubic += sign * (squared.T @ rows)
+        self.quartic += sign * (squared.T @ squared)
+
+    def fit(self, returns):
+        returns = np.asarray(returns, dtype=np.float64)
+        if self.window:
+            returns = returns[-self.window:]
+            self.rows.extend(returns)
+        self._accumulate(returns, 1)
+        return self
+
+    def update(self, row):
+        row = np.asarray(row, dtype=np.float64)[None]
+        self._accumulate(row, 1)
+        if self.window:
+            self.rows.append(row[0])
+            if len(self.rows) > self.window:
+                self._accumulate(self.rows.popleft()[None], -1)
+        return self
+
+    def update_many(self, rows):
+        """`update` for a block of rows, with the rows leaving the window subtracted in one go."""
+        rows = np.asarray(rows, dtype=np.float64)
+        if not len(rows):
+            return self
+        self._accumulate(rows, 1)
+        if self.window:
+            self.rows.extend(rows)
+            excess = len(self.rows) - self.window
+            if excess > 0:
+                self._accumulate(np.array([self.rows.popleft() for _ in range(excess)]), -1)
+        return self
+
+    def mean(self):
+        return self.sum / self.count
+
+    def emp_cov(self):
+        """Biased covariance, Σ(x - m)(x - m)' / T."""
+        m = self.mean()
+        return self.cross / self.count - np.outer(m, m)
+
+    def sample(self):
+        return self.emp_cov() * self.count / (self.count - 1)
+
+    def centered_quartic(self):
+        """Σ_t (x_t - m)²(x_t - m)²' expanded in the raw sums."""
+        m, s, T = self.mean(), self.sum, self.count
+        m2 = np.diag(self.cross)
+        return (self.quartic
+                - 2 * self.cubic * m[None, :] - 2 * self.cubic.T * m[:, None]
+                + 4 * np.outer(m, m) * self.cross
+                + np.outer(m2, m ** 2) + np.outer(m ** 2, m2)
+                - 2 * np.outer(s * m, m ** 2) - 2 * np.outer(m ** 2, s * m)
+                + T * np.outer(m ** 2, m ** 2))
+
+    def ledoit_wolf(self):
+        emp_cov = self.emp_cov()
+        shrinkage, mu = ledoit_wolf_shrinkage(emp_cov, self.centered_quartic(), self.count)
+        return shrink(emp_cov, shrinkage, mu)
+
+
+class EWMACovariance:
+    """
+    RiskMetrics EWMA covariance, Σ_t = λ Σ_{t-1} + (1 - λ) x_t x_t'.
+
+    Args:
+        num_assets (int): Number of columns.
+        decay (float): λ, 0.94 is the RiskMetrics daily value.
+    """
+
+    def __init__(self, num_assets, decay=EWMA_DECAY):
+        self.decay = decay
+        self.cov = np.zeros((num_assets, num_assets))
+        self.count = 0
+
+    def fit(self, returns):
+        returns = np.asarray(returns, dtype=np.float64)
+        if self.count:
+            for row in returns:
+                self.update(row)
+        elif len(returns):
+            self.cov = ewma_covariance(returns, self.decay)
+            self.count = len(returns)
+        return self
+
+    def update_many(self, rows):
+        rows = np.asarray(rows, dtype=np.float64)
+        if not self.count:
+            return self.fit(rows)
+        weights = (1 - self.decay) * self.decay ** np.arange(len(rows) - 1, -1, -1)
+        self.cov = self.decay ** len(rows) * self.cov + (rows * weights[:, None]).T @ rows
+        self.count += len(rows)
+        return self
+
+    def update(self, row):
+        row = np.asarray(row, dtype=np.float64)
+        self.cov = np.outer(row, row) if not self.count else self.decay * self.cov + (1 - self.decay) * np.outer(row, row)
+        self.count += 1
+        return self
+
+
+def make_estimator(method, num_assets, decay=EWMA_DECAY, window=ROLLING_WINDOW):
+    if method == 'ewma':
+        return EWMACovariance(num_assets, decay=decay)
+    if method == 'rolling':
+        return MomentCovariance(num_assets, window=window)
+    if method in ('sample', 'ledoit_wolf'):
+        return MomentCovariance(num_assets)
+    raise ValueError(f"Unknown covariance estimator {method!r}, expected one of {ESTIMATORS}")
+
+
+def estimate(estimator, method):
+    if method == 'ewma':
+        return estimator.cov.copy()
+    if method == 'ledoit_wolf':
+        return estimator.ledoit_wolf()
+    return estimator.sample()
+
+
+def covariance(returns, method='sample', **params):
+    """Covariance of a (T, n) returns matrix with one of `ESTIMATORS`."""
+    return estimate(make_estimator(method, np.shape(returns)[1], **params).fit(returns), method)
+
+
+class CovarianceCache:
+    """
+    Covariance estimators kept per (tickers, method, params), rolled forward on new data.
+
+    When the returns passed for a key extend the ones seen last time (same dates up
+    to the previous last date), only the new rows are fed to the estimator, so a daily
+    refresh costs O(n²) per new day instead of a full pass over the history.
+
+    Args:
+        max_size (int): Number of ticker sets kept.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def extends(returns, dates, seen, last_row):
+        """True if `returns` are the rows seen before plus new ones; the last seen row catches revised history."""
+        return (len(dates) >= len(seen) and dates[:len(seen)].equals(seen)
+                and np.array_equal(np.asarray(returns[len(seen) - 1], dtype=np.float64), last_row))
+
+    def get(self, tickers, returns, dates, method='sample', **params):
+        """
+        Args:
+            tickers (list): Basket, in column order of `returns`.
+            returns (np.ndarray): (T, n) returns.
+            dates (pd.DatetimeIndex): Date of every row.
+            method (str): One of `ESTIMATORS`.
+            **params: `decay` for 'ewma', `window` for 'rolling'.
+
+        Returns:
+            np.ndarray: (n, n) covariance.
+        """
+        key = (tuple(tickers), method, tuple(sorted(params.items())))
+        with self.lock:
+            estimator, seen, last_row = self.entries.get(key, (None, None, None))
+            if estimator is not None and self.extends(returns, dates, seen, last_row):
+                for row in np.asarray(returns[len(seen):], dtype=np.float64):
+                    estimator.update(row)
+            else:
+                estimator = make_estimator(method, len(tickers), **params).fit(returns)
+
+            self.entries[key] = (estimator, dates, np.array(returns[-1], dtype=np.float64))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            return estimate(estimator, method)
+
+
+# shared by every optimizer in this process
+default_covariance_cache = CovarianceCache()
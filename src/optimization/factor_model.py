@@ -0,0 +1,95 @@
+import numpy as np
+from scipy.sparse.linalg import svds
+
+
+NUM_FACTORS = 20
+SPECIFIC_FLOOR = 1e-3  # smallest specific variance, as a fraction of the asset's total variance
+
+
+class FactorCovariance:
+    """
+    Covariance as B B' + diag(d): k factor loadings per asset plus a specific variance.
+
+    Stored in O(nk) memory. Products with vectors and matrices cost O(nk) per column, so
+    `cov @ w`, `w @ cov @ w` and the Sharpe gradient (see sharpe.py) never build an n × n
+    matrix. `np.asarray(cov)` densifies for the solvers that need the full matrix.
+
+    Args:
+        loadings (np.ndarray): (n, k) B.
+        specific (np.ndarray): (n,) d.
+    """
+
+    # numpy defers `w @ cov` to __rmatmul__ instead of converting cov to an array
+    __array_ufunc__ = None
+
+    def __init__(self, loadings, specific):
+        self.loadings = np.asarray(loadings, dtype=np.float64)
+        self.specific = np.asarray(specific, dtype=np.float64)
+        self.shape = (len(self.specific), len(self.specific))
+
+    def __len__(self):
+        return len(self.specific)
+
+    @property
+    def num_factors(self):
+        return self.loadings.shape[1]
+
+    def __matmul__(self, other):
+        other = np.asarray(other, dtype=np.float64)
+        specific = self.specific if other.ndim == 1 else self.specific[:, None]
+        return self.loadings @ (self.loadings.T @ other) + specific * other
+
+    def __rmatmul__(self, other):
+        # symmetric: x'C = (C x)'
+        return (self @ np.asarray(other, dtype=np.float64).T).T
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.dense()
+        return dense if dtype is None else dense.astype(dtype, copy=False)
+
+    def diagonal(self):
+        return np.einsum('ik,ik->i', self.loadings, self.loadings) + self.specific
+
+    def variance(self, weights):
+        exposures = self.loadings.T @ weights
+        return exposures @ exposures + self.specific @ weights ** 2
+
+    def dense(self):
+        dense = self.loadings @ self.loadings.T
+        dense[np.diag_indices_from(dense)] += self.specific
+        return dense
+
+
+def factor_covariance(returns, num_factors=NUM_FACTORS):
+    """
+    Statistical factor model of a (T, n) returns matrix by truncated SVD.
+
+    The factors are the top k principal components of the centered returns, B = V_k S_k / sqrt(T - 1),
+    and every asset's specific variance is what the factors leave of its sample variance, so
+    the diagonal matches the sample covariance (down to `SPECIFIC_FLOOR`). Only the k leading
+    singular triplets are computed; the n × n sample covariance is never formed.
+
+    Args:
+        returns (np.ndarray): (T, n) returns without gaps.
+        num_factors (int): k, capped at min(T, n) - 1.
+
+    Returns:
+        FactorCovariance: Low-rank-plus-diagonal covariance.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    num_obs, num_assets = returns.shape
+    centered = returns - returns.mean(axis=0)
+    variances = np.einsum('ti,ti->i', centered, centered) / (num_obs - 1)
+    num_factors = max(min(num_factors, num_obs - 1, num_assets - 1), 0)
+    if not num_factors:
+        return FactorCovariance(np.zeros((num_assets, 0)), variances)
+
+    if num_factors < min(num_obs, num_assets) // 2:
+        # fixed start vector: ARPACK otherwise starts from a random one
+        _, singular_values, vt = svds(centered, k=num_factors, v0=np.ones(min(num_obs, num_assets)))
+    else:
+        _, singular_values, vt = np.linalg.svd(centered, full_matrices=False)
+        singular_values, vt = singular_values[:num_factors], vt[:num_factors]
+    loadings = vt.T * (singular_values / np.sqrt(num_obs - 1))
+    common = np.einsum('ik,ik->i', loadings, loadings)
+    return FactorCovariance(loadings, np.maximum(variances - common, SPECIFIC_FLOOR * variances))
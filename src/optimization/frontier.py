@@ -0,0 +1,177 @@
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+
+from src.optimization.qp import KKTSolver, feasible_start, solve_qp
+
+
+def _bounds(num_assets, lower, upper):
+    lower = np.zeros(num_assets) if lower is None else np.broadcast_to(lower, num_assets).astype(float)
+    upper = np.ones(num_assets) if upper is None else np.broadcast_to(upper, num_assets).astype(float)
+    return lower, upper
+
+
+def corner_portfolio(mean_returns, lower=None, upper=None, highest=True):
+    """Highest (or lowest) return fully invested portfolio in the box: fill assets in order of return."""
+    mean_returns = np.asarray(mean_returns, dtype=float)
+    lower, upper = _bounds(len(mean_returns), lower, upper)
+    x = lower.copy()
+    left = 1. - x.sum()
+    for j in (np.argsort(-mean_returns) if highest else np.argsort(mean_returns)):
+        take = min(upper[j] - x[j], left)
+        x[j] += take
+        left -= take
+        if left <= 0:
+            break
+    return x
+
+
+def min_variance_portfolio(cov_matrix, lower=None, upper=None, kkt=None):
+    cov_matrix = np.asarray(cov_matrix, dtype=float)
+    lower, upper = _bounds(len(cov_matrix), lower, upper)
+    n = len(cov_matrix)
+    return solve_qp(cov_matrix, np.zeros(n), np.ones((1, n)), [1.], lower, upper, kkt=kkt)['x']
+
+
+def closed_form_frontier(mean_returns, cov_matrix, target_returns):
+    """
+    Fully invested frontier with short sales allowed, for all targets at once.
+
+    One Cholesky factorization of the covariance gives Σ⁻¹1 and Σ⁻¹μ; every frontier
+    portfolio is a combination of the two.
+
+    Returns:
+        tuple: (weights, volatilities) with weights of shape (len(target_returns), n).
+    """
+    mean_returns = np.asarray(mean_returns, dtype=float)
+    target_returns = np.asarray(target_returns, dtype=float)
+    factor = cho_factor(np.asarray(cov_matrix, dtype=float))
+    inv_ones, inv_mean = cho_solve(factor, np.column_stack([np.ones(len(mean_returns)), mean_returns])).T
+    a, b, c = inv_ones.sum(), inv_mean.sum(), mean_returns @ inv_mean
+    d = a * c - b * b
+    weights = (np.outer(c - b * target_returns, inv_ones) + np.outer(a * target_returns - b, inv_mean)) / d
+    variances = (a * target_returns ** 2 - 2 * b * target_returns + c) / d
+    return weights, np.sqrt(np.maximum(variances, 0.))
+
+
+def _sweep(mean_returns, cov_matrix, targets, start, anchor, lower, upper, kkt=None):
+    """Solve the target-return problems in `targets` (ordered away from `start`) warm-starting each from the previous."""
+    n = len(mean_returns)
+    kkt = KKTSolver(cov_matrix) if kkt is None else kkt
+    A = np.vstack([np.ones(n), mean_returns])
+    zeros = np.zeros(n)
+    weights = np.empty((len(targets), n))
+    x, anchor_return = start, anchor @ mean_returns
+    for i, target in enumerate(targets):
+        shift = target - x @ mean_returns
+        # move along the current piece of the frontier: same working set, only the target changed
+        free = np.flatnonzero((x > lower + 1e-12) & (x < upper - 1e-12))
+        guess = x.copy()
+        guess[free] += kkt(A, zeros, np.array([0., shift]), free)[0]
+        if np.all(guess >= lower - 1e-12) and np.all(guess <= upper + 1e-12) and abs(A[1] @ guess - target) < 1e-12:
+            x0 = guess
+        else:
+            # the piece ends before the target, mixing in the corner portfolio is always feasible
+            theta = shift / (anchor_return - x @ mean_returns)
+            x0 = x + theta * (anchor - x)
+        x = solve_qp(cov_matrix, zeros, A, [1., target], lower, upper, x0=x0, kkt=kkt)['x']
+        weights[i] = x
+    return weights
+
+
+def efficient_frontier(mean_returns, cov_matrix, num_points=50, target_returns=None, lower=None, upper=None):
+    """
+    Minimum-variance portfolios for a grid of target returns, long-only (box bounds) by default.
+
+    Targets are swept outward from the minimum-variance portfolio; each solve starts
+    from its neighbour, first by moving along the neighbour's frontier piece (exact
+    when no bound changes) and otherwise from a mix with the corner portfolio. Most
+    targets take one or two active-set iterations. All solves share one `KKTSolver`, so
+    the Cholesky factor of the covariance restricted to a piece's free assets is computed
+    once per piece, not once per iteration.
+
+    Args:
+        mean_returns (np.ndarray): (n,) expected returns.
+        cov_matrix (np.ndarray): (n, n) covariance.
+        num_points (int): Grid size between the minimum-variance and maximum-return portfolios.
+        target_returns (np.ndarray): Explicit targets instead of the grid.
+        lower (np.ndarray): Per-asset lower bounds, zeros by default.
+        upper (np.ndarray): Per-asset upper bounds, ones by default.
+
+    Returns:
+        dict: 'returns', 'volatilities' and 'weights' (shape (num_targets, n)), sorted by return.
+    """
+    mean_returns = np.asarray(mean_returns, dtype=float)
+    cov_matrix = np.asarray(cov_matrix, dtype=float)
+    lower, upper = _bounds(len(mean_returns), lower, upper)
+    if feasible_start(len(mean_returns), lower, upper) is None:
+        raise ValueError("Bounds leave no fully invested portfolio")
+
+    kkt = KKTSolver(cov_matrix)
+    min_var = min_variance_portfolio(cov_matrix, lower, upper, kkt=kkt)
+    highest = corner_portfolio(mean_returns, lower, upper, highest=True)
+    lowest = corner_portfolio(mean_returns, lower, upper, highest=False)
+    if target_returns is None:
+        target_returns = np.linspace(min_var @ mean_returns, highest @ mean_returns, num_points)
+    target_returns = np.sort(np.asarray(target_returns, dtype=float))
+    if target_returns[0] < lowest @ mean_returns - 1e-12 or target_returns[-1] > highest @ mean_returns + 1e-12:
+        raise ValueError("Target returns outside of what the bounds allow")
+
+    split = np.searchsorted(target_returns, min_var @ mean_returns)
+    weights = np.empty((len(target_returns), len(mean_returns)))
+    weights[split:] = _sweep(mean_returns, cov_matrix, target_returns[split:], min_var, highest, lower, upper, kkt)
+    weights[:split] = _sweep(mean_returns, cov_matrix, target_returns[:split][::-1], min_var, lowest, lower, upper,
+                             kkt)[::-1]
+
+    variances = np.einsum('ij,jk,ik->i', weights, cov_matrix, weights)
+    return {
+        'returns': weights @ mean_returns,
+        'volatilities': np.sqrt(np.maximum(variances, 0.)),
+        'weights': weights,
+    }
+
+
+def portfolios_for_volatility(mean_returns, cov_matrix, target_volatilities, lower=None, upper=None,
+                              num_points=50, tol=1e-10):
+    """
+    Highest-return portfolios whose volatility matches each target.
+
+    The frontier grid brackets every target, then the target return is bisected inside its
+    bracket with warm-started solves. Targets below the minimum-variance volatility get the
+    minimum-variance portfolio, targets above the maximum-return one get that corner.
+
+    Returns:
+        dict: Same layout as `efficient_frontier`, in the order of `target_volatilities`.
+    """
+    mean_returns = np.asarray(mean_returns, dtype=float)
+    cov_matrix = np.asarray(cov_matrix, dtype=float)
+    lower, upper = _bounds(len(mean_returns), lower, upper)
+    target_volatilities = np.atleast_1d(np.asarray(target_volatilities, dtype=float))
+    grid = efficient_frontier(mean_returns, cov_matrix, num_points=num_points, lower=lower, upper=upper)
+    # on the efficient branch volatility grows with return, np.maximum.accumulate guards against round-off
+    grid_vols = np.maximum.accumulate(grid['volatilities'])
+    volatility = lambda w: np.sqrt(max(w @ cov_matrix @ w, 0.))
+
+    weights = np.empty((len(target_volatilities), len(mean_returns)))
+    for i, target in enumerate(target_volatilities):
+        j = np.searchsorted(grid_vols, target)
+        if j == 0 or j == len(grid_vols):
+            weights[i] = grid['weights'][min(j, len(grid_vols) - 1)]
+            continue
+        low, high = grid['returns'][j - 1], grid['returns'][j]
+        start = grid['weights'][j - 1]
+        w = start
+        while high - low > tol * max(1., abs(high)):
+            middle = (low + high) / 2
+            w = _sweep(mean_returns, cov_matrix, [middle], start, grid['weights'][-1], lower, upper)[0]
+            if volatility(w) < target:
+                low, start = middle, w
+            else:
+                high = middle
+        weights[i] = w
+
+    variances = np.einsum('ij,jk,ik->i', weights, cov_matrix, weights)
+    return {
+        'returns': weights @ mean_returns,
+        'volatilities': np.sqrt(np.maximum(variances, 0.)),
+        'weights': weights,
+    }
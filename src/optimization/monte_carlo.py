@@ -0,0 +1,101 @@
+import numpy as np
+
+
+PATH_BLOCK = 1024  # paths per random stream, fixes the numbers for a seed regardless of memory chunking
+CONFIDENCE_LEVELS = (0.95, 0.99)
+
+
+def cholesky_factor(cov_matrix):
+    """Cholesky factor of the covariance, with negative eigenvalues clipped if it is not positive definite."""
+    try:
+        return np.linalg.cholesky(cov_matrix)
+    except np.linalg.LinAlgError:
+        values, vectors = np.linalg.eigh(cov_matrix)
+        return vectors * np.sqrt(np.maximum(values, 0.))
+
+
+def simulate_block(rng, weights, mean_returns, factor, num_paths, horizon, rebalance, slab_days):
+    """Terminal return and max drawdown of `num_paths` paths, drawn time-major in slabs of `slab_days` days."""
+    value = np.ones(num_paths)
+    peak = np.ones(num_paths)
+    max_drawdown = np.zeros(num_paths)
+    holdings = np.tile(weights, (num_paths, 1))
+    for start in range(0, horizon, slab_days):
+        days = min(slab_days, horizon - start)
+        # one batched draw of correlated asset returns for the whole slab: (days, paths, assets)
+        growth = np.maximum(1 + mean_returns + rng.standard_normal((days, num_paths, len(weights))) @ factor.T, 0.)
+        if rebalance:
+            values = value * np.cumprod(growth @ weights, axis=0)
+        else:
+            grown = holdings * np.cumprod(growth, axis=0)
+            values = grown.sum(axis=2)
+            holdings = grown[-1]
+        peaks = np.maximum(peak, np.maximum.accumulate(values, axis=0))
+        max_drawdown = np.minimum(max_drawdown, (values / peaks - 1).min(axis=0))
+        value, peak = values[-1], peaks[-1]
+    return value - 1, max_drawdown
+
+
+def simulate(weights, mean_returns, cov_matrix, horizon=252, num_paths=10000, seed=0, rebalance=False,
+             max_memory_mb=64):
+    """
+    Monte Carlo paths of a portfolio under multivariate normal daily returns.
+
+    Paths are generated in blocks of `PATH_BLOCK` with one random stream each, and
+    every block in time slabs sized to `max_memory_mb`. Draws are time-major, so the
+    same seed gives the same paths (up to rounding) whatever the memory limit.
+
+    Args:
+        weights (np.ndarray): (n,) portfolio weights.
+        mean_returns (np.ndarray): (n,) daily expected returns.
+        cov_matrix (np.ndarray): (n, n) daily covariance.
+        horizon (int): Days per path.
+        num_paths (int): Number of paths.
+        seed (int): Seed of the random streams.
+        rebalance (bool): Rebalance to `weights` daily instead of buy-and-hold.
+        max_memory_mb (float): Bound on the size of one slab of draws.
+
+    Returns:
+        tuple: (terminal returns, max drawdowns), one per path.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    mean_returns = np.asarray(mean_returns, dtype=np.float64)
+    factor = cholesky_factor(np.asarray(cov_matrix, dtype=np.float64))
+
+    terminal = np.empty(num_paths)
+    max_drawdown = np.empty(num_paths)
+    streams = np.random.SeedSequence(seed).spawn(-(-num_paths // PATH_BLOCK))
+    for block, stream in enumerate(streams):
+        start = block * PATH_BLOCK
+        paths = min(PATH_BLOCK, num_paths - start)
+        # the cumulative products hold a couple of arrays of the draw's size at once
+        slab_days = max(1, int(max_memory_mb * 2 ** 20 / (3 * 8 * paths * len(weights))))
+        terminal[start:start + paths], max_drawdown[start:start + paths] = simulate_block(
+            np.random.default_rng(stream), weights, mean_returns, factor, paths, horizon, rebalance, slab_days)
+    return terminal, max_drawdown
+
+
+def risk_report(terminal, max_drawdown, confidence_levels=CONFIDENCE_LEVELS):
+    """
+    VaR/CVaR of the horizon return (as positive losses), max-drawdown distribution and probability of loss.
+    """
+    losses = -terminal
+    report = {
+        'probability_of_loss': float(np.mean(terminal < 0)),
+        'expected_return': float(terminal.mean()),
+        'max_drawdown_mean': float(max_drawdown.mean()),
+        'max_drawdown_percentiles': {q: float(np.percentile(max_drawdown, q)) for q in (5, 50, 95)},
+    }
+    for level in confidence_levels:
+        var = np.quantile(losses, level)
+        report[f'var_{level:.0%}'] = float(var)
+        report[f'cvar_{level:.0%}'] = float(losses[losses >= var].mean())
+    return report
+
+
+def tail_risk(weights, mean_returns, cov_matrix, horizon=252, num_paths=10000, seed=0, rebalance=False,
+              confidence_levels=CONFIDENCE_LEVELS, max_memory_mb=64):
+    """`simulate` followed by `risk_report`."""
+    terminal, max_drawdown = simulate(weights, mean_returns, cov_matrix, horizon=horizon, num_paths=num_paths,
+                                      seed=seed, rebalance=rebalance, max_memory_mb=max_memory_mb)
+    return risk_report(terminal, max_drawdown, confidence_levels)
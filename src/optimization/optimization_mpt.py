@@ -1,8 +1,20 @@
 import pandas as pd
 import numpy as np
-from scipy.optimize import minimize
 import os
 
+from src.optimization.price_store import BENCHMARK, get_price_store
+from src.optimization.covariance import covariance, default_covariance_cache
+from src.optimization.factor_model import NUM_FACTORS, factor_covariance
+from src.optimization.sharpe import max_sharpe
+from src.optimization.allocation import ALLOCATORS
+from src.optimization.constraints import constraint_matrices
+from src.optimization.result_cache import default_result_cache
+from src.optimization.backtest import backtest
+from src.optimization.monte_carlo import tail_risk
+from src.optimization.frontier import closed_form_frontier, efficient_frontier, portfolios_for_volatility
+
+METHODS = tuple(ALLOCATORS)
+
 test_tickers = ['SPY US Equity', 'IVV US Equity', 'VO US Equity', '510050 CH Equity']
 
 current_file_path = os.path.abspath(os.path.dirname(__file__))
@@ -14,22 +26,36 @@ abs_path = lambda path: os.path.abspath(os.path.join(current_file_path, path))
 
 
 class PortfolioOptimizer:
-    def __init__(self, tickers, risk_free_rate=0.05, data=None):
+    def __init__(self, tickers, risk_free_rate=0.05, data=None, covariance='sample', max_weight=None, groups=None,
+                 group_caps=None, num_factors=NUM_FACTORS):
         self.tickers = tickers
         self.risk_free_rate = risk_free_rate
-        self.data, self.benchmark = self.load_data(data)
-        self.returns, self.benchmark_returns = self.calculate_returns()
-
-    def load_data(self, data=None):
-        # Load the CSV file containing daily returns
+        # per-asset caps and caps per group (e.g. asset class) shared by every allocation method
+        self.upper, self.G, self.h = constraint_matrices(tickers, max_weight, groups, group_caps)
+        # 'sample', 'ledoit_wolf', 'ewma' or 'rolling' (see covariance.py), or 'factor' (see factor_model.py)
+        self.covariance = covariance
+        self.num_factors = num_factors
+        self.cov_model = None
+        self.statistics = None
+        self.shared_data = data is None
         if data is None:
-            data = pd.read_pickle('../../data/etf_prices.pkl')
+            # shared panel, prices and returns are only sliced, never re-read or recomputed
+            store = get_price_store()
+            self.data = store.frame(self.tickers, returns=False, dropna=False)
+            self.benchmark = store.series(BENCHMARK, returns=False, dropna=False)
+            self.returns = store.frame(self.tickers)
+            self.benchmark_returns = store.series(BENCHMARK)
+        else:
+            self.data, self.benchmark = self.load_data(data)
+            self.returns, self.benchmark_returns = self.calculate_returns()
+
+    def load_data(self, data):
         # Convert index to datetime if not already in datetime format
-        benchmark = data['SPY US Equity']
+        benchmark = data[BENCHMARK]
         # Ensure only the tickers we are interested in are selected
         ticker_columns = [ticker for ticker in self.tickers]
         data = data[ticker_columns]
-        data = data.fillna(method='ffill')
+        data = data.ffill()
 
         # Rename columns to match tickers without ' Equity' suffix
         data.columns = self.tickers
@@ -50,42 +76,115 @@ class PortfolioOptimizer:
 
         return returns, benchmark_returns
 
-    def compute_statistics(self):
-        # Calculate mean return, variance, and standard deviation
-        mean_returns = self.returns.mean()
-        cov_matrix = self.returns.cov()
-        std_devs = self.returns.std()
-        return mean_returns, cov_matrix, std_devs
-
-    def mean_variance_optimization(self):
-        mean_returns, cov_matrix, _ = self.compute_statistics()
-        num_assets = len(self.tickers)
-
-        def portfolio_return(weights):
-            return np.sum(weights * mean_returns)
+    def risk_model(self):
+        """
+        Covariance handed to the allocation methods, estimated once per optimizer.
+
+        A dense (n, n) array, or with covariance='factor' a low-rank-plus-diagonal
+        `FactorCovariance` that is never densified on the max-Sharpe (SLSQP) and
+        risk parity paths, so large universes fit in memory.
+        """
+        if self.cov_model is None:
+            if self.covariance == 'factor':
+                self.cov_model = factor_covariance(self.returns.values, self.num_factors)
+            elif self.shared_data:
+                # estimators of the shared panel are kept per basket and only rolled forward on new days
+                self.cov_model = default_covariance_cache.get(self.tickers, self.returns.values, self.returns.index,
+                                                              self.covariance)
+            else:
+                self.cov_model = covariance(self.returns.values, self.covariance)
+        return self.cov_model
 
-        def portfolio_volatility(weights):
-            return np.sqrt(np.dot(weights.T, np.dot(cov_matrix, weights)))
-
-        def negative_sharpe_ratio(weights):
-            return -(portfolio_return(weights) - self.risk_free_rate / 252) / portfolio_volatility(weights)
+    def compute_statistics(self):
+        # Calculate mean return, variance, and standard deviation once per optimizer
+        if self.statistics is None:
+            mean_returns = self.returns.mean()
+            cov_matrix = pd.DataFrame(np.asarray(self.risk_model()), index=self.returns.columns,
+                                      columns=self.returns.columns)
+            std_devs = self.returns.std()
+            self.statistics = mean_returns, cov_matrix, std_devs
+        return self.statistics
+
+    def mean_variance_optimization(self, solver='slsqp'):
+        # 'slsqp' with analytic gradients or the convex 'qp' reformulation, see sharpe.py
+        return max_sharpe(self.returns.mean().values, self.risk_model(), self.risk_free_rate / 252, solver=solver,
+                          upper=self.upper, G=self.G, h=self.h)
+
+    def optimize(self, method='max_sharpe', solver='slsqp'):
+        """Weights of one of `METHODS` (see allocation.py) under the optimizer's caps."""
+        if method not in METHODS:
+            raise ValueError(f"Unknown method {method!r}, expected one of {METHODS}")
+        return ALLOCATORS[method](self.returns.mean().values, self.risk_model(), self.risk_free_rate / 252,
+                                  upper=self.upper, G=self.G, h=self.h, solver=solver)
+
+    def backtest(self, method='max_sharpe', lookback=252, rebalance_every=21, cost_bps=0.):
+        """Out-of-sample walk-forward evaluation of `method` on this basket, see backtest.py."""
+        return backtest(self.returns.values, self.returns.index, method=method, lookback=lookback,
+                        rebalance_every=rebalance_every, covariance=self.covariance,
+                        risk_free_rate=self.risk_free_rate, cost_bps=cost_bps)
+
+    def annualize(self, returns, volatilities):
+        annualized_return = (1 + returns) ** 252 - 1
+        annualized_volatility = volatilities * np.sqrt(252)
+        sharpe_ratio = (annualized_return - self.risk_free_rate) / annualized_volatility
+        return annualized_return, annualized_volatility, sharpe_ratio
+
+    def frontier_result(self, returns, volatilities, weights):
+        annualized_return, annualized_volatility, sharpe_ratio = self.annualize(returns, volatilities)
+        return {
+            'returns': returns,
+            'volatilities': volatilities,
+            'weights': weights,
+            'annualized_return': annualized_return,
+            'annualized_volatility': annualized_volatility,
+            'sharpe_ratio': sharpe_ratio,
+        }
 
-        # Constraints and bounds
-        constraints = ({'type': 'eq', 'fun': lambda x: np.sum(x) - 1})
-        bounds = tuple((0, 1) for _ in range(num_assets))
-        initial_guess = num_assets * [1. / num_assets, ]
+    def efficient_frontier(self, num_points=50, target_returns=None, allow_short=False, max_weight=1.):
+        """
+        Minimum-variance portfolios for many target returns in one pass.
 
-        # Optimize the portfolio
-        result = minimize(negative_sharpe_ratio, initial_guess, method='SLSQP', bounds=bounds, constraints=constraints)
+        Long-only frontiers are swept with a warm-started active-set QP (see `frontier.py`);
+        with `allow_short` all targets come from a single Cholesky factorization.
 
-        return result.x
+        Args:
+            num_points (int): Number of frontier portfolios when `target_returns` is None.
+            target_returns (np.ndarray): Daily target returns.
+            allow_short (bool): Drop the long-only and `max_weight` bounds.
+            max_weight (float): Upper bound on every weight.
 
-    def get_portfolio_details(self):
-        weights = self.mean_variance_optimization()
+        Returns:
+            dict: Arrays 'returns', 'volatilities' (daily), 'weights' of shape (num_points, n),
+            plus 'annualized_return', 'annualized_volatility' and 'sharpe_ratio'.
+        """
         mean_returns, cov_matrix, _ = self.compute_statistics()
+        mean_returns, cov_matrix = mean_returns.values, cov_matrix.values
+        if allow_short:
+            if target_returns is None:
+                target_returns = np.linspace(mean_returns.min(), mean_returns.max(), num_points)
+            target_returns = np.asarray(target_returns, dtype=float)
+            weights, volatilities = closed_form_frontier(mean_returns, cov_matrix, target_returns)
+            return self.frontier_result(target_returns, volatilities, weights)
+        frontier = efficient_frontier(mean_returns, cov_matrix, num_points=num_points,
+                                      target_returns=target_returns, upper=max_weight)
+        return self.frontier_result(frontier['returns'], frontier['volatilities'], frontier['weights'])
+
+    def portfolios_for_volatility(self, target_volatilities, max_weight=1.):
+        """
+        Long-only frontier portfolios for annualized volatility targets, e.g. [0.08, 0.15, 0.25]
+        for conservative / balanced / aggressive.
+        """
+        mean_returns, cov_matrix, _ = self.compute_statistics()
+        daily_targets = np.asarray(target_volatilities, dtype=float) / np.sqrt(252)
+        portfolios = portfolios_for_volatility(mean_returns.values, cov_matrix.values, daily_targets, upper=max_weight)
+        return self.frontier_result(portfolios['returns'], portfolios['volatilities'], portfolios['weights'])
+
+    def get_portfolio_details(self, method='max_sharpe', solver='slsqp', tail_risk_paths=0):
+        weights = self.optimize(method, solver=solver)
+        mean_returns, cov_matrix = self.returns.mean(), self.risk_model()
 
         daily_portfolio_return = np.sum(weights * mean_returns)
-        daily_portfolio_volatility = np.sqrt(np.dot(weights.T, np.dot(cov_matrix, weights)))
+        daily_portfolio_volatility = np.sqrt(weights @ (cov_matrix @ weights))
 
         # Annualize return and volatility
         annualized_return = (1 + daily_portfolio_return) ** 252 - 1
@@ -116,7 +215,7 @@ class PortfolioOptimizer:
         # Format weights to display as percentages
         pd.options.display.float_format = '{:.2f}'.format
 
-        return {
+        details = {
             'weights_table': weights_df,
             'annualized_return': annualized_return,
             'annualized_volatility': annualized_volatility,
@@ -124,11 +223,63 @@ class PortfolioOptimizer:
             'sortino_ratio': sortino_ratio,
             'information_ratio': information_ratio
         }
+        if tail_risk_paths:
+            # one-year buy-and-hold distribution, see monte_carlo.py
+            details['tail_risk'] = tail_risk(weights, mean_returns.values, np.asarray(cov_matrix),
+                                             num_paths=tail_risk_paths)
+        return details
+
 
+def cached_portfolio_details(tickers, risk_free_rate=0.05, method='max_sharpe', covariance='sample', solver='slsqp',
+                             tail_risk_paths=0, max_weight=None, groups=None, group_caps=None,
+                             cache=default_result_cache):
+    """
+    `get_portfolio_details` of a basket on the shared price store, memoized in `cache`.
+
+    Results are solved for the sorted basket, so every ordering of the same tickers
+    shares one entry; the weights table comes back in the order of `tickers`.
+    """
+    constraints = {'max_weight': max_weight, 'group_caps': group_caps,
+                   'groups': {ticker: groups[ticker] for ticker in tickers if ticker in groups} if groups else None}
 
-def optimizer(tickers=test_tickers, risk_free_rate=0.05, data=None):
-    optimizer = PortfolioOptimizer(tickers, risk_free_rate, data=data)
-    portfolio_details = optimizer.get_portfolio_details()
+    def solve():
+        optimizer = PortfolioOptimizer(sorted(tickers), risk_free_rate, covariance=covariance, **constraints)
+        return optimizer.get_portfolio_details(method=method, solver=solver, tail_risk_paths=tail_risk_paths)
+
+    key = cache.key(tickers, risk_free_rate, get_price_store().version, method,
+                    {'covariance': covariance, 'solver': solver, 'tail_risk_paths': tail_risk_paths, **constraints})
+    details = cache.get_or_solve(key, solve)
+    weights_table = details['weights_table'].set_index('Ticker').loc[list(tickers)].reset_index()
+    return {**details, 'weights_table': weights_table}
+
+
+def optimizer(tickers=test_tickers, risk_free_rate=0.05, data=None, method='max_sharpe', covariance='sample',
+              solver='slsqp', tail_risk_paths=0, max_weight=None, groups=None, group_caps=None,
+              cache=default_result_cache):
+    """
+    Allocation summary of a basket for the chat frontends.
+
+    Args:
+        tickers (list): Bloomberg tickers of the basket.
+        risk_free_rate (float): Annual risk-free rate.
+        data (pd.DataFrame): Prices to use instead of the shared price store (results are then not cached).
+        method (str): One of `METHODS`: 'max_sharpe', 'min_variance', 'risk_parity', 'max_diversification'.
+        covariance (str): Covariance estimator, see covariance.py, or 'factor' for the factor model.
+        solver (str): Max-Sharpe solver, 'slsqp' or 'qp'.
+        tail_risk_paths (int): Monte Carlo paths for VaR/CVaR lines, 0 to skip them.
+        max_weight (float or dict): Per-asset cap.
+        groups (dict): Ticker -> group, e.g. asset class.
+        group_caps (dict): Group -> cap on the group's total weight.
+    """
+    constraints = {'max_weight': max_weight, 'groups': groups, 'group_caps': group_caps}
+    if data is None and cache is not None:
+        portfolio_details = cached_portfolio_details(tickers, risk_free_rate, method=method, covariance=covariance,
+                                                     solver=solver, tail_risk_paths=tail_risk_paths, cache=cache,
+                                                     **constraints)
+    else:
+        optimizer = PortfolioOptimizer(tickers, risk_free_rate, data=data, covariance=covariance, **constraints)
+        portfolio_details = optimizer.get_portfolio_details(method=method, solver=solver,
+                                                            tail_risk_paths=tail_risk_paths)
 
     # in future we will need to use something other than {portfolio_details[...]}
     template = f"""
@@ -139,4 +290,11 @@ def optimizer(tickers=test_tickers, risk_free_rate=0.05, data=None):
     Sortino Ratio: {portfolio_details['sortino_ratio']:.2f}
     Information Ratio: {portfolio_details['information_ratio']:.2f}
     """
+    if 'tail_risk' in portfolio_details:
+        risk = portfolio_details['tail_risk']
+        template += f"""1-Year VaR (95%): {risk['var_95%']:.2%}, CVaR (95%): {risk['cvar_95%']:.2%}
+    1-Year VaR (99%): {risk['var_99%']:.2%}, CVaR (99%): {risk['cvar_99%']:.2%}
+    Probability of Loss: {risk['probability_of_loss']:.2%}
+    Median Max Drawdown: {risk['max_drawdown_percentiles'][50]:.2%}
+    """
     return template
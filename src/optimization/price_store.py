@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+PRICES_PATH = '../../data/etf_prices.pkl'
+BENCHMARK = 'SPY US Equity'
+
+
+def data_version(path):
+    """Version tag of the price file: changes whenever it is rewritten."""
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+class PriceStore:
+    """
+    The ETF price panel and its daily returns, loaded once per process.
+
+    Both matrices are kept ticker-major as float32 (row i is the whole history of
+    ticker i), so a single ticker is a contiguous zero-copy view and a basket is one
+    gather of its rows. The arrays are cached as `.npy` files next to the pickle and
+    memory-mapped on later loads, so other processes share the same pages.
+
+    Args:
+        path (str): Pickled DataFrame of prices, dates x tickers.
+        cache_dir (str): Where the `.npy` cache lives, `<path>.cache` by default.
+    """
+
+    def __init__(self, path=PRICES_PATH, cache_dir=None):
+        self.path = path
+        self.cache_dir = cache_dir or path + '.cache'
+        self.version = data_version(path)
+        if not self.load_cache():
+            self.build()
+        self.positions = {ticker: i for i, ticker in enumerate(self.tickers)}
+
+    def load_cache(self):
+        meta_path = os.path.join(self.cache_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path, 'r') as file:
+            meta = json.load(file)
+        if meta['version'] != self.version:
+            return False
+        self.tickers = meta['tickers']
+        self.dates = pd.DatetimeIndex(np.load(os.path.join(self.cache_dir, 'dates.npy')))
+        self.prices = np.load(os.path.join(self.cache_dir, 'prices.npy'), mmap_mode='r')
+        self.returns = np.load(os.path.join(self.cache_dir, 'returns.npy'), mmap_mode='r')
+        return True
+
+    def build(self):
+        data = pd.read_pickle(self.path).ffill()
+        self.tickers = [str(ticker) for ticker in data.columns]
+        self.dates = pd.DatetimeIndex(data.index)
+        self.prices = np.ascontiguousarray(data.values.T, dtype=np.float32)
+        # same as pct_change on the forward-filled panel: NaN until a ticker starts trading
+        returns = np.full(self.prices.shape, np.nan, dtype=np.float32)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns[:, 1:] = data.values[1:].T / data.values[:-1].T - 1
+        self.returns = returns
+        self.save_cache()
+
+    def save_cache(self):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            np.save(os.path.join(self.cache_dir, 'prices.npy'), self.prices)
+            np.save(os.path.join(self.cache_dir, 'returns.npy'), self.returns)
+            np.save(os.path.join(self.cache_dir, 'dates.npy'), self.dates.values)
+            # meta last: a cache without it is never trusted
+            with open(os.path.join(self.cache_dir, 'meta.json'), 'w') as file:
+                json.dump({'version': self.version, 'tickers': self.tickers}, file)
+        except OSError as error:
+            print(f"Price cache not written ({error}), keeping the panel in memory only")
+
+    def __contains__(self, ticker):
+        return ticker in self.positions
+
+    def columns(self, tickers):
+        missing = [ticker for ticker in tickers if ticker not in self.positions]
+        if missing:
+            raise KeyError(f"No prices for {missing}")
+        return [self.positions[ticker] for ticker in tickers]
+
+    def column(self, ticker, returns=True):
+        """History of one ticker as a read-only view, no copy."""
+        return (self.returns if returns else self.prices)[self.positions[ticker]]
+
+    def panel(self, tickers, returns=True, dropna=True):
+        """
+        (dates, tickers) matrix of a basket.
+
+        Args:
+            tickers (list): Basket, in output column order.
+            returns (bool): Daily returns, otherwise forward-filled prices.
+            dropna (bool): Keep only dates where every ticker has a value.
+
+        Returns:
+            tuple: (matrix, dates).
+        """
+        matrix = (self.returns if returns else self.prices)[self.columns(tickers)].T
+        dates = self.dates
+        if dropna:
+            keep = ~np.isnan(matrix).any(axis=1)
+            matrix, dates = matrix[keep], dates[keep]
+        return matrix, dates
+
+    def frame(self, tickers, returns=True, dropna=True):
+        matrix, dates = self.panel(tickers, returns=returns, dropna=dropna)
+        return pd.DataFrame(matrix.astype(np.float64), index=dates, columns=list(tickers))
+
+    def series(self, ticker, returns=True, dropna=True):
+        return self.frame([ticker], returns=returns, dropna=dropna)[ticker]
+
+
+_store = None
+_lock = threading.Lock()
+
+
+def get_price_store(path=None):
+    """Process-wide store, reloaded when the price file on disk changes; `path` defaults to the loaded one."""
+    global _store
+    with _lock:
+        if path is None:
+            path = _store.path if _store is not None else PRICES_PATH
+        if _store is None or _store.path != path or _store.version != data_version(path):
+            _store = PriceStore(path)
+        return _store
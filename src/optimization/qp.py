@@ -0,0 +1,242 @@
+import numpy as np
+from scipy.linalg import cholesky, qr, qr_delete, qr_insert, solve_triangular
+from scipy.optimize import linprog
+
+
+FACTOR_MIN_FREE = 32  # below this many free variables a dense KKT solve is cheaper than factor bookkeeping
+
+def feasible_start(num_assets, lower=None, upper=None):
+    """
+    A fully invested point inside the box: equal weights, clipped to the bounds and topped up greedily.
+
+    Returns:
+        np.ndarray: Weights summing to one, or None if the bounds make that impossible.
+    """
+    lower = np.zeros(num_assets) if lower is None else np.broadcast_to(lower, num_assets).astype(float)
+    upper = np.ones(num_assets) if upper is None else np.broadcast_to(upper, num_assets).astype(float)
+    if lower.sum() > 1 + 1e-12 or upper.sum() < 1 - 1e-12:
+        return None
+    x = np.clip(np.full(num_assets, 1. / num_assets), lower, upper)
+    for _ in range(num_assets):
+        gap = 1. - x.sum()
+        if abs(gap) <= 1e-15:
+            break
+        room = (upper - x) if gap > 0 else (x - lower)
+        open_ = room > 0
+        share = np.minimum(room[open_], abs(gap) / open_.sum())
+        x[open_] += np.sign(gap) * share
+    return x
+
+
+def kkt_solve(Q, A, rhs_x, rhs_eq, free):
+    """
+    Solve the equality-constrained KKT system restricted to the `free` variables.
+
+    [Q_FF  A_F'] [ p ]   [rhs_x_F]
+    [A_F   0   ] [-λ ] = [rhs_eq ]
+
+    `rhs_x` and `rhs_eq` may have a second axis to solve for several right-hand sides
+    with one factorization.
+
+    Returns:
+        tuple: (p, λ) with `p` over the free variables only.
+    """
+    num_free, num_eq = len(free), A.shape[0]
+    K = np.zeros((num_free + num_eq, num_free + num_eq))
+    K[:num_free, :num_free] = Q[np.ix_(free, free)]
+    K[:num_free, num_free:] = A[:, free].T
+    K[num_free:, :num_free] = A[:, free]
+    rhs = np.concatenate([rhs_x[free], rhs_eq])
+    try:
+        solution = np.linalg.solve(K, rhs)
+    except np.linalg.LinAlgError:
+        # singular when fewer free variables than equality rows, or a rank-deficient covariance
+        solution = np.linalg.lstsq(K, rhs, rcond=None)[0]
+    return solution[:num_free], -solution[num_free:]
+
+
+class KKTSolver:
+    """
+    `kkt_solve` for a fixed Q that factors Q once and updates the factor as the free set changes.
+
+    With the Cholesky factor Q = M'M, the reduced matrix is Q_FF = M_F'M_F, so the R of a
+    QR factorization of the columns M_F is a Cholesky factor of Q_FF. An active-set step
+    frees or fixes one variable at a time, which is one column inserted into or deleted
+    from that QR (`scipy.linalg.qr_insert` / `qr_delete`) instead of a new factorization;
+    the KKT system then reduces to triangular solves and the small Schur complement
+    S = A_F Q_FF⁻¹ A_F'. One solver shared by every solve of a frontier sweep carries the
+    factor from point to point. A singular Q, and free sets too small for the bookkeeping to
+    pay off, fall back to the dense `kkt_solve`.
+
+    Args:
+        Q (np.ndarray): (n, n) positive semi-definite matrix.
+    """
+
+    def __init__(self, Q):
+        self.Q = np.asarray(Q, dtype=float)
+        try:
+            self.root = cholesky(self.Q)
+        except np.linalg.LinAlgError:
+            self.root = None
+        self.order = np.zeros(0, dtype=np.int64)
+        self.factored = np.zeros(len(self.Q), dtype=bool)
+        self.qr = None
+        self.updates = 0
+        self.refactors = 0
+
+    def factor(self, free):
+        """Upper-triangular R with Q[order][:, order] = R'R, `order` being `free` in factor order."""
+        keep = np.zeros(len(self.Q), dtype=bool)
+        keep[free] = True
+        removed = np.flatnonzero(~keep[self.order])
+        added = free[~self.factored[free]]
+        if self.qr is None or len(removed) + len(added) > len(free) // 2:
+            self.order = np.array(free)
+            self.qr = qr(self.root[:, free], check_finite=False)
+            self.refactors += 1
+        else:
+            q, r = self.qr
+            for position in removed[::-1]:
+                q, r = qr_delete(q, r, position, which='col', overwrite_qr=True, check_finite=False)
+            self.order = np.delete(self.order, removed)
+            if len(added):
+                q, r = qr_insert(q, r, self.root[:, added], len(self.order), which='col', check_finite=False)
+                self.order = np.concatenate([self.order, added])
+            self.qr = (q, r)
+            self.updates += len(removed) + len(added)
+        self.factored = keep
+        return self.qr[1][:len(free)]
+
+    def __call__(self, A, rhs_x, rhs_eq, free):
+        """Same arguments and result as `kkt_solve` with `Q`."""
+        # with fewer free variables than rows S is singular, the dense solve handles it
+        if self.root is None or len(free) < max(len(A), FACTOR_MIN_FREE):
+            return kkt_solve(self.Q, A, rhs_x, rhs_eq, free)
+        r = self.factor(free)
+        A_order = A[:, self.order]
+        rhs = rhs_x[self.order].reshape(len(free), -1)
+        # Q_FF⁻¹ [rhs_x_F, A_F'] with two triangular solves
+        solved = solve_triangular(r, solve_triangular(r, np.hstack([rhs, A_order.T]), trans='T', check_finite=False),
+                                  check_finite=False)
+        inv_rhs, inv_rows = solved[:, :rhs.shape[1]], solved[:, rhs.shape[1]:]
+        try:
+            negative = np.linalg.solve(A_order @ inv_rows, A_order @ inv_rhs - np.reshape(rhs_eq, (len(A), -1)))
+        except np.linalg.LinAlgError:
+            return kkt_solve(self.Q, A, rhs_x, rhs_eq, free)
+        p = inv_rhs - inv_rows @ negative
+        # back from factor order to the sorted order of `free`, in the shape of the inputs
+        p = p[np.argsort(self.order)]
+        if np.ndim(rhs_x) == 1:
+            return p[:, 0], -negative[:, 0]
+        return p, -negative
+
+
+def feasible_point(A, b, lower, upper, G=None, h=None):
+    """Phase one: any point satisfying the equality rows, the box and `G x <= h`, or None."""
+    n = A.shape[1]
+    bounds = [(lo, None if np.isinf(up) else up) for lo, up in zip(lower, upper)]
+    if G is not None and not len(G):
+        G = h = None
+    result = linprog(np.zeros(n), A_ub=G, b_ub=h, A_eq=A, b_eq=b, bounds=bounds, method='highs')
+    return result.x if result.status == 0 else None
+
+
+def solve_qp(Q, c, A, b, lower=None, upper=None, G=None, h=None, x0=None, max_iter=None, tol=1e-10, kkt=None):
+    """
+    Primal active-set solver for a convex QP with equality rows, box bounds and inequality rows.
+
+        min ½ x'Qx + c'x   s.t.   A x = b,   lower <= x <= upper,   G x <= h
+
+    The working set holds variables fixed at a bound and active rows of `G`. Starting
+    from a feasible `x0` (for instance a neighbouring solution), only the constraints
+    that change between the two problems have to be added or released, which is what
+    makes sweeps over many related problems cheap.
+
+    Args:
+        Q (np.ndarray): (n, n) positive semi-definite matrix.
+        c (np.ndarray): (n,) linear term.
+        A (np.ndarray): (m, n) equality rows.
+        b (np.ndarray): (m,) right-hand side.
+        lower (np.ndarray): Lower bounds, zeros by default (long-only).
+        upper (np.ndarray): Upper bounds, unbounded by default.
+        G (np.ndarray): (k, n) inequality rows, e.g. group caps.
+        h (np.ndarray): (k,) right-hand side of `G`.
+        x0 (np.ndarray): Feasible starting point, found with an LP if not given.
+        max_iter (int): Iteration limit, 10 * (n + k) by default.
+        tol (float): Tolerance on bounds and multipliers.
+        kkt (KKTSolver): Factorization cache of `Q`, shared by related problems (e.g. a frontier sweep).
+
+    Returns:
+        dict: 'x', 'multipliers' (of the equality rows), 'working_set' (boolean mask of variables
+        fixed at a bound), 'active_rows' (boolean mask of rows of `G` holding with equality) and 'iterations'.
+    """
+    Q, c = np.asarray(Q, dtype=float), np.asarray(c, dtype=float)
+    A, b = np.atleast_2d(np.asarray(A, dtype=float)), np.atleast_1d(np.asarray(b, dtype=float))
+    n = len(c)
+    lower = np.zeros(n) if lower is None else np.broadcast_to(lower, n).astype(float)
+    upper = np.full(n, np.inf) if upper is None else np.broadcast_to(upper, n).astype(float)
+    G = np.zeros((0, n)) if G is None else np.atleast_2d(np.asarray(G, dtype=float))
+    h = np.zeros(0) if h is None else np.atleast_1d(np.asarray(h, dtype=float))
+    max_iter = max_iter or 10 * (n + len(h)) + 10
+    kkt = KKTSolver(Q) if kkt is None else kkt
+
+    if x0 is None:
+        budget_only = not len(h) and A.shape[0] == 1 and np.all(A == 1) and b[0] == 1
+        x0 = feasible_start(n, lower, upper) if budget_only else feasible_point(A, b, lower, upper, G, h)
+        if x0 is None:
+            raise ValueError("Constraints leave no feasible portfolio")
+    x = np.clip(np.asarray(x0, dtype=float), lower, upper)
+    if np.abs(A @ x - b).max() > 1e-8 or np.any(G @ x > h + 1e-8):
+        raise ValueError("Starting point violates the constraints")
+
+    at_lower = x <= lower + tol
+    at_upper = ~at_lower & (x >= upper - tol)
+    active = G @ x >= h - tol
+    multipliers = np.zeros(len(b))
+
+    for iteration in range(1, max_iter + 1):
+        working = at_lower | at_upper
+        free = np.flatnonzero(~working)
+        rows = np.vstack([A, G[active]])
+        gradient = Q @ x + c
+        p_free, row_multipliers = kkt(rows, -gradient, np.zeros(len(rows)), free)
+        multipliers = row_multipliers[:len(b)]
+
+        if np.abs(p_free).max(initial=0.) <= tol * max(1., np.abs(x).max()):
+            # stationary on the working set: release the constraint with the most negative multiplier
+            reduced = gradient - rows.T @ row_multipliers
+            scale = tol * max(1., np.abs(gradient).max())
+            violation = np.where(at_lower, -reduced, 0.) + np.where(at_upper, reduced, 0.)
+            row_violation = np.zeros(len(h))
+            row_violation[active] = row_multipliers[len(b):]
+            j, r = np.argmax(violation), np.argmax(row_violation) if len(h) else None
+            if r is not None and row_violation[r] > max(violation[j], scale):
+                active[r] = False
+                continue
+            if violation[j] <= scale:
+                return {'x': x, 'multipliers': multipliers, 'working_set': working, 'active_rows': active,
+                        'iterations': iteration}
+            at_lower[j] = at_upper[j] = False
+            continue
+
+        # longest step along p that stays feasible, the first blocking constraint joins the working set
+        p = np.zeros(n)
+        p[free] = p_free
+        with np.errstate(divide='ignore', invalid='ignore'):
+            steps = np.where(p < 0, (lower - x) / p, np.where(p > 0, (upper - x) / p, np.inf))
+            growth = G @ p
+            row_steps = np.where(~active & (growth > tol), (h - G @ x) / growth, np.inf)
+        steps[working] = np.inf
+        j = np.argmin(steps)
+        r = np.argmin(row_steps) if len(h) else None
+        step = min(1., max(min(steps[j], row_steps[r] if r is not None else np.inf), 0.))
+        x = x + step * p
+        if step < 1.:
+            if r is not None and row_steps[r] < steps[j]:
+                active[r] = True
+            elif p[j] < 0:
+                x[j], at_lower[j] = lower[j], True
+            else:
+                x[j], at_upper[j] = upper[j], True
+
+    raise RuntimeError(f"Active-set QP did not converge in {max_iter} iterations")
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import pickle
+import shutil
+import threading
+import time
+
+from src.retrieval.cache import LRUCache, freeze
+
+
+def digest(value):
+    return hashlib.sha1(repr(value).encode('utf-8')).hexdigest()
+
+
+class OptimizationCache:
+    """
+    Memoized optimizer results keyed by (sorted tickers, risk-free rate, price data version, method, options).
+
+    An in-memory LRU sits in front of an optional on-disk tier that survives restarts.
+    The price data version is part of every key, and a new version drops the memory
+    tier and the disk entries of older versions, so results never outlive the prices
+    they were computed from.
+
+    Args:
+        max_size (int): Entries kept in memory.
+        disk_dir (str): Directory of the disk tier, None keeps results in memory only.
+    """
+
+    def __init__(self, max_size=1024, disk_dir=None):
+        self.memory = LRUCache(max_size)
+        self.disk_dir = disk_dir
+        self.version = None
+        self.disk_hits = 0
+        self.solves = 0
+        self.solve_seconds = 0.
+        self.lock = threading.Lock()
+
+    def key(self, tickers, risk_free_rate, version, method, options=None):
+        return tuple(sorted(tickers)), float(risk_free_rate), version, method, freeze(options or {})
+
+    def validate(self, version):
+        with self.lock:
+            if version == self.version:
+                return
+            self.version = version
+        self.memory.clear()
+        if self.disk_dir and os.path.isdir(self.disk_dir):
+            current = digest(version)
+            for name in os.listdir(self.disk_dir):
+                if name != current:
+                    shutil.rmtree(os.path.join(self.disk_dir, name), ignore_errors=True)
+
+    def disk_path(self, key):
+        return os.path.join(self.disk_dir, digest(key[2]), digest(key) + '.pkl')
+
+    def read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self.disk_path(key), 'rb') as file:
+                stored_key, value = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return value if stored_key == key else None
+
+    def write_disk(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self.disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{os.getpid()}.partial"
+        with open(partial, 'wb') as file:
+            pickle.dump((key, value), file)
+        os.replace(partial, path)
+
+    def get_or_solve(self, key, solve_fn):
+        """Cached result for `key`, `solve_fn()` runs on a miss in both tiers."""
+        self.validate(key[2])
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        value = self.read_disk(key)
+        if value is not None:
+            with self.lock:
+                self.disk_hits += 1
+        else:
+            start = time.perf_counter()
+            value = solve_fn()
+            with self.lock:
+                self.solves += 1
+                self.solve_seconds += time.perf_counter() - start
+            self.write_disk(key, value)
+        self.memory.put(key, value)
+        return value
+
+    def stats(self):
+        memory = self.memory.stats()
+        lookups = memory['hits'] + memory['misses']
+        return {
+            'memory': memory,
+            'disk_hits': self.disk_hits,
+            'solves': self.solves,
+            'hit_rate': (memory['hits'] + self.disk_hits) / lookups if lookups else 0.,
+            'mean_solve_seconds': self.solve_seconds / self.solves if self.solves else 0.,
+            'total_solve_seconds': self.solve_seconds,
+        }
+
+
+# shared by every optimizer() call in this process
+default_result_cache = OptimizationCache()
@@ -0,0 +1,121 @@
+import numpy as np
+from scipy.optimize import minimize
+
+from src.optimization.constraints import check_solution, homogenize
+from src.optimization.factor_model import FactorCovariance
+from src.optimization.qp import feasible_point, solve_qp
+
+
+SOLVERS = ('slsqp', 'qp')
+
+
+def portfolio_return(weights, mean_returns):
+    return weights @ mean_returns
+
+
+def return_gradient(weights, mean_returns):
+    return mean_returns
+
+
+def portfolio_volatility(weights, cov_matrix):
+    return np.sqrt(weights @ cov_matrix @ weights)
+
+
+def volatility_gradient(weights, cov_matrix):
+    """∂σ/∂w = Σw / σ."""
+    cov_weights = cov_matrix @ weights
+    return cov_weights / np.sqrt(weights @ cov_weights)
+
+
+def negative_sharpe_ratio(weights, mean_returns, cov_matrix, risk_free_rate):
+    return -(weights @ mean_returns - risk_free_rate) / portfolio_volatility(weights, cov_matrix)
+
+
+def negative_sharpe_gradient(weights, mean_returns, cov_matrix, risk_free_rate):
+    """∂/∂w of -(w'μ - r) / σ = -μ/σ + (w'μ - r) Σw / σ³, one covariance product."""
+    cov_weights = cov_matrix @ weights
+    volatility = np.sqrt(weights @ cov_weights)
+    excess = weights @ mean_returns - risk_free_rate
+    return -mean_returns / volatility + excess * cov_weights / volatility ** 3
+
+
+def max_sharpe_slsqp(mean_returns, cov_matrix, risk_free_rate, upper=1., G=None, h=None, analytic=True):
+    """
+    Long-only max-Sharpe weights with SLSQP.
+
+    Objective and gradient only use products with `cov_matrix`, so a `FactorCovariance`
+    makes every evaluation O(nk).
+
+    Args:
+        mean_returns (np.ndarray): (n,) expected returns, same period as `risk_free_rate`.
+        cov_matrix (np.ndarray or FactorCovariance): (n, n) covariance.
+        risk_free_rate (float): Per-period risk-free rate.
+        upper (float or np.ndarray): Upper bound on every weight.
+        G (np.ndarray): Group rows, G w <= h.
+        h (np.ndarray): Group caps.
+        analytic (bool): Pass the analytic gradient instead of letting SciPy difference the objective.
+
+    Raises:
+        ValueError: If SLSQP does not converge to weights within the caps.
+    """
+    num_assets = len(mean_returns)
+    args = (mean_returns, cov_matrix, risk_free_rate)
+    constraints = [{'type': 'eq', 'fun': lambda x: np.sum(x) - 1, 'jac': lambda x: np.ones_like(x)}]
+    if G is not None:
+        constraints.append({'type': 'ineq', 'fun': lambda x: h - G @ x, 'jac': lambda x: -G})
+    bounds = tuple((0, cap) for cap in np.broadcast_to(upper, num_assets))
+    initial_guess = np.full(num_assets, 1. / num_assets)
+    result = minimize(negative_sharpe_ratio, initial_guess, args=args, method='SLSQP', bounds=bounds,
+                      constraints=constraints, jac=negative_sharpe_gradient if analytic else None)
+    return check_solution(result.x, result, upper, G, h)
+
+
+def max_ratio_qp(numerator, cov_matrix, upper=None, G=None, h=None):
+    """
+    Long-only weights maximizing a'w / sqrt(w'Σw) as a convex QP.
+
+    With y = w / κ and the scale fixed by a'y = 1, this is min y'Σy s.t. a'y = 1, y >= 0
+    (plus the caps, homogenized), and w = y / 1'y. Only valid when some feasible portfolio
+    has a'w > 0; returns None otherwise.
+    """
+    numerator = np.asarray(numerator, dtype=float)
+    num_assets = len(numerator)
+    rows = homogenize(num_assets, None if upper is None else np.broadcast_to(upper, num_assets).astype(float), G, h)
+    if rows is None:
+        best = np.argmax(numerator)
+        if numerator[best] <= 0:
+            return None
+        start = np.zeros(num_assets)
+        start[best] = 1. / numerator[best]
+    else:
+        start = feasible_point(numerator[None], [1.], np.zeros(num_assets), np.full(num_assets, np.inf),
+                               rows, np.zeros(len(rows)))
+        if start is None:
+            return None
+    y = solve_qp(cov_matrix, np.zeros(num_assets), numerator[None], [1.], G=rows,
+                 h=None if rows is None else np.zeros(len(rows)), x0=start)['x']
+    return y / y.sum()
+
+
+def max_sharpe_qp(mean_returns, cov_matrix, risk_free_rate, upper=None, G=None, h=None):
+    """Long-only max-Sharpe weights as a convex QP on the excess returns, see `max_ratio_qp`."""
+    return max_ratio_qp(np.asarray(mean_returns, dtype=float) - risk_free_rate, cov_matrix, upper, G, h)
+
+
+def max_sharpe(mean_returns, cov_matrix, risk_free_rate, solver='slsqp', upper=1., G=None, h=None):
+    """
+    Long-only max-Sharpe weights with one of `SOLVERS`, under per-asset caps `upper` and group caps G w <= h.
+
+    The QP path falls back to SLSQP when no feasible portfolio beats the risk-free rate. A
+    `FactorCovariance` is kept as is for SLSQP and densified for the QP.
+    """
+    mean_returns = np.asarray(mean_returns, dtype=float)
+    if not isinstance(cov_matrix, FactorCovariance):
+        cov_matrix = np.asarray(cov_matrix, dtype=float)
+    if solver not in SOLVERS:
+        raise ValueError(f"Unknown solver {solver!r}, expected one of {SOLVERS}")
+    if solver == 'qp':
+        weights = max_sharpe_qp(mean_returns, cov_matrix, risk_free_rate, upper, G, h)
+        if weights is not None:
+            return weights
+    return max_sharpe_slsqp(mean_returns, cov_matrix, risk_free_rate, upper=upper, G=G, h=h)
@@ -0,0 +1,78 @@
+import argparse
+import time
+
+import numpy as np
+
+from src.optimization.covariance import covariance
+from src.optimization.factor_model import factor_covariance
+from src.optimization.price_store import PRICES_PATH, get_price_store
+from src.optimization.sharpe import max_sharpe_qp, max_sharpe_slsqp, negative_sharpe_ratio
+
+
+SIZES = (4, 10, 25, 50, 100, 250, 500)
+RISK_FREE_RATE = 0.05
+
+
+def synthetic_returns(num_days, num_assets, num_factors=5, seed=0):
+    # a few common factors plus idiosyncratic noise, roughly the correlation structure of an ETF panel
+    rng = np.random.default_rng(seed)
+    loadings = rng.normal(0.5, 0.3, size=(num_factors, num_assets))
+    factors = rng.normal(0.0003, 0.008, size=(num_days, num_factors))
+    return factors @ loadings / np.sqrt(num_factors) + rng.normal(0.0002, 0.006, size=(num_days, num_assets))
+
+
+def store_returns(num_days, num_assets, seed=0):
+    # random baskets of ETFs with a full history over the last `num_days` days
+    store = get_price_store(PRICES_PATH)
+    recent = np.asarray(store.returns[:, -num_days:])
+    complete = np.flatnonzero(~np.isnan(recent).any(axis=1))
+    if len(complete) < num_assets:
+        raise ValueError(f"Only {len(complete)} ETFs have {num_days} days of history")
+    rows = np.random.default_rng(seed).choice(complete, size=num_assets, replace=False)
+    return recent[rows].T.astype(np.float64)
+
+
+SOLVER_FUNCTIONS = {
+    'slsqp_numeric': lambda mu, cov, rf: max_sharpe_slsqp(mu, cov, rf, analytic=False),
+    'slsqp_analytic': lambda mu, cov, rf: max_sharpe_slsqp(mu, cov, rf, analytic=True),
+    'qp': max_sharpe_qp,
+}
+
+
+def benchmark(returns, solvers=tuple(SOLVER_FUNCTIONS), covariance_method='sample', repeats=3):
+    mean_returns = returns.mean(axis=0)
+    # 'factor' keeps the SLSQP evaluations O(nk); the QP densifies it
+    cov_matrix = factor_covariance(returns) if covariance_method == 'factor' else covariance(returns, covariance_method)
+    risk_free_rate = RISK_FREE_RATE / 252
+
+    results = []
+    for name in solvers:
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            weights = SOLVER_FUNCTIONS[name](mean_returns, cov_matrix, risk_free_rate)
+            timings.append(time.perf_counter() - start)
+        sharpe = np.nan if weights is None else -negative_sharpe_ratio(weights, mean_returns, cov_matrix, risk_free_rate)
+        results.append({'solver': name, 'seconds': float(np.median(timings)), 'sharpe': sharpe * np.sqrt(252)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wall time and objective of the max-Sharpe solvers over basket sizes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--days", type=int, default=756, help="Days of returns per basket")
+    parser.add_argument("--prices", action="store_true", help="Random baskets from etf_prices.pkl instead of synthetic returns")
+    parser.add_argument("--covariance", default="sample", help="Estimator from covariance.py, or 'factor'")
+    parser.add_argument("--solvers", nargs="+", default=list(SOLVER_FUNCTIONS), choices=list(SOLVER_FUNCTIONS))
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'assets':>8}{'solver':>16}{'seconds':>12}{'sharpe':>10}")
+    for size in args.sizes:
+        returns = store_returns(args.days, size) if args.prices else synthetic_returns(args.days, size)
+        for row in benchmark(returns, args.solvers, covariance_method=args.covariance, repeats=args.repeats):
+            print(f"{size:>8}{row['solver']:>16}{row['seconds']:>12.4f}{row['sharpe']:>10.4f}")
+
+
+if __name__ == '__main__':
+    main()
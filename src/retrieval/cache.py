@@ -0,0 +1,153 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(text):
+    """Case- and whitespace-insensitive form of a query, so trivial retypes hit the cache."""
+    return " ".join(str(text).lower().split())
+
+
+def freeze(value):
+    """Hashable version of nested filters (dicts, lists, tuples)."""
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def index_version(*paths):
+    """Version tag of on-disk index files: changes whenever one of them is rewritten."""
+    parts = []
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f"{path}:{stat.st_mtime_ns}:{stat.st_size}")
+    return "|".join(parts)
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded LRU mapping with hit/miss counters.
+
+    Args:
+        max_size (int): Maximum number of entries kept.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.,
+        }
+
+
+class RetrievalCache:
+    """
+    Two LRU tiers in front of retrieval: normalized query -> embedding and
+    (data version, embedding, k, filters) -> result IDs.
+
+    Both tiers are dropped when `validate` sees a new index version, since a rebuilt
+    index usually comes with new IDs and often with a new encoder.
+
+    Args:
+        max_embeddings (int): Size of the embedding tier.
+        max_results (int): Size of the result tier.
+    """
+
+    def __init__(self, max_embeddings=1024, max_results=4096):
+        self.embeddings = LRUCache(max_embeddings)
+        self.results = LRUCache(max_results)
+        self.version = None
+
+    def validate(self, version):
+        if version != self.version:
+            self.embeddings.clear()
+            self.results.clear()
+            self.version = version
+
+    def encode(self, query, encode_fn):
+        """Embedding of `query`; `encode_fn` maps a list of texts to an (n, d) array and runs on misses only."""
+        key = normalize_query(query)
+        embedding = self.embeddings.get(key)
+        if embedding is None:
+            embedding = np.asarray(encode_fn([query])[0], dtype=np.float32)
+            embedding.setflags(write=False)
+            self.embeddings.put(key, embedding)
+        return embedding
+
+    def encode_many(self, queries, encode_fn):
+        """(n, d) embeddings of `queries`, with all cache misses encoded in a single `encode_fn` call."""
+        embeddings = [self.embeddings.get(normalize_query(query)) for query in queries]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            encoded = np.asarray(encode_fn([queries[i] for i in missing]), dtype=np.float32)
+            for i, embedding in zip(missing, encoded):
+                embedding.setflags(write=False)
+                self.embeddings.put(normalize_query(queries[i]), embedding)
+                embeddings[i] = embedding
+        return np.vstack(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+
+    def search(self, embedding, k, search_fn, filters=None, extra=None, version=None):
+        """
+        Cached `search_fn()` result for (version, embedding, k, filters).
+
+        Args:
+            embedding (np.ndarray): Query embedding.
+            k (int): Number of results.
+            search_fn (callable): No-argument function computing the result on a miss.
+            filters (dict): Filters applied by the search.
+            extra: Anything else the result depends on, e.g. the normalized text for lexical scoring.
+            version: Version of the data and index searched. `validate` alone is not enough: a
+                search started before it can finish after it and store IDs of the old index.
+        """
+        digest = hashlib.sha1(np.ascontiguousarray(embedding, dtype=np.float32).tobytes()).hexdigest()
+        key = (version, digest, k, freeze(filters), freeze(extra))
+        result = self.results.get(key)
+        if result is None:
+            result = search_fn()
+            self.results.put(key, result)
+        return result
+
+    def stats(self):
+        return {'embeddings': self.embeddings.stats(), 'results': self.results.stats()}
+
+
+# one instance shared by everything retrieving in this process
+default_cache = RetrievalCache()
@@ -0,0 +1,160 @@
+import re
+
+import numpy as np
+
+from src.retrieval.lexical import tokenize
+
+
+CATEGORICAL_FIELDS = ('asset_class_focus', 'fund_geographical_focus', 'fund_market_cap_focus')
+NUMERIC_FIELDS = ('expense_ratio',)
+
+# words too generic to identify a category value on their own
+GENERIC_TOKENS = {'cap', 'region', 'fund', 'funds', 'etf', 'etfs', 'market', 'focus', 'and', 'the', 'other',
+                  'unavailable', 'not', 'available', 'applicable', 'none', 'nan'}
+
+UPPER_BOUND = r"(?:under|below|less than|lower than|at most|max(?:imum)?|<=?)"
+LOWER_BOUND = r"(?:over|above|more than|greater than|at least|min(?:imum)?|>=?)"
+NUMBER = r"(\d+(?:\.\d+)?)\s*%?"
+# dotted abbreviations like 'U.S.' or 'u.k', collapsed to one token before matching
+ABBREVIATION = re.compile(r"\b[a-z](?:\.[a-z])+\b\.?", re.IGNORECASE)
+# how each numeric field is referred to in a query
+NUMERIC_PATTERNS = {
+    'expense_ratio': r"(?:expense(?:s| ratio)?|fees?|ter)",
+}
+
+
+def to_number(value):
+    """Parse values like '0.09', '0.09%' or 0.09; anything else becomes NaN."""
+    try:
+        return float(str(value).strip().rstrip('%').replace(',', ''))
+    except ValueError:
+        return float('nan')
+
+
+def singular(token):
+    """Crude singular form, so 'commodities' meets 'Commodity' and 'bonds' meets 'Bond'."""
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if token.endswith(('sses', 'xes', 'ches', 'shes')):
+        return token[:-2]
+    if len(token) > 3 and token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+        return token[:-1]
+    return token
+
+
+def terms(text):
+    """Tokens of `text` in singular form, with 'U.S.' read as one token 'us'."""
+    text = ABBREVIATION.sub(lambda match: match.group(0).replace('.', ''), str(text))
+    return [singular(token) for token in tokenize(text)]
+
+
+def _stem_match(a, b):
+    # 'europe' ~ 'european', 'asia' ~ 'asian', but no 'inte' ~ 'interest' style matches
+    shorter, longer = sorted((a, b), key=len)
+    return a == b or (len(shorter) >= 4 and longer.startswith(shorter))
+
+
+def _phrase_match(value_tokens, query_tokens):
+    """All of a value's tokens, in order and next to each other: 'income' alone is not 'Fixed Income'."""
+    size = len(value_tokens)
+    return any(all(_stem_match(v, q) for v, q in zip(value_tokens, query_tokens[start:start + size]))
+               for start in range(len(query_tokens) - size + 1))
+
+
+class AttributeIndex:
+    """
+    Bitmap indexes over categorical ETF fields and sorted-array indexes over numeric ones.
+
+    Every filter resolves to a boolean mask over ETF positions, so candidates can be
+    restricted before any vector is scored.
+
+    Args:
+        etf_data (list): ETF records (dicts); position in the list is the document ID.
+        categorical_fields (tuple): Fields matched by exact value.
+        numeric_fields (tuple): Fields filtered by (low, high) range.
+    """
+
+    def __init__(self, etf_data, categorical_fields=CATEGORICAL_FIELDS, numeric_fields=NUMERIC_FIELDS):
+        self.num_docs = len(etf_data)
+
+        self.bitmaps = {}
+        for field in categorical_fields:
+            values = np.array([str(etf.get(field)) for etf in etf_data], dtype=object)
+            self.bitmaps[field] = {value: values == value for value in set(values)}
+
+        self.sorted_values = {}
+        for field in numeric_fields:
+            values = np.array([to_number(etf.get(field)) for etf in etf_data], dtype=np.float64)
+            known = np.flatnonzero(~np.isnan(values))
+            order = known[np.argsort(values[known], kind='stable')]
+            self.sorted_values[field] = (values[order], order)
+
+    def mask(self, filters):
+        """
+        Boolean mask of ETFs matching all filters.
+
+        Args:
+            filters (dict): field -> list of accepted values (categorical) or (low, high) with None for open ends (numeric).
+
+        Returns:
+            np.ndarray: Boolean array of shape (num_docs,).
+        """
+        mask = np.ones(self.num_docs, dtype=bool)
+        for field, condition in (filters or {}).items():
+            if field in self.bitmaps:
+                field_mask = np.zeros(self.num_docs, dtype=bool)
+                for value in condition:
+                    if value in self.bitmaps[field]:
+                        field_mask |= self.bitmaps[field][value]
+                mask &= field_mask
+            elif field in self.sorted_values:
+                values, order = self.sorted_values[field]
+                low, high = condition
+                start = 0 if low is None else np.searchsorted(values, low, side='left')
+                end = len(values) if high is None else np.searchsorted(values, high, side='right')
+                field_mask = np.zeros(self.num_docs, dtype=bool)
+                field_mask[order[start:end]] = True
+                mask &= field_mask
+            else:
+                raise KeyError(f"No index on field {field!r}")
+        return mask
+
+    def parse_filters(self, query):
+        """
+        Rule-based extraction of structured filters from a free text query.
+
+        "European small-cap ETFs under 0.3% expense" gives
+        {'fund_geographical_focus': ['European Region'], 'fund_market_cap_focus': ['Small-cap'],
+         'expense_ratio': (None, 0.3)} (values as spelled in the data), "mid cap ETFs" gives
+        {'fund_market_cap_focus': ['Mid-cap']} and "U.S. equity" matches 'U.S.'. Tokens are
+        compared in singular form, and a value of several words only matches the whole phrase.
+        """
+        filters = {}
+        # a lowercase 'us' is the pronoun ("show us bond funds"), not the country
+        query_tokens = terms(re.sub(r"\bus\b", " ", query))
+
+        for field, bitmaps in self.bitmaps.items():
+            matched = []
+            for value in bitmaps:
+                value_tokens = [t for t in terms(value) if t not in GENERIC_TOKENS]
+                if value_tokens and _phrase_match(value_tokens, query_tokens):
+                    matched.append(value)
+            if matched:
+                filters[field] = matched
+
+        lowered = query.lower()
+        for field, name in NUMERIC_PATTERNS.items():
+            if field not in self.sorted_values:
+                continue
+            bounds = {}
+            for side, bound in (('high', UPPER_BOUND), ('low', LOWER_BOUND)):
+                # "under 0.3% expense" or "expense ratio below 0.3%"
+                match = (re.search(rf"{bound}\s*{NUMBER}\s*{name}", lowered)
+                         or re.search(rf"{name}\s*(?:of\s*)?{bound}\s*{NUMBER}", lowered))
+                if match:
+                    bounds[side] = float(match.group(1))
+            low, high = bounds.get('low'), bounds.get('high')
+            if low is not None or high is not None:
+                filters[field] = (low, high)
+
+        return filters
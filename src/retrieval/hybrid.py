@@ -0,0 +1,144 @@
+import numpy as np
+import faiss
+
+from src.dataset.index_factory import search_with_mask
+from src.retrieval.lexical import BM25Index
+from src.retrieval.filters import AttributeIndex, CATEGORICAL_FIELDS, NUMERIC_FIELDS
+from src.retrieval.cache import normalize_query
+
+
+TEXT_FIELDS = ('ticker', 'etf_name', 'description')
+
+
+def _normalize(scores):
+    if len(scores) == 0:
+        return scores
+    low, high = scores.min(), scores.max()
+    if high - low < 1e-12:
+        return np.ones_like(scores)
+    return (scores - low) / (high - low)
+
+
+class HybridRetriever:
+    """
+    BM25 + dense retrieval over ETF records with structured-attribute pre-filtering.
+
+    A query is first turned into a candidate mask by the attribute indexes (explicit
+    `filters`, or filters parsed from the query text). Dense and lexical search then
+    only score candidates inside the mask, and their min-max normalized scores are
+    mixed as `alpha * dense + (1 - alpha) * bm25`.
+
+    Args:
+        etf_data (list): ETF records; position in the list must be the ID used by `index`.
+        encode_fn (callable): Maps a list of texts to an (n, d) array of query embeddings.
+        index (faiss.Index): Dense index over `etf_data`. Either this or `embeddings` is required.
+        embeddings (np.ndarray): (n, d) matrix (or `EmbeddingStore.vectors` memmap) scored exactly instead of `index`.
+        metric (str): 'ip' or 'l2', only used with `embeddings`.
+        text_fields (tuple): Fields indexed by BM25.
+        categorical_fields (tuple): Fields with bitmap indexes.
+        numeric_fields (tuple): Fields with sorted-array range indexes.
+        alpha (float): Weight of the dense score.
+        num_candidates (int): Candidates taken from each of the dense and lexical sides before fusion.
+        cache (RetrievalCache): Optional cache for query embeddings and results, e.g. `cache.default_cache`.
+        version (str): Version of `etf_data` and `index`, part of every cached result key, so a
+            search still running on old data never stores IDs that newer data would resolve.
+    """
+
+    def __init__(self, etf_data, encode_fn, index=None, embeddings=None, metric='ip', text_fields=TEXT_FIELDS,
+                 categorical_fields=CATEGORICAL_FIELDS, numeric_fields=NUMERIC_FIELDS, alpha=0.5, num_candidates=100, cache=None,
+                 version=None):
+        if index is None and embeddings is None:
+            raise ValueError("HybridRetriever needs either a FAISS index or an embedding matrix")
+        self.etf_data = etf_data
+        self.encode_fn = encode_fn
+        self.index = index
+        self.embeddings = embeddings
+        self.metric = metric
+        self.alpha = alpha
+        self.num_candidates = num_candidates
+        self.cache = cache
+        self.version = version
+
+        self.lexical = BM25Index([
+            " ".join(str(etf.get(field, "")) for field in text_fields) for etf in etf_data
+        ])
+        self.attributes = AttributeIndex(etf_data, categorical_fields, numeric_fields)
+
+    def dense_scores(self, query_embedding, mask, k):
+        """Top-k dense hits inside `mask` as (ids, similarity), higher similarity is better."""
+        if self.embeddings is not None:
+            candidates = np.flatnonzero(mask)
+            vectors = np.asarray(self.embeddings[candidates], dtype=np.float32)
+            if self.metric == 'ip':
+                scores = vectors @ query_embedding
+            else:
+                scores = -((vectors - query_embedding) ** 2).sum(1)
+            top = np.argsort(-scores, kind='stable')[:k]
+            return candidates[top], scores[top]
+
+        if mask.all():
+            distances, ids = self.index.search(query_embedding[None], k)
+        else:
+            distances, ids = search_with_mask(self.index, query_embedding[None], k, mask)
+        ids, distances = ids[0], distances[0]
+        found = ids >= 0
+        similarity = distances if self.index.metric_type == faiss.METRIC_INNER_PRODUCT else -distances
+        return ids[found], similarity[found]
+
+    def search(self, query, k=5, filters=None, parse_filters=True, query_embedding=None):
+        """
+        Retrieve the k best ETFs for `query`.
+
+        Args:
+            query (str): User text.
+            k (int): Number of results.
+            filters (dict): Explicit filters, see `AttributeIndex.mask`. Overrides parsing.
+            parse_filters (bool): Derive filters from the query text when `filters` is None.
+            query_embedding (np.ndarray): Precomputed embedding of `query`, skips `encode_fn`.
+
+        Returns:
+            tuple: (ids, scores) numpy arrays, best first.
+        """
+        if filters is None:
+            filters = self.attributes.parse_filters(query) if parse_filters else {}
+
+        if query_embedding is None:
+            if self.cache is not None:
+                query_embedding = self.cache.encode(query, self.encode_fn)
+            else:
+                query_embedding = self.encode_fn([query])[0]
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+
+        if self.cache is None:
+            return self._search(query, query_embedding, k, filters)
+        # BM25 depends on the text as well, normalize_query keeps its tokens intact
+        return self.cache.search(query_embedding, k, lambda: self._search(query, query_embedding, k, filters),
+                                 filters=filters, extra=normalize_query(query), version=self.version)
+
+    def _search(self, query, query_embedding, k, filters):
+        mask = self.attributes.mask(filters)
+        if not mask.any():
+            # over-constrained query, better to answer on semantics than with nothing
+            mask = np.ones_like(mask)
+
+        dense_ids, dense = self.dense_scores(query_embedding, mask, self.num_candidates)
+
+        bm25 = self.lexical.scores(query, mask)
+        lexical_ids = np.flatnonzero(bm25 > 0)
+        lexical_ids = lexical_ids[np.argsort(-bm25[lexical_ids], kind='stable')[:self.num_candidates]]
+
+        candidates = np.union1d(dense_ids, lexical_ids)
+        dense_full = np.full(len(candidates), dense.min() if len(dense) else 0., dtype=np.float32)
+        dense_full[np.searchsorted(candidates, dense_ids)] = dense
+
+        fused = self.alpha * _normalize(dense_full) + (1 - self.alpha) * _normalize(bm25[candidates])
+        top = np.argsort(-fused, kind='stable')[:k]
+        ids, scores = candidates[top], fused[top]
+        # results may be shared through the cache
+        ids.setflags(write=False)
+        scores.setflags(write=False)
+        return ids, scores
+
+    def search_records(self, query, k=5, **kwargs):
+        ids, _ = self.search(query, k, **kwargs)
+        return [self.etf_data[idx] for idx in ids]
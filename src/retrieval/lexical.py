@@ -0,0 +1,71 @@
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+class BM25Index:
+    """
+    Okapi BM25 over an inverted index of ETF text fields.
+
+    Postings are kept as (doc ids, term frequencies) numpy arrays per term, so a query
+    only touches the documents that contain one of its terms.
+
+    Args:
+        documents (list): Texts, one per ETF; position in the list is the document ID.
+        k1 (float): Term frequency saturation.
+        b (float): Length normalization.
+    """
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.num_docs = len(documents)
+
+        postings = defaultdict(list)
+        lengths = np.zeros(self.num_docs, dtype=np.float32)
+        for doc_id, text in enumerate(documents):
+            tokens = tokenize(text)
+            lengths[doc_id] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                postings[term].append((doc_id, tf))
+
+        self.postings = {
+            term: (np.array([d for d, _ in entries], dtype=np.int64), np.array([tf for _, tf in entries], dtype=np.float32))
+            for term, entries in postings.items()
+        }
+        avg_length = lengths.mean() if self.num_docs else 0.
+        self.length_norm = k1 * (1 - b + b * lengths / max(avg_length, 1e-9))
+
+    def idf(self, term):
+        df = len(self.postings[term][0])
+        return np.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+
+    def scores(self, query, mask=None):
+        """
+        BM25 score of every document for `query`.
+
+        Args:
+            query (str): Free text query.
+            mask (np.ndarray): Optional boolean array; documents outside it score 0.
+
+        Returns:
+            np.ndarray: float32 scores of shape (num_docs,).
+        """
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            doc_ids, tf = self.postings[term]
+            if mask is not None:
+                keep = mask[doc_ids]
+                doc_ids, tf = doc_ids[keep], tf[keep]
+            scores[doc_ids] += self.idf(term) * tf * (self.k1 + 1) / (tf + self.length_norm[doc_ids])
+        return scores
@@ -0,0 +1,90 @@
+import time
+
+import numpy as np
+import torch
+from sentence_transformers import CrossEncoder
+
+
+RERANK_MODEL = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+
+
+class CrossEncoderReranker:
+    """
+    Second-stage re-ranker scoring (query, ETF snippet) pairs with a small cross-encoder.
+
+    Candidates are scored in dense order, batch by batch, until the time budget runs out.
+    The batches that finished are re-ranked (the best dense candidates, so the scoring time
+    is never thrown away); only when not even one batch fits is the dense order kept. The
+    final list is cut deterministically: everything scoring at least `min_score`, but no
+    fewer than `min_results` and no more than `max_results`.
+
+    Args:
+        model_name (str): Hugging Face cross-encoder, the default MiniLM runs fine on CPU.
+        device (str): 'cpu' or 'cuda'.
+        batch_size (int): Pairs per forward pass.
+        time_budget (float): Seconds allowed for scoring, None for no limit.
+        min_score (float): Relevance cutoff on the cross-encoder logit.
+        min_results (int): Results returned even if they score below `min_score`.
+        max_results (int): Upper bound on returned results.
+        max_length (int): Truncation length of a pair.
+    """
+
+    def __init__(self, model_name=RERANK_MODEL, device='cpu', batch_size=16, time_budget=0.25, min_score=0.,
+                 min_results=3, max_results=8, max_length=512):
+        self.model = CrossEncoder(model_name, device=device, max_length=max_length)
+        self.batch_size = batch_size
+        self.time_budget = time_budget
+        self.min_score = min_score
+        self.min_results = min_results
+        self.max_results = max_results
+
+    def score(self, query, texts):
+        """
+        Cross-encoder scores of the leading `texts` that could be scored within the time budget.
+
+        The remaining time is checked before every batch against the slowest batch so far,
+        so the budget is not overrun by more than one batch in the worst case.
+        """
+        start = time.perf_counter()
+        slowest = 0.
+        scores = np.empty(len(texts), dtype=np.float32)
+        for i in range(0, len(texts), self.batch_size):
+            elapsed = time.perf_counter() - start
+            if self.time_budget is not None and elapsed + slowest > self.time_budget:
+                return scores[:i]
+            batch_start = time.perf_counter()
+            with torch.no_grad():
+                scores[i:i + self.batch_size] = self.model.predict(
+                    [(query, text) for text in texts[i:i + self.batch_size]],
+                    batch_size=self.batch_size, show_progress_bar=False,
+                )
+            slowest = max(slowest, time.perf_counter() - batch_start)
+        return scores
+
+    def cutoff(self, scores):
+        """Number of top results to keep for descending `scores`."""
+        keep = int(np.sum(scores >= self.min_score))
+        return max(self.min_results, min(keep, self.max_results))
+
+    def rerank(self, query, ids, texts):
+        """
+        Re-rank dense candidates.
+
+        Args:
+            query (str): User text.
+            ids (np.ndarray): Candidate IDs in dense order.
+            texts (list): Snippet of every candidate, aligned with `ids`.
+
+        Returns:
+            tuple: (ids, scores, reranked). Candidates the budget left unscored are dropped;
+            `scores` is None and `ids` keeps the dense order (cut to `min_results`) when
+            no batch could be scored.
+        """
+        ids = np.asarray(ids)
+        scores = self.score(query, texts)
+        if len(scores) == 0 and len(ids):
+            return ids[:self.min_results], None, False
+        order = np.argsort(-scores, kind='stable')
+        ids, scores = ids[:len(scores)][order], scores[order]
+        keep = self.cutoff(scores)
+        return ids[:keep], scores[:keep], True
@@ -0,0 +1,297 @@
+import argparse
+import json
+import os
+import pickle
+import threading
+from dataclasses import dataclass, field
+
+import numpy as np
+import faiss
+from sentence_transformers import SentenceTransformer
+
+from src.dataset.index_factory import configure_search
+from src.dataset.embedding_store import read_index_shared
+from src.dataset.context_blocks import render_snippet
+from src.dataset.incremental_index import check_positions
+from src.retrieval.cache import default_cache, index_version
+from src.retrieval.hybrid import HybridRetriever
+
+
+# the one data file / index / encoder triple every frontend retrieves against
+ETFS_PATH = "../../data/etf_data_v3_clean.json"
+INDEX_PATH = "../../data/etfs.index"
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'  # the encoder rag_index_modal.py builds etfs.index with
+# rag_index.py writes MultitaskLM vectors to its own etfs_multitask.index, which this service can't query
+
+
+@dataclass(frozen=True)
+class RetrievedETF:
+    id: int
+    ticker: str
+    bbg_ticker: str
+    name: str
+    description: str
+    score: float
+    record: dict = field(repr=False, compare=False)
+
+
+@dataclass(frozen=True)
+class RetrievalSnapshot:
+    """Data, index and the lexical/attribute indexes built from them, swapped as one object."""
+    version: str
+    etf_data: list
+    index: object
+    hybrid: HybridRetriever
+
+
+def load_etf_data(path):
+    """ETF records from a JSON list or a pickled list."""
+    if os.path.splitext(path)[1] == '.pickle':
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def search_vectors(index, embeddings, k):
+    """
+    One FAISS call for a whole batch of query vectors.
+
+    Returns:
+        tuple: (similarity, ids) arrays of shape (nq, k); higher similarity is better, missing hits have ID -1.
+    """
+    distances, ids = index.search(np.ascontiguousarray(embeddings, dtype=np.float32), k)
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return distances, ids
+    return -distances, ids
+
+
+def check_dimension(index, dimension, index_path=None):
+    """
+    Make sure query vectors of the encoder (`dimension`, None if unknown) fit `index`.
+
+    Raises:
+        ValueError: If the index was built with another encoder.
+    """
+    if dimension is not None and index.d != dimension:
+        raise ValueError(f"{index_path or 'Index'} holds {index.d}-d vectors, the encoder gives {dimension}-d ones; "
+                         f"it was built with another encoder")
+
+
+class Retriever:
+    """
+    ETF retrieval service: loads data, index and encoder once and answers batches of queries.
+
+    `search` takes many queries at a time. All of them go through the encoder in one batch.
+    Dense-only search (`hybrid=False`) is then a single FAISS call. Hybrid search runs BM25
+    and the attribute filters of `HybridRetriever` per query on the precomputed embeddings.
+    An optional re-ranker (`rerank.CrossEncoderReranker`) decides the final cut per query.
+
+    Data, index and the indexes derived from the data live in one `RetrievalSnapshot`;
+    `refresh` replaces it as a whole when the data file or the index is rewritten, so a
+    search never mixes IDs of a new index with records or filter masks of the old data.
+
+    Args:
+        etf_data (list): ETF records; position in the list is the index ID.
+        index (faiss.Index): Dense index over `etf_data`.
+        encode_fn (callable): Maps a list of texts to an (n, d) array.
+        cache (RetrievalCache): Cache for embeddings and hybrid results, None disables it.
+        reranker: Optional second stage with `rerank(query, ids, texts)`.
+        num_candidates (int): Hits per query handed to the re-ranker.
+        index_path (str): Where `index` was loaded from, enables `refresh`.
+        dimension (int): Output size of `encode_fn`, a reloaded index of another size is refused.
+        etfs_path (str): Where `etf_data` was loaded from, reloaded by `refresh` too.
+        nprobe (int): IVF lists visited per query, when reloading.
+        ef_search (int): HNSW candidate list size, when reloading.
+        **hybrid_kwargs: Forwarded to `HybridRetriever` (text/filter fields, alpha, ...).
+    """
+
+    def __init__(self, etf_data, index, encode_fn, cache=default_cache, reranker=None, num_candidates=30,
+                 index_path=None, nprobe=None, ef_search=None, etfs_path=None, dimension=None, **hybrid_kwargs):
+        self.encode_fn = encode_fn
+        self.dimension = dimension
+        self.cache = cache
+        self.reranker = reranker
+        self.num_candidates = num_candidates
+        self.index_path = index_path
+        self.etfs_path = etfs_path
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.hybrid_kwargs = hybrid_kwargs
+        self.lock = threading.Lock()
+        self.rejected = None
+        self.set_data(etf_data, index, self.disk_version())
+
+    @classmethod
+    def load(cls, etfs_path=ETFS_PATH, index_path=INDEX_PATH, encoder_name=EMBEDDING_MODEL, device=None,
+             nprobe=None, ef_search=None, **kwargs):
+        encoder = SentenceTransformer(encoder_name, device=device)
+        etf_data = load_etf_data(etfs_path)
+        index = configure_search(read_index_shared(index_path), nprobe=nprobe, ef_search=ef_search)
+        dimension = encoder.get_sentence_embedding_dimension()
+        # hits are resolved with etf_data[id], refuse an index built from another version of the data
+        check_positions(index, [etf.get('bbg_ticker') for etf in etf_data], index_path)
+        check_dimension(index, dimension, index_path)
+        return cls(etf_data, index, encoder.encode, index_path=index_path, etfs_path=etfs_path,
+                   nprobe=nprobe, ef_search=ef_search, dimension=dimension, **kwargs)
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    @property
+    def etf_data(self):
+        return self.snapshot.etf_data
+
+    @property
+    def index(self):
+        return self.snapshot.index
+
+    @property
+    def hybrid(self):
+        return self.snapshot.hybrid
+
+    def disk_version(self):
+        """`index_version` of the data file and index behind this retriever, None if not loaded from disk."""
+        if self.index_path is None:
+            return None
+        return index_version(*(path for path in (self.etfs_path, self.index_path) if path))
+
+    def set_data(self, etf_data, index, version=None):
+        """Swap data, index and the BM25/attribute indexes built from them in one step."""
+        hybrid = HybridRetriever(etf_data, self.encode_fn, index=index, cache=self.cache, version=version,
+                                 **self.hybrid_kwargs)
+        self.snapshot = RetrievalSnapshot(version, etf_data, index, hybrid)
+        if self.cache is not None and version is not None:
+            self.cache.validate(version)
+
+    def set_index(self, index):
+        self.set_data(self.etf_data, index, self.disk_version())
+
+    def refresh(self):
+        """
+        Reload data file and index if either was rewritten; cached results of the old ones are dropped.
+
+        A data file and index that disagree (e.g. one is rewritten, the other not yet), or an
+        index built with another encoder, are not swapped in; the old snapshot keeps serving.
+        """
+        if self.index_path is None:
+            return False
+        with self.lock:
+            version = self.disk_version()
+            if version in (self.version, self.rejected):
+                return False
+            etf_data = load_etf_data(self.etfs_path) if self.etfs_path else self.etf_data
+            index = configure_search(read_index_shared(self.index_path), nprobe=self.nprobe, ef_search=self.ef_search)
+            try:
+                check_positions(index, [etf.get('bbg_ticker') for etf in etf_data], self.index_path)
+                check_dimension(index, self.dimension, self.index_path)
+            except ValueError as error:
+                print(f"Keeping the loaded ETF index: {error}")
+                self.rejected = version
+                return False
+            self.set_data(etf_data, index, version)
+        return True
+
+    def encode(self, queries):
+        if self.cache is None:
+            return np.asarray(self.encode_fn(list(queries)), dtype=np.float32)
+        return self.cache.encode_many(list(queries), self.encode_fn)
+
+    def record(self, idx, score, etf_data=None):
+        etf = (self.etf_data if etf_data is None else etf_data)[idx]
+        return RetrievedETF(
+            id=int(idx),
+            ticker=etf.get('ticker'),
+            bbg_ticker=etf.get('bbg_ticker'),
+            name=etf.get('etf_name'),
+            description=etf.get('description'),
+            score=float(score),
+            record=etf,
+        )
+
+    def search(self, queries, k=5, hybrid=True, filters=None, embeddings=None, snapshot=None):
+        """
+        Retrieve for many queries at once.
+
+        Args:
+            queries (list): Query texts.
+            k (int): Results per query (before re-ranking, which may cut further).
+            hybrid (bool): BM25 + filters + dense per query; False is one batched dense FAISS call.
+            filters (dict): Explicit attribute filters for every query, parsed from the text when None.
+            embeddings (np.ndarray): Precomputed (n, d) query embeddings, skips the encoder.
+            snapshot (RetrievalSnapshot): Data and indexes to search, the current ones by default.
+
+        Returns:
+            list: One list of `RetrievedETF` per query, best first.
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        state = self.snapshot if snapshot is None else snapshot
+        if embeddings is None:
+            embeddings = self.encode(queries)
+        depth = self.num_candidates if self.reranker is not None else k
+
+        if hybrid:
+            hits = [state.hybrid.search(query, depth, filters=filters, query_embedding=embedding)
+                    for query, embedding in zip(queries, embeddings)]
+        else:
+            scores, ids = search_vectors(state.index, embeddings, depth)
+            hits = [(row_ids[row_ids >= 0], row_scores[row_ids >= 0]) for row_ids, row_scores in zip(ids, scores)]
+
+        results = []
+        for query, (ids, scores) in zip(queries, hits):
+            if self.reranker is not None:
+                texts = [render_snippet(state.etf_data[idx]) for idx in ids]
+                ids, rerank_scores, reranked = self.reranker.rerank(query, ids, texts)
+                scores = rerank_scores if reranked else scores[:len(ids)]
+            else:
+                ids, scores = ids[:k], scores[:k]
+            results.append([self.record(idx, score, state.etf_data) for idx, score in zip(ids, scores)])
+        return results
+
+    def search_one(self, query, k=5, **kwargs):
+        return self.search([query], k, **kwargs)[0]
+
+
+# loaded lazily, once per process
+_retriever = None
+
+
+def get_retriever(**kwargs):
+    global _retriever
+    if _retriever is None:
+        _retriever = Retriever.load(**kwargs)
+    return _retriever
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch ETF retrieval for a file of prompts")
+    parser.add_argument("prompts_file", help="JSON list of strings or of objects with a 'prompt' field")
+    parser.add_argument("output_file", help="Output JSON with the retrieved tickers per prompt")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--dense-only", action="store_true", help="Skip BM25 and filters, one FAISS call per batch")
+    parser.add_argument("--etfs-path", default=ETFS_PATH)
+    parser.add_argument("--index-path", default=INDEX_PATH)
+    args = parser.parse_args()
+
+    with open(args.prompts_file, 'r') as file:
+        prompts = [p['prompt'] if isinstance(p, dict) else p for p in json.load(file)]
+
+    retriever = Retriever.load(args.etfs_path, args.index_path)
+    output = []
+    for start in range(0, len(prompts), args.batch_size):
+        batch = prompts[start:start + args.batch_size]
+        for prompt, hits in zip(batch, retriever.search(batch, args.k, hybrid=not args.dense_only)):
+            output.append({'prompt': prompt, 'tickers': [hit.bbg_ticker for hit in hits],
+                           'scores': [hit.score for hit in hits]})
+
+    with open(args.output_file, 'w') as file:
+        json.dump(output, file, indent=4)
+    print(f"Retrieved for {len(prompts)} prompts, saved to {args.output_file}")
+
+
+if __name__ == '__main__':
+    main()
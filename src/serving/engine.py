@@ -0,0 +1,361 @@
+import argparse
+import atexit
+import queue
+import threading
+import time
+
+import torch
+
+from src.serving.kv import cache_tensors, left_pad, make_cache
+from src.serving.prefix_cache import PrefixCache
+
+
+class GenerationRequest:
+    """
+    Handle of one prompt submitted to a `GenerationEngine`.
+
+    Iterating it yields token ids as the engine decodes them; `result` blocks until the
+    request is finished and returns all generated ids.
+    """
+
+    def __init__(self, input_ids, max_new_tokens, do_sample, temperature, top_p, top_k, eos_token_id,
+                 prefix_length=None):
+        self.input_ids = input_ids
+        self.prefix_length = prefix_length
+        self.max_new_tokens = max_new_tokens
+        self.do_sample = do_sample
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.eos_token_id = eos_token_id
+        self.tokens = []
+        self.error = None
+        self.cancelled = False
+        self.submitted = time.perf_counter()
+        self.first_token_at = None
+        self.finished = threading.Event()
+        self.stream = queue.Queue()
+
+    def emit(self, token):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.tokens.append(token)
+        self.stream.put(token)
+
+    def finish(self, error=None):
+        self.error = error
+        self.finished.set()
+        self.stream.put(None)
+
+    def cancel(self):
+        """Stop decoding this request; the engine drops it from the batch at its next step."""
+        self.cancelled = True
+
+    @property
+    def done(self):
+        return (self.cancelled or len(self.tokens) >= self.max_new_tokens
+                or (self.tokens and self.tokens[-1] in self.eos_token_id))
+
+    def __iter__(self):
+        while True:
+            token = self.stream.get()
+            if token is None:
+                break
+            yield token
+        if self.error is not None:
+            raise self.error
+
+    def result(self, timeout=None):
+        if not self.finished.wait(timeout):
+            raise TimeoutError("Generation did not finish in time")
+        if self.error is not None:
+            raise self.error
+        return list(self.tokens)
+
+
+def sample_tokens(logits, temperature, top_k, top_p, greedy, generator=None):
+    """
+    Next token of every row, each row with its own sampling parameters.
+
+    Same filters as `generate`: temperature, then top-k, then top-p (nucleus, the most
+    likely token is always kept). Rows with `greedy` set take the argmax.
+
+    Args:
+        logits (torch.Tensor): (B, V) next-token logits.
+        temperature (torch.Tensor): (B,) temperatures.
+        top_k (torch.Tensor): (B,) top-k, 0 keeps the whole vocabulary.
+        top_p (torch.Tensor): (B,) nucleus mass.
+        greedy (torch.Tensor): (B,) bool.
+        generator (torch.Generator): Random stream of the engine.
+    """
+    logits = logits.float()
+    if bool(greedy.all()):
+        return logits.argmax(dim=-1)
+    scores, order = (logits / temperature[:, None]).sort(dim=-1, descending=True)
+    ranks = torch.arange(scores.shape[1], device=scores.device)[None]
+    top_k = torch.where(top_k > 0, top_k, scores.shape[1])
+    scores = scores.masked_fill(ranks >= top_k[:, None], float('-inf'))
+    probs = scores.softmax(dim=-1)
+    scores = scores.masked_fill(probs.cumsum(dim=-1) - probs >= top_p[:, None], float('-inf'))
+    choice = torch.multinomial(scores.softmax(dim=-1), 1, generator=generator)
+    return torch.where(greedy, logits.argmax(dim=-1), order.gather(1, choice).squeeze(1))
+
+
+class GenerationEngine:
+    """
+    Continuous-batching decoder shared by all chat sessions of a process.
+
+    Requests are queued by `submit` from any thread. A single worker thread owns the
+    model: it prefills every new prompt on its own, appends its KV cache to the running
+    batch (left-padded to a common length), and decodes one token for every running
+    request per forward pass. Finished requests leave the batch at the step they end,
+    so short answers never wait for long ones and new requests join without waiting
+    for the batch to drain. With a `PrefixCache`, prefill reuses the KV states of cached
+    prompt prefixes (system prompt, retrieved context) and only runs the rest.
+
+    Args:
+        model: Causal LM (`transformers` model, or a PEFT model wrapping one).
+        eos_token_id (int or list): Stop token(s), default of every request.
+        max_batch_size (int): Requests decoded together; the rest wait in the queue.
+        seed (int): Seed of the sampling stream.
+        prefix_cache (PrefixCache): Cached prompt prefixes of `model`, see prefix_cache.py.
+    """
+
+    def __init__(self, model, eos_token_id=None, max_batch_size=8, seed=None, prefix_cache=None):
+        self.model = model.eval()
+        self.prefix_cache = prefix_cache
+        self.device = next(model.parameters()).device
+        self.eos_token_id = eos_token_id
+        self.max_batch_size = max_batch_size
+        self.generator = torch.Generator(device=self.device)
+        if seed is not None:
+            self.generator.manual_seed(seed)
+        self.waiting = queue.Queue()
+        self.active = []
+        self.cache = None
+        self.mask = None
+        self.worker = None
+        self.running = False
+        self.counters = {'requests': 0, 'prefills': 0, 'steps': 0, 'tokens': 0}
+
+    def start(self):
+        if self.worker is None or not self.worker.is_alive():
+            self.running = True
+            self.worker = threading.Thread(target=self.run, name='generation-engine', daemon=True)
+            self.worker.start()
+            # a worker still inside torch at interpreter shutdown aborts the process
+            atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        if self.worker is None or not self.worker.is_alive():
+            return
+        self.running = False
+        self.waiting.put(None)
+        self.worker.join()
+        atexit.unregister(self.stop)
+
+    def submit(self, input_ids, max_new_tokens=200, do_sample=True, temperature=1., top_p=1., top_k=0,
+               eos_token_id=None, prefix_length=None):
+        """
+        Queue a prompt for generation.
+
+        Args:
+            input_ids (torch.Tensor or list): Prompt token ids, (T,) or (1, T).
+            max_new_tokens (int): Generation budget.
+            do_sample (bool): Sample with temperature/top-k/top-p, greedy otherwise.
+            temperature (float): Softmax temperature.
+            top_p (float): Nucleus mass.
+            top_k (int): Top-k filter, 0 to disable.
+            eos_token_id (int or list): Stop token(s), defaults to the engine's.
+            prefix_length (int): Leading prompt tokens shared with other requests (system prompt plus
+                retrieved context), kept in the prefix cache.
+
+        Returns:
+            GenerationRequest: Token stream and result of the request.
+        """
+        input_ids = torch.as_tensor(input_ids, dtype=torch.long).reshape(-1)
+        eos_token_id = self.eos_token_id if eos_token_id is None else eos_token_id
+        eos_token_id = set() if eos_token_id is None else set(torch.as_tensor(eos_token_id).reshape(-1).tolist())
+        request = GenerationRequest(input_ids, max_new_tokens, do_sample, temperature, top_p, top_k, eos_token_id,
+                                    prefix_length)
+        self.start()
+        self.waiting.put(request)
+        return request
+
+    def generate(self, input_ids, **params):
+        """`submit` and wait: the generated token ids of one prompt."""
+        return self.submit(input_ids, **params).result()
+
+    def stats(self):
+        steps = self.counters['steps']
+        stats = {**self.counters, 'running': len(self.active), 'waiting': self.waiting.qsize(),
+                 'mean_batch_size': self.counters['tokens'] / steps if steps else 0.}
+        if self.prefix_cache is not None:
+            stats['prefix_cache'] = self.prefix_cache.stats()
+        return stats
+
+    def run(self):
+        with torch.inference_mode():
+            while self.running:
+                try:
+                    self.admit()
+                    if self.active:
+                        self.step()
+                except Exception as error:
+                    # one bad batch must not take the server down: fail its requests and start over
+                    self.fail(error)
+            self.fail(RuntimeError("Generation engine stopped"))
+
+    def fail(self, error):
+        for request in self.active:
+            request.finish(error)
+        self.active, self.cache, self.mask = [], None, None
+
+    def admit(self):
+        """Prefill queued requests into the free batch slots, blocking only while nothing is running."""
+        while len(self.active) < self.max_batch_size:
+            try:
+                request = self.waiting.get(block=not self.active)
+            except queue.Empty:
+                return
+            if request is None:
+                return
+            if request.cancelled or request.max_new_tokens <= 0:
+                request.finish()
+                continue
+            self.counters['requests'] += 1
+            try:
+                self.prefill(request)
+            except Exception as error:
+                request.finish(error)
+
+    def prefill(self, request):
+        input_ids = request.input_ids.to(self.device)[None]
+        if self.prefix_cache is not None:
+            outputs = self.prefix_cache.prefill(request.input_ids, request.prefix_length)
+        else:
+            outputs = self.model(input_ids=input_ids, use_cache=True, output_hidden_states=False, return_dict=True)
+        self.counters['prefills'] += 1
+        token = self.sample(outputs.logits[:, -1], [request])[0]
+        request.emit(token)
+        if request.done:
+            request.finish()
+            return
+        self.join(cache_tensors(outputs.past_key_values), torch.ones_like(input_ids), request)
+
+    def join(self, tensors, mask, request):
+        """Add one prefilled sequence to the running batch."""
+        if self.cache is None:
+            self.cache, self.mask, self.active = tensors, mask, [request]
+            return
+        length = max(mask.shape[1], self.mask.shape[1])
+        running, running_mask = left_pad(self.cache, self.mask, length)
+        tensors, mask = left_pad(tensors, mask, length)
+        self.cache = [(torch.cat([keys, new_keys]), torch.cat([values, new_values]))
+                      for (keys, values), (new_keys, new_values) in zip(running, tensors)]
+        self.mask = torch.cat([running_mask, mask])
+        self.active.append(request)
+
+    def step(self):
+        """One decode step over the running batch, then drop the finished requests."""
+        input_ids = torch.tensor([[request.tokens[-1]] for request in self.active], device=self.device)
+        # positions count real tokens only, so left padding does not shift them
+        position_ids = self.mask.sum(dim=1, keepdim=True)
+        mask = torch.cat([self.mask, torch.ones_like(input_ids)], dim=1)
+        # MultitaskLM loads the body with output_hidden_states=True for its heads, decoding only needs logits
+        outputs = self.model(input_ids=input_ids, attention_mask=mask, position_ids=position_ids,
+                             past_key_values=make_cache(self.cache), use_cache=True,
+                             output_hidden_states=False, return_dict=True)
+        self.counters['steps'] += 1
+        self.counters['tokens'] += len(self.active)
+        self.cache, self.mask = cache_tensors(outputs.past_key_values), mask
+        for request, token in zip(self.active, self.sample(outputs.logits[:, -1], self.active)):
+            request.emit(token)
+
+        keep = [i for i, request in enumerate(self.active) if not request.done]
+        if len(keep) < len(self.active):
+            for request in self.active:
+                if request.done:
+                    request.finish()
+            self.evict(keep)
+
+    def evict(self, keep):
+        self.active = [self.active[i] for i in keep]
+        if not keep:
+            self.cache, self.mask = None, None
+            return
+        rows = torch.tensor(keep, device=self.device)
+        mask = self.mask[rows]
+        # columns that are padding for every remaining row are dropped
+        start = int((mask.sum(dim=0) > 0).nonzero()[0])
+        self.mask = mask[:, start:]
+        self.cache = [(keys[rows, :, start:], values[rows, :, start:]) for keys, values in self.cache]
+
+    def sample(self, logits, requests):
+        tensor = lambda values, dtype: torch.tensor(values, dtype=dtype, device=logits.device)
+        return sample_tokens(
+            logits,
+            tensor([max(request.temperature, 1e-5) for request in requests], torch.float),
+            tensor([request.top_k for request in requests], torch.long),
+            tensor([request.top_p for request in requests], torch.float),
+            tensor([not request.do_sample for request in requests], torch.bool),
+            generator=self.generator,
+        ).tolist()
+
+
+def stand_in_model(vocab_size=512, hidden_size=64, num_layers=2, seed=0):
+    """Small randomly initialized Qwen2-style causal LM (same architecture family as FinguAI-Chat) for CPU tests."""
+    from transformers import Qwen2Config, Qwen2ForCausalLM
+
+    torch.manual_seed(seed)
+    config = Qwen2Config(vocab_size=vocab_size, hidden_size=hidden_size, intermediate_size=2 * hidden_size,
+                         num_hidden_layers=num_layers, num_attention_heads=4, num_key_value_heads=2,
+                         max_position_embeddings=4096)
+    return Qwen2ForCausalLM(config).eval()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent requests through the engine vs one generate() at a time")
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--shared-prefix", type=int, default=0, help="Leading tokens all prompts share, e.g. a system prompt")
+    parser.add_argument("--prefix-cache", action="store_true", help="Pin the shared prefix in a PrefixCache")
+    parser.add_argument("--model", help="Hugging Face causal LM, defaults to a CPU stand-in")
+    args = parser.parse_args()
+
+    if args.model:
+        from transformers import AutoModelForCausalLM
+        model = AutoModelForCausalLM.from_pretrained(args.model)
+    else:
+        model = stand_in_model()
+    vocab_size = model.config.vocab_size
+    rng = torch.Generator().manual_seed(0)
+    prefix = torch.randint(vocab_size, (args.shared_prefix,), generator=rng)
+    prompts = [torch.cat([prefix, torch.randint(vocab_size, (int(length),), generator=rng)])
+               for length in torch.randint(16, 256, (args.requests,), generator=rng)]
+    params = {'max_new_tokens': args.max_new_tokens, 'do_sample': False}
+
+    start = time.perf_counter()
+    with torch.inference_mode():
+        sequential = [model.generate(prompt[None], **params)[0, len(prompt):].tolist()
+                      for prompt in prompts]
+    sequential_time = time.perf_counter() - start
+
+    prefix_cache = PrefixCache(model).pin(prefix) if args.prefix_cache and args.shared_prefix else None
+    engine = GenerationEngine(model, max_batch_size=args.max_batch_size, prefix_cache=prefix_cache).start()
+    start = time.perf_counter()
+    requests = [engine.submit(prompt, **params) for prompt in prompts]
+    batched = [request.result() for request in requests]
+    batched_time = time.perf_counter() - start
+
+    matching = sum(a == b for a, b in zip(sequential, batched))
+    print(f"sequential generate: {sequential_time:.2f}s, engine: {batched_time:.2f}s "
+          f"({sequential_time / batched_time:.1f}x), greedy outputs identical for {matching}/{len(prompts)}")
+    print(engine.stats())
+    engine.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import torch
+from transformers import DynamicCache
+
+
+def cache_tensors(past_key_values):
+    """Per-layer (keys, values) of a model's past_key_values, for the cache APIs of old and new transformers."""
+    if hasattr(past_key_values, 'layers'):
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    if hasattr(past_key_values, 'key_cache'):
+        return list(zip(past_key_values.key_cache, past_key_values.value_cache))
+    return [tuple(layer[:2]) for layer in past_key_values]
+
+
+def make_cache(tensors):
+    tensors = tuple((keys, values) for keys, values in tensors)
+    if hasattr(DynamicCache, 'from_legacy_cache'):
+        return DynamicCache.from_legacy_cache(tensors)
+    return DynamicCache(tensors)
+
+
+def left_pad(tensors, mask, length):
+    """Left-pad (batch, heads, seq, dim) cache tensors and their (batch, seq) mask to `length` positions."""
+    missing = length - mask.shape[1]
+    if not missing:
+        return tensors, mask
+    pad = lambda x: torch.nn.functional.pad(x, (0, 0, missing, 0))
+    return [(pad(keys), pad(values)) for keys, values in tensors], torch.nn.functional.pad(mask, (missing, 0))
@@ -0,0 +1,141 @@
+import threading
+from collections import OrderedDict
+
+import torch
+
+from src.serving.kv import cache_tensors, make_cache
+
+
+def common_prefix(a, b):
+    """Number of leading tokens two 1-D id tensors share."""
+    length = min(len(a), len(b))
+    mismatch = (a[:length] != b[:length]).nonzero()
+    return int(mismatch[0]) if len(mismatch) else length
+
+
+class PrefixCache:
+    """
+    KV states of prompt prefixes, computed once and reused by every request that starts with them.
+
+    Pinned prefixes (the constant system prompt) are kept for the lifetime of the process;
+    other prefixes (system prompt plus a retrieved ETF context) live in an LRU of `max_size`
+    entries. A prompt reuses the longest leading run of tokens it shares with any entry (the
+    KV states of a prefix do not depend on what follows it), so prefill only covers the rest.
+    Entries are shared, not copied: dynamic caches append by concatenation and never write
+    into the tensors they were built from. Keys include the active adapter, so one cache
+    serves a PEFT model whose adapter is switched.
+
+    Args:
+        model: Causal LM the states belong to.
+        max_size (int): Unpinned prefixes kept.
+    """
+
+    def __init__(self, model, max_size=16):
+        self.model = model
+        self.max_size = max_size
+        self.pinned = {}
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    def adapter(self):
+        return getattr(self.model, 'active_adapter', None)
+
+    def device(self):
+        return next(self.model.parameters()).device
+
+    def forward(self, input_ids, tensors=None):
+        """Run `input_ids` after the cached `tensors` (if any); the output's cache covers both."""
+        past_key_values = make_cache(tensors) if tensors is not None else None
+        with torch.inference_mode():
+            return self.model(input_ids=input_ids.to(self.device())[None], past_key_values=past_key_values,
+                              use_cache=True, output_hidden_states=False, return_dict=True)
+
+    def lookup(self, input_ids):
+        """
+        Longest cached run of leading tokens of `input_ids`.
+
+        Returns:
+            tuple: (length, per-layer (keys, values) cut to that length), (0, None) on a miss.
+        """
+        adapter = self.adapter()
+        with self.lock:
+            best, best_key, best_pinned = 0, None, False
+            for pinned, entries in ((True, self.pinned), (False, self.entries)):
+                for key, (ids, _) in entries.items():
+                    if key[0] == adapter:
+                        length = common_prefix(ids, input_ids)
+                        if length > best:
+                            best, best_key, best_pinned = length, key, pinned
+            if best_key is None:
+                self.misses += 1
+                return 0, None
+            self.hits += 1
+            self.reused_tokens += best
+            if not best_pinned:
+                self.entries.move_to_end(best_key)
+            _, tensors = (self.pinned if best_pinned else self.entries)[best_key]
+        return best, [(keys[:, :, :best], values[:, :, :best]) for keys, values in tensors]
+
+    def add(self, input_ids, tensors, pin=False):
+        key = (self.adapter(), tuple(input_ids.tolist()))
+        with self.lock:
+            if pin:
+                self.pinned[key] = (input_ids, tensors)
+                return
+            self.entries[key] = (input_ids, tensors)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def extend(self, input_ids, pin=False):
+        """KV states of `input_ids`, built on the longest cached prefix and stored for later requests."""
+        input_ids = torch.as_tensor(input_ids, dtype=torch.long).reshape(-1).cpu()
+        length, tensors = self.lookup(input_ids)
+        if length < len(input_ids):
+            tensors = cache_tensors(self.forward(input_ids[length:], tensors).past_key_values)
+        self.add(input_ids, tensors, pin=pin)
+        return tensors
+
+    def pin(self, input_ids):
+        """Cache a prefix for the lifetime of the process, e.g. the tokenized system prompt."""
+        self.extend(input_ids, pin=True)
+        return self
+
+    def prefill(self, input_ids, prefix_length=None):
+        """
+        Forward pass of a whole prompt, reusing cached prefix states.
+
+        Args:
+            input_ids (torch.Tensor): (T,) prompt.
+            prefix_length (int): Leading tokens worth caching for later requests (system
+                prompt plus retrieved context); they are added to the LRU if not cached yet.
+
+        Returns:
+            Model output whose logits cover the uncached suffix and whose past_key_values cover the prompt.
+        """
+        input_ids = torch.as_tensor(input_ids, dtype=torch.long).reshape(-1).cpu()
+        if prefix_length and prefix_length < len(input_ids):
+            length, tensors = prefix_length, self.extend(input_ids[:prefix_length])
+        else:
+            length, tensors = self.lookup(input_ids)
+        # the last prompt token is always run, its logits give the first generated token
+        length = min(length, len(input_ids) - 1)
+        if tensors is not None:
+            tensors = [(keys[:, :, :length], values[:, :, :length]) for keys, values in tensors]
+        return self.forward(input_ids[length:], tensors if length else None)
+
+    def past_key_values(self, input_ids):
+        """A fresh cache of the longest cached prefix of `input_ids` for `model.generate(input_ids, past_key_values=...)`."""
+        input_ids = torch.as_tensor(input_ids, dtype=torch.long).reshape(-1).cpu()
+        length, tensors = self.lookup(input_ids)
+        length = min(length, len(input_ids) - 1)
+        if not length:
+            return None
+        return make_cache([(keys[:, :, :length], values[:, :, :length]) for keys, values in tensors])
+
+    def stats(self):
+        return {'pinned': len(self.pinned), 'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'reused_tokens': self.reused_tokens}
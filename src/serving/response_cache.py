@@ -0,0 +1,142 @@
+import os
+import pickle
+import threading
+import time
+
+from src.optimization.result_cache import digest
+from src.retrieval.cache import LRUCache, freeze, index_version, normalize_query
+
+
+RESPONSE_TTL = 24 * 3600  # seconds
+
+
+def model_fingerprint(model, *weight_paths):
+    """
+    Identity of the weights behind an answer: base model name, active adapter and the
+    version of the weight files (a directory counts every file in it), so a retrained
+    or swapped adapter never serves the previous adapter's answers.
+    """
+    files = []
+    for path in weight_paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)))
+        else:
+            files.append(path)
+    config = getattr(model, 'config', None)
+    name = getattr(config, '_name_or_path', None) or type(model).__name__
+    return digest((name, getattr(model, 'active_adapter', None), index_version(*files)))
+
+
+class ResponseCache:
+    """
+    Deterministic (greedy) answers keyed by (model fingerprint, data version, normalized
+    prompt, retrieved tickers, generation options).
+
+    Only worth it for greedy decoding, where the same key always gives the same answer.
+    An in-memory LRU sits in front of an optional on-disk tier that survives restarts;
+    entries older than `ttl` are misses in both tiers and expired files are deleted.
+    Prompts are normalized like retrieval queries (case and whitespace), so trivial
+    retypes of a question share its answer.
+
+    Args:
+        max_size (int): Answers kept in memory.
+        ttl (float): Lifetime of an answer in seconds.
+        disk_dir (str): Directory of the disk tier, None keeps answers in memory only.
+    """
+
+    def __init__(self, max_size=1024, ttl=RESPONSE_TTL, disk_dir=None):
+        self.memory = LRUCache(max_size)
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.lock = threading.Lock()
+        if disk_dir:
+            self.prune()
+
+    def key(self, fingerprint, data_version, prompt, tickers=(), options=None):
+        return fingerprint, data_version, normalize_query(prompt), tuple(sorted(tickers)), freeze(options or {})
+
+    def fresh(self, created):
+        return time.time() - created <= self.ttl
+
+    def disk_path(self, key):
+        return os.path.join(self.disk_dir, digest(key) + '.pkl')
+
+    def read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self.disk_path(key)
+        try:
+            with open(path, 'rb') as file:
+                stored_key, created, value = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return None
+        if stored_key != key:
+            return None
+        if not self.fresh(created):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return created, value
+
+    def write_disk(self, key, created, value):
+        if not self.disk_dir:
+            return
+        path = self.disk_path(key)
+        os.makedirs(self.disk_dir, exist_ok=True)
+        partial = f"{path}.{os.getpid()}.partial"
+        with open(partial, 'wb') as file:
+            pickle.dump((key, created, value), file)
+        os.replace(partial, path)
+
+    def get(self, key):
+        """Cached answer for `key`, None on a miss."""
+        entry = self.memory.get(key)
+        stale = entry is not None and not self.fresh(entry[0])
+        if entry is None or stale:
+            entry = self.read_disk(key)
+            if entry is None:
+                with self.lock:
+                    self.misses += 1
+                    self.expired += stale
+                return None
+            with self.lock:
+                self.disk_hits += 1
+            self.memory.put(key, entry)
+        with self.lock:
+            self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        created = time.time()
+        self.memory.put(key, (created, value))
+        self.write_disk(key, created, value)
+
+    def prune(self):
+        """Delete expired and unreadable files of the disk tier."""
+        if not self.disk_dir or not os.path.isdir(self.disk_dir):
+            return
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            try:
+                with open(path, 'rb') as file:
+                    _, created, _ = pickle.load(file)
+                if self.fresh(created):
+                    continue
+            except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+                pass
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': self.memory.stats()['size'], 'hits': self.hits, 'disk_hits': self.disk_hits,
+                'misses': self.misses, 'expired': self.expired,
+                'hit_rate': self.hits / lookups if lookups else 0.}
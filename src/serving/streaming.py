@@ -0,0 +1,103 @@
+CHAT_MARKERS = ('<|im_start|>', '<|im_end|>')
+TURN_END = '\nuser'  # the model starting a new user turn ends the answer, as in the frontends' regex
+
+
+class IncrementalDecoder:
+    """
+    Text of a token stream, one delta per token.
+
+    Only the tokens since the last complete piece of text are re-decoded (with the
+    previous piece as context, so word boundaries come out the same as a full decode),
+    and nothing is released while the tail is an incomplete UTF-8 character.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.ids = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def push(self, token):
+        self.ids.append(token)
+        prefix = self.tokenizer.decode(self.ids[self.prefix_offset:self.read_offset])
+        text = self.tokenizer.decode(self.ids[self.prefix_offset:])
+        if text.endswith('\ufffd') or len(text) <= len(prefix):
+            return ''
+        self.prefix_offset, self.read_offset = self.read_offset, len(self.ids)
+        return text[len(prefix):]
+
+
+def partial_match(text, patterns):
+    """Length of the longest suffix of `text` that is a proper prefix of one of `patterns`."""
+    longest = 0
+    for pattern in patterns:
+        for size in range(min(len(pattern) - 1, len(text)), longest, -1):
+            if text.endswith(pattern[:size]):
+                longest = size
+                break
+    return longest
+
+
+class AnswerStream:
+    """
+    Assistant answer of a generation, growing as tokens arrive.
+
+    Streaming counterpart of the frontends' post-processing: chat markers are dropped and
+    the answer ends where the model opens a user turn. Text that could still turn into a
+    marker or a turn end is held back until the next tokens decide it.
+
+    Args:
+        tokenizer: Tokenizer of the model.
+        tokens (iterable): Generated token ids, e.g. a `GenerationRequest`.
+    """
+
+    def __init__(self, tokenizer, tokens):
+        self.decoder = IncrementalDecoder(tokenizer)
+        self.tokens = tokens
+        self.text = ''
+        self.pending = ''
+        self.ended = False
+
+    @property
+    def answer(self):
+        return self.text.strip()
+
+    def push(self, delta):
+        """Add decoded text; True if the visible answer changed."""
+        if self.ended:
+            return False
+        pending = self.pending + delta
+        for marker in CHAT_MARKERS:
+            pending = pending.replace(marker, '')
+        if TURN_END in pending:
+            self.text += pending[:pending.index(TURN_END)]
+            self.pending, self.ended = '', True
+            return True
+        held = partial_match(pending, CHAT_MARKERS + (TURN_END,))
+        released = pending[:len(pending) - held]
+        self.text, self.pending = self.text + released, pending[len(pending) - held:]
+        return bool(released.strip())
+
+    def __iter__(self):
+        """Yields the answer so far every time it changes, the complete answer last."""
+        for token in self.tokens:
+            if self.push(self.decoder.push(token)):
+                yield self.answer
+            if self.ended:
+                break
+        if not self.ended:
+            self.text, self.pending = self.text + self.pending, ''
+        yield self.answer
+
+
+def stream_answer(tokenizer, request):
+    """
+    Partial answers of an engine request for a streaming UI callback.
+
+    The request is cancelled when the consumer stops early (e.g. the browser disconnects),
+    so its batch slot is freed instead of decoding to `max_new_tokens`.
+    """
+    try:
+        yield from AnswerStream(tokenizer, request)
+    finally:
+        request.cancel()
@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class StageTimer:
+    """
+    Start and end of every stage of one request, relative to its arrival.
+
+    Stages may run concurrently (e.g. portfolio optimization next to generation), so
+    the summary lists intervals on the request's timeline rather than durations that
+    add up to the total.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def mark(self, name, start, end=None):
+        """Record a stage from `perf_counter` timestamps, `end` defaults to now."""
+        end = time.perf_counter() if end is None else end
+        with self.lock:
+            self.stages[name] = (start - self.origin, end - self.origin)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.mark(name, start)
+
+    def timed(self, name, fn):
+        """`fn` wrapped to record its run as stage `name`, for work handed to a thread pool."""
+        def run(*args, **kwargs):
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        return run
+
+    def total(self):
+        return max((end for _, end in self.stages.values()), default=0.)
+
+    def summary(self):
+        stages = sorted(self.stages.items(), key=lambda item: item[1])
+        timeline = ' | '.join(f"{name} {start * 1e3:.0f}-{end * 1e3:.0f}ms" for name, (start, end) in stages)
+        return f"{timeline} | total {self.total() * 1e3:.0f}ms"
+
+
+class LatencyStats:
+    """
+    Duration percentiles per stage over the last `window` requests.
+
+    Args:
+        window (int): Requests kept per stage.
+    """
+
+    def __init__(self, window=1000):
+        self.durations = defaultdict(lambda: deque(maxlen=window))
+        self.lock = threading.Lock()
+
+    def add(self, timer):
+        with self.lock:
+            for name, (start, end) in timer.stages.items():
+                self.durations[name].append(end - start)
+            self.durations['total'].append(timer.total())
+
+    def stats(self):
+        with self.lock:
+            return {name: {'count': len(values),
+                           'p50_ms': float(np.percentile(values, 50)) * 1e3,
+                           'p95_ms': float(np.percentile(values, 95)) * 1e3}
+                    for name, values in self.durations.items()}
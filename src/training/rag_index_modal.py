@@ -8,7 +8,12 @@ import faiss
 import numpy as np
 import torch
 from torch import nn
+import os
 
+from src.dataset.index_factory import build_index
+from src.dataset.embedding_store import write_store, write_index
+from src.dataset.sharded_embedding import sharded_embed
+from src.dataset.incremental_index import MANIFEST_SUFFIX
 # from src.models.multitask import MultitaskLM
 
 
@@ -16,9 +21,14 @@ ETFS_PATH = "../../data/etf_data_v3_clean.json"
 INDEX_PATH = "../../data/etfs.index"
 MODEL_NAME = 'FINGU-AI/FinguAI-Chat-v1'
 LORA_PATH = '../pipeline/fine_tuned_model/FINGU-AI/FinguAI-Chat-v1'
-EMBEDDINGS_PATH = 'etf_embeddings.pth'
+EMBEDDINGS_PATH = 'etf_embeddings.npy'
 BATCH_SIZE = 30
-GLOBAL_LIMIT = 100
+GLOBAL_LIMIT = None  # sharded run makes the full universe practical on CPU
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+NUM_WORKERS = os.cpu_count()  # 1 keeps the single-process loop
+SHARD_DIR = 'etf_embedding_shards'  # partial outputs, a rerun resumes from here
+INDEX_TYPE = 'flat'  # 'flat', 'ivf_flat', 'hnsw' or 'ivf_pq'
+METRIC = 'l2'
 
 def form(etf):
     top_sectors = {
@@ -75,17 +85,35 @@ The ETF's ticker is {etf['ticker']} ({etf['bbg_ticker']}), known as the {etf['et
 - **Inception Date**: {etf['inception_date']}"""
 
 
-def main(etfs_path, index_path, model_name, lora_path, batch_size, global_limit, embeddings_path):
+def main(etfs_path, index_path, model_name, lora_path, batch_size, global_limit, embeddings_path,
+         index_type='flat', metric='l2', num_workers=1, shard_dir=SHARD_DIR):
     with open(ETFS_PATH, 'r') as file:
         etf_data = json.load(file)
 
-    embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+    descriptions = [form(etf) for etf in etf_data][:global_limit]
+    tickers = [etf['bbg_ticker'] for etf in etf_data][:global_limit]
+
+    if num_workers > 1:
+        embeddings = sharded_embed(descriptions, EMBEDDING_MODEL, shard_dir, num_workers=num_workers,
+                                   batch_size=batch_size)
+    else:
+        embeddings = embed(descriptions)
+
+    index = build_index(embeddings, index_type, metric=metric)
+    print(embeddings.shape)
+    write_store(EMBEDDINGS_PATH, embeddings, tickers)
+    write_index(index, INDEX_PATH)
+    # IDs are positions in etf_data, a manifest left next to the index by an incremental build would contradict them
+    if os.path.exists(INDEX_PATH + MANIFEST_SUFFIX):
+        os.remove(INDEX_PATH + MANIFEST_SUFFIX)
+
+
+def embed(descriptions):
+    embedding_model = SentenceTransformer(EMBEDDING_MODEL)
 
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     embedding_model.to(device)
 
-    descriptions = [form(etf) for etf in etf_data][:GLOBAL_LIMIT]
-
     # Prepare descriptions
     num_batches = len(descriptions) // BATCH_SIZE + int(len(descriptions) % BATCH_SIZE != 0)
     
@@ -100,17 +128,9 @@ def main(etfs_path, index_path, model_name, lora_path, batch_size, global_limit,
         all_embeddings.append(embeddings)
 
     # Concatenate all embeddings
-    embeddings = np.vstack(all_embeddings)
+    return np.vstack(all_embeddings)
     # Split code END
 
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(embeddings)
-    from faiss import write_index, read_index
-    print(embeddings.shape)
-    torch.save(embeddings, EMBEDDINGS_PATH)
-    write_index(index, INDEX_PATH)
-
 
 if __name__ == '__main__':
     main(
@@ -120,4 +140,7 @@ if __name__ == '__main__':
         lora_path=LORA_PATH,
         embeddings_path=EMBEDDINGS_PATH,
         batch_size=BATCH_SIZE,
-        global_limit=GLOBAL_LIMIT)
+        global_limit=GLOBAL_LIMIT,
+        index_type=INDEX_TYPE,
+        metric=METRIC,
+        num_workers=NUM_WORKERS)